@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+Benchmark the hot paths of jvp on synthetic lexicons of every size in
+--sizes, crossed with all the forms of Japanese_verb_form.jvp.
+
+Run: python bench_jvp.py --output bench.json --baseline bench_baseline.json
+
+The results are seconds per call. They are compared against the baseline,
+and the per call time of a hot path at the largest size against the
+smallest size is checked, so a path that stops scaling fails even on a
+machine of different speed. Exit code 1 on a regression.
+'''
+
+from __future__ import print_function
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import jvp
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+default_sizes = [100, 1000, 10000, 100000]
+
+# hot paths whose time per call should not grow with the lexicon
+flat_paths = ['get_right_answer', 'sample_verb', 'record',
+              'find_verb_in_practice_history']
+
+kana = 'かきくけこさしすせそたちつてとなにぬねのはひふへほまみむめもらりれろ'
+godan_endings = ['う', 'く', 'ぐ', 'す', 'つ', 'ぬ', 'ぶ', 'む', 'る']
+ichidan_endings = ['べる', 'める', 'える', 'ける', 'せる', 'てる']
+
+
+def synthetic_lexicon(size):
+    '''
+    Return size distinct (verb_base, verb_kanji) of godan and ichidan
+    verbs, every fifth one without kanji
+    '''
+    endings = godan_endings + ichidan_endings
+    verbs = []
+    prefixes = itertools.chain.from_iterable(
+        itertools.product(kana, repeat=length) for length in itertools.count(1))
+    for i, prefix in enumerate(prefixes):
+        if len(verbs) >= size:
+            break
+        ending = endings[i % len(endings)]
+        verb_base = ''.join(prefix) + ending
+        if i % 5 == 4:
+            verb_kanji = 'None'
+        else:
+            verb_kanji = chr(0x4e00 + i % 20000) + ending
+        verbs.append((verb_base, verb_kanji))
+    return verbs
+
+
+def per_call(function, calls):
+    '''
+    Seconds per call of function(i), i from 0 to calls - 1
+    '''
+    start = time.perf_counter()
+    for i in range(calls):
+        function(i)
+    return (time.perf_counter() - start) / calls
+
+
+def bench_size(size, calls):
+    '''
+    Benchmark the hot paths of one lexicon size in a temporary directory
+    '''
+    results = {}
+    temp_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        with open(os.path.join(temp_dir, 'Japanese_verb_base.jvp'), 'w',
+                  encoding='utf-8') as f:
+            for verb_base, verb_kanji in synthetic_lexicon(size):
+                f.write(''.join([verb_base, '\t', verb_kanji, '\n']))
+        shutil.copy(os.path.join(script_dir, 'Japanese_verb_form.jvp'), temp_dir)
+        os.chdir(temp_dir)
+        rng = random.Random(size)
+
+        start = time.perf_counter()
+        practice = jvp.Practice()
+        results['new_practice_history'] = time.perf_counter() - start
+        practice.close()
+        start = time.perf_counter()
+        practice = jvp.Practice()
+        results['load_practice_history'] = time.perf_counter() - start
+
+        rows = len(practice.practice_history)
+        verbs = []
+        for i in range(calls):
+            index = rng.randrange(rows)
+            verbs.append(jvp.Verb(*practice.practice_history.row(
+                index, jvp.history_columns[:3])))
+            verbs[-1].error_flag = rng.random() < 0.3
+
+        jvp.conjugation_cache.clear()
+        results['get_right_answer'] = per_call(
+            lambda i: verbs[i].get_right_answer(), calls)
+        results['sample_verb'] = per_call(lambda i: practice.sample_verb(), calls)
+        results['find_verb_in_practice_history'] = per_call(
+            lambda i: practice.find_verb_in_practice_history(verbs[i]), calls)
+        results['record'] = per_call(lambda i: practice.record(verbs[i]), calls)
+        practice.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_dir)
+    return results
+
+
+def run_benchmarks(sizes, calls):
+    # the lazy imports are paid before the first size is timed
+    bench_size(min(sizes), calls)
+    results = {}
+    for size in sizes:
+        results[str(size)] = bench_size(size, calls)
+    return {'python': platform.python_version(),
+            'forms': len(read_forms()),
+            'calls': calls,
+            'results': results}
+
+
+def read_forms():
+    with open(os.path.join(script_dir, 'Japanese_verb_form.jvp'),
+              encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def compare(report, baseline, tolerance, max_growth):
+    '''
+    Return the regressions of report: paths slower than tolerance times the
+    baseline, and flat paths growing more than max_growth times from the
+    smallest to the largest size
+    '''
+    regressions = []
+    for size, results in report['results'].items():
+        for path, seconds in sorted(results.items()):
+            base = baseline.get('results', {}).get(size, {}).get(path)
+            if base and seconds > base * tolerance:
+                regressions.append(''.join([
+                    path, ' at ', size, ' verbs: ', '%.3g' % seconds,
+                    's against baseline ', '%.3g' % base, 's']))
+    sizes = sorted(report['results'], key=int)
+    if len(sizes) > 1:
+        smallest = report['results'][sizes[0]]
+        largest = report['results'][sizes[-1]]
+        for path in flat_paths:
+            growth = largest[path] / smallest[path]
+            if growth > max_growth:
+                regressions.append(''.join([
+                    path, ' grows ', '%.1f' % growth, ' times from ',
+                    sizes[0], ' to ', sizes[-1], ' verbs']))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of jvp')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes,
+                        help='numbers of verbs of the synthetic lexicons')
+    parser.add_argument('--calls', type=int, default=1000,
+                        help='calls timed for each hot path')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+                        help='slowdown against the baseline taken as a regression')
+    parser.add_argument('--max-growth', type=float, default=10.0,
+                        help='growth of a flat hot path from the smallest to '
+                             'the largest size taken as a regression')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.sizes, args.calls)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance, args.max_growth)
+    for regression in regressions:
+        print('Regression: ' + regression, file=sys.stderr)
+    sys.exit(1 if regressions else 0)
@@ -3,13 +3,43 @@
 
 from __future__ import print_function
 import os
+import sys
+import time
 from sys import version_info
-import numpy as np
-import pandas as pd
 import random
-import csv
+import array
+import itertools
+import heapq
+from collections import OrderedDict, deque, namedtuple
 
-hiragana_array = np.array([
+
+class LazyModule(object):
+    '''
+    Class LazyModule
+    Stand-in for a module that is imported on first attribute access,
+    numpy and pandas are only paid for by the features that use them
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            __import__(self.name)
+            self.module = sys.modules[self.name]
+        return getattr(self.module, attribute)
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+csv = LazyModule('csv')
+hashlib = LazyModule('hashlib')
+inspect = LazyModule('inspect')
+json = LazyModule('json')
+shutil = LazyModule('shutil')
+sqlite3 = LazyModule('sqlite3')
+struct = LazyModule('struct')
+
+hiragana_rows = [
     ['あ', 'い', 'う', 'え', 'お'],
     ['か', 'き', 'く', 'け', 'こ'],
     ['さ', 'し', 'す', 'せ', 'そ'],
@@ -25,14 +55,58 @@ hiragana_array = np.array([
     ['だ', 'ぢ', 'づ', 'で', 'ど'],
     ['ば', 'び', 'ぶ', 'べ', 'ぼ'],
     ['ぱ', 'ぴ', 'ぷ', 'ぺ', 'ぽ']
-])
-
-hiragana_table = pd.DataFrame(hiragana_array, 
-                index=['a', 'k', 's', 't', 'n', 'h', 'm', 'y', 'r', 'w', 'g', 'z', 'd', 'b', 'p'], 
-                columns=['a', 'i', 'u', 'e', 'o'])
+]
+consonant_labels = ['a', 'k', 's', 't', 'n', 'h', 'm', 'y', 'r', 'w', 'g', 'z', 'd', 'b', 'p']
+vowel_labels = ['a', 'i', 'u', 'e', 'o']
 
 speacial_v1 = ('帰る', '滑る', '入る', '切る', '知る', '要る', '走る', '減る')
 
+# offset between a hiragana and the katakana of the same sound
+katakana_offset = ord('ア') - ord('あ')
+
+
+def build_kana_index():
+    '''
+    Build the kana lookup tables from hiragana_rows
+    kana_index: kana -> (consonant, vowel), both hiragana and katakana
+    kana_lookup: (consonant, vowel, is_katakana) -> kana
+    The ambiguous い, う, え of the y and w rows belong to the a row
+    '''
+    kana_index = {}
+    kana_lookup = {}
+    for consonant, row in zip(consonant_labels, hiragana_rows):
+        for vowel, hiragana in zip(vowel_labels, row):
+            katakana = chr(ord(hiragana) + katakana_offset)
+            kana_index.setdefault(hiragana, (consonant, vowel))
+            kana_index.setdefault(katakana, (consonant, vowel))
+            kana_lookup[(consonant, vowel, False)] = hiragana
+            kana_lookup[(consonant, vowel, True)] = katakana
+    return kana_index, kana_lookup
+
+kana_index, kana_lookup = build_kana_index()
+
+vowel_kana = dict(zip(vowel_labels, hiragana_rows[0]))
+
+
+def __getattr__(name):
+    '''
+    Build the numpy and pandas kana tables when they are asked for
+    '''
+    if name == 'hiragana_array':
+        return np.array(hiragana_rows)
+    if name == 'hiragana_table':
+        return pd.DataFrame(hiragana_rows, index=consonant_labels,
+                            columns=vowel_labels)
+    raise AttributeError(''.join(['module ', __name__, ' has no attribute ', name]))
+
+
+def is_katakana(kana):
+    '''
+    Whether the kana is a katakana
+    '''
+    return 'ァ' <= kana <= 'ヶ'
+
+
 class Hiragana(object):
     '''
     Class hiranaga
@@ -46,58 +120,98 @@ class Hiragana(object):
         '''
         Get the vowel of the hiragana
         '''
-        self.vowel = None
-        if self.hiragana in list(hiragana_table['a']):
-            self.vowel = 'あ'
-        if self.hiragana in list(hiragana_table['i']):
-            self.vowel = 'い'
-        if self.hiragana in list(hiragana_table['u']):
-            self.vowel = 'う'
-        if self.hiragana in list(hiragana_table['e']):
-            self.vowel = 'え'
-        if self.hiragana in list(hiragana_table['o']):
-            self.vowel = 'お'
-        if self.vowel == None:
+        position = kana_index.get(self.hiragana)
+        if position is None:
+            self.vowel = None
             errormessage = ''.join(['hiragana: ', self.hiragana, ' not found!'])
             raise ValueError(errormessage)
+        self.vowel = vowel_kana[position[1]]
 
     def get_consonant(self):
-        self.consonant = None
-        if self.hiragana in ('い', 'う', 'え'):
-            self.consonant = 'a'
-        else:
-            for index in hiragana_table.index.values:
-                if self.hiragana in list(hiragana_table.loc[index, :]):
-                    self.consonant = index
-        if self.consonant == None:
+        position = kana_index.get(self.hiragana)
+        if position is None:
+            self.consonant = None
             raise ValueError('Something wrong')
-            #self.consonant = 'a'
+        self.consonant = position[0]
 
     def change_vowel(self, vowel):
         self.get_consonant()
-        self.hiragana = hiragana_table.loc[self.consonant, vowel]
+        self.hiragana = kana_lookup[(self.consonant, vowel,
+                                     is_katakana(self.hiragana))]
+
+
+class InternTable(object):
+    '''
+    Class InternTable
+    Gives every distinct value an integer id. The values, with their
+    strings interned, are kept once and shared by all their users
+    '''
+    def __init__(self):
+        self.values = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, value_id):
+        return self.values[value_id]
+
+    def id_of(self, value):
+        '''
+        Return the id of value, give it the next id if it is new
+        '''
+        value_id = self.ids.get(value)
+        if value_id is None:
+            if isinstance(value, tuple):
+                value = tuple(sys.intern(item) if isinstance(item, str) else item
+                              for item in value)
+            elif isinstance(value, str):
+                value = sys.intern(value)
+            value_id = len(self.values)
+            self.values.append(value)
+            self.ids[value] = value_id
+        return value_id
+
+# (verb_base, verb_kanji) and verb_form of every verb created, by id
+verb_table = InternTable()
+form_table = InternTable()
 
 
 class Verb(object):
     '''
     Class Verb
+    A quiz of a verb in a form. The verb and the form are ids into
+    verb_table and form_table, and right_answer is a tuple shared with
+    the conjugation cache, so a Verb holds no strings of its own
     '''
+    __slots__ = ('verb_id', 'form_id', 'level', 'verb_type', 'right_answer',
+                 'error_flag', 'near_miss', 'user_answer')
+
     def __init__(self, verb_base, verb_kanji, verb_form):
         self.level = None
-        self.verb_base = verb_base
-        self.verb_form = verb_form
-        if verb_kanji == 'None':
-            self.verb_kanji = None
-        else:
-            self.verb_kanji = verb_kanji
+        self.verb_id = verb_table.id_of((verb_base, normalize_kanji(verb_kanji)))
+        self.form_id = form_table.id_of(verb_form)
         self.verb_type = None
-        self.right_answer = []
+        self.right_answer = ()
         self.error_flag = False
+        self.near_miss = False
         self.user_answer = None
-        if self.verb_kanji != None and isinstance(self.verb_kanji, str):
-            self.has_kanji = True
-        else:
-            self.has_kanji = False
+
+    @property
+    def verb_base(self):
+        return verb_table[self.verb_id][0]
+
+    @property
+    def verb_kanji(self):
+        return verb_table[self.verb_id][1]
+
+    @property
+    def verb_form(self):
+        return form_table[self.form_id]
+
+    @property
+    def has_kanji(self):
+        return verb_table[self.verb_id][1] is not None
 
     def __str__(self):
         '''
@@ -109,389 +223,31 @@ class Verb(object):
             verb_content = self.verb_kanji + ' (' + self.verb_base + ')'
         else:
             verb_content = self.verb_base
-        right_answer = '[]'
-        if self.right_answer != None:
-            right_answer = '['
-            for i, answer in enumerate(self.right_answer):
-                if i == 0:
-                    right_answer = ' '.join([right_answer, answer])
-                else:
-                    right_answer = ' '.join([right_answer, 'or', answer])
-            right_answer = ''.join([right_answer, ']'])
         message = ''.join(['verb: ', verb_content, \
                            ', required form: ', self.verb_form, \
-                           ', right answer: ', right_answer])
+                           ', right answer: ', format_answers(self.right_answer)])
         return message
 
     def get_right_answer(self):
         '''
-        Get the right_answer according to the base and form
+        Get the right_answer according to the base and form,
+        from the conjugation cache if it has been worked out before
         '''
-        self.get_verb_type()
-        if self.verb_form == 'ます':
-            self.turn_to_masu()
-            return
-        if self.verb_form == 'て':
-            self.turn_to_te()
+        key = (self.verb_base, self.verb_kanji, self.verb_form)
+        cached = conjugation_cache.get(key)
+        if cached is not None:
+            self.verb_type, self.right_answer = cached
             return
-        if self.verb_form == 'た':
-            self.turn_to_ta()
-            return
-        if self.verb_form == 'ない':
-            self.turn_to_nai()
-            return
-        if self.verb_form == '意志':
-            self.turn_to_yizhi()
-            return
-        if self.verb_form == '命令':
-            self.turn_to_mingling()
-            return
-        if self.verb_form == '假定':
-            self.turn_to_jiading()
-            return
-        if self.verb_form == '可能':
-            self.turn_to_keneng()
-            return
-        if self.verb_form == '使役':
-            self.turn_to_shiyi()
-            return
-        if self.verb_form == '被动':
-            self.turn_to_beidong()
-            return
-        if self.verb_form == '使役被动':
-            self.turn_to_shiyibeidong()
-            return
-        raise ValueError('Unsupported form')
+        self.calc_right_answer()
+        conjugation_cache.put(key, (self.verb_type, self.right_answer))
 
-    def turn_to_masu(self):
-        '''
-        Turn a verb into ます形 (masu type)
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('i')
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'ます'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'ます'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'ます'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'ます'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            last_second_hira = self.verb_base[-2:-1]
-            hira = Hiragana(last_second_hira)
-            hira.change_vowel('i')
-            hira_answer = hira.hiragana + 'ます'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1]+ 'ます'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-
-    def turn_to_te(self):
-        '''
-        Turn the verb into て形 (te type)
-        '''
-        if self.verb_type == 1:
-            append_item = ''
-            if self.verb_base[-1:] in ('う', 'つ', 'る'):
-                append_item = 'って'
-            if self.verb_base[-1:] in ('ぶ', 'む', 'ぬ'):
-                append_item = 'んで'
-            if self.verb_base[-1:] == 'く':
-                append_item = 'いて'
-            if self.verb_base[-1:] == 'ぐ':
-                append_item = 'いで'
-            if self.verb_base[-1:] == 'す':
-                append_item = 'して'
-
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + append_item
-                if self.verb_kanji == '行く':
-                    kanji_answer = '行って'
-                self.right_answer.append(kanji_answer)
-            hira_answer = self.verb_base[0:-1] + append_item
-            if self.verb_base == 'いく':
-                hira_answer = 'いって'
-            self.right_answer.append(hira_answer)
-
-        if self.verb_type == 2:
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'て'
-                self.right_answer.append(kanji_answer)
-            hira_answer = self.verb_base[0:-1] + 'て'
-            self.right_answer.append(hira_answer)
-
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来て')
-                self.right_answer.append('きて')
-            if self.verb_base == 'する':
-                self.right_answer.append('して')
-
-    def turn_to_ta(self):
-        '''
-        Turn a verb into た形 (ta type)
-        '''
-        if self.verb_type == 1:
-            append_item = ''
-            if self.verb_base[-1:] in ('う', 'つ', 'る'):
-                append_item = 'った'
-            if self.verb_base[-1:] in ('ぶ', 'む', 'ぬ'):
-                append_item = 'んだ'
-            if self.verb_base[-1:] == 'く':
-                append_item = 'いた'
-            if self.verb_base[-1:] == 'ぐ':
-                append_item = 'いだ'
-            if self.verb_base[-1:] == 'す':
-                append_item = 'した'
-
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + append_item
-                if self.verb_kanji == '行く':
-                    kanji_answer = '行った'
-                self.right_answer.append(kanji_answer)
-            hira_answer = self.verb_base[0:-1] + append_item
-            if self.verb_base == 'いく':
-                hira_answer = 'いった'
-            self.right_answer.append(hira_answer)
-
-        if self.verb_type == 2:
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'た'
-                self.right_answer.append(kanji_answer)
-            hira_answer = self.verb_base[0:-1] + 'た'
-            self.right_answer.append(hira_answer)
-
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来た')
-                self.right_answer.append('きた')
-            if self.verb_base == 'する':
-                self.right_answer.append('した')
-
-    def turn_to_nai(self):
-        '''
-        Turn a verb into ない形 (nai type)
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('a')
-            if hira.hiragana == 'あ':
-                hira.hiragana = 'わ'
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'ない'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'ない'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-            # special verb: ある
-            if self.verb_base == 'ある':
-                self.right_answer = ['ない']
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'ない'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'ない'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来ない')
-                self.right_answer.append('こない')
-            if self.verb_base == 'する':
-                self.right_answer.append('しない')
-
-    def turn_to_mingling(self):
-        '''
-        Turn a verb into 命令形
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('e')
-            hira_answer = self.verb_base[0:-1] + hira.hiragana
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'ろ'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'ろ'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来い')
-                self.right_answer.append('こい')
-            if self.verb_base == 'する':
-                self.right_answer.append('しろ')
-
-    def turn_to_yizhi(self):
-        '''
-        Turn a verb into 意志形
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('o')
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'う'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'う'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'よう'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'よう'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来よう')
-                self.right_answer.append('こよう')
-            if self.verb_base == 'する':
-                self.right_answer.append('しよう')
-
-    def turn_to_keneng(self):
-        '''
-        Turn a verb into 可能态
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('e')
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'る'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'る'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'られる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'られる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来られる')
-                self.right_answer.append('こられる')
-            if self.verb_base == 'する':
-                self.right_answer.append('できる')
-
-    def turn_to_shiyi(self):
-        '''
-        Turn a verb into 使役态
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('a')
-            if hira.hiragana == 'あ':
-                hira.hiragana = 'わ'
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'せる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'せる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'させる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'させる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来させる')
-                self.right_answer.append('こさせる')
-            if self.verb_base == 'する':
-                self.right_answer.append('させる')
-
-    def turn_to_beidong(self):
-        '''
-        Turn a verb into 被动态
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('a')
-            if hira.hiragana == 'あ':
-                hira.hiragana = 'わ'
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'れる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'れる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'られる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'られる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来られる')
-                self.right_answer.append('こられる')
-            if self.verb_base == 'する':
-                self.right_answer.append('される')
-
-    def turn_to_shiyibeidong(self):
-        '''
-        Turn a verb into 使役被动态
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('a')
-            if hira.hiragana == 'あ':
-                hira.hiragana = 'わ'
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'される'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'される'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'させられる'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'させられる'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来させられる')
-                self.right_answer.append('こさせられる')
-            if self.verb_base == 'する':
-                self.right_answer.append('させられる')
-
-    def turn_to_jiading(self):
-        '''
-        Turn a verb into 假定形
-        '''
-        if self.verb_type == 1:
-            last_hira = self.verb_base[-1:]
-            hira = Hiragana(last_hira)
-            hira.change_vowel('e')
-            hira_answer = self.verb_base[0:-1] + hira.hiragana + 'ば'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + hira.hiragana + 'ば'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 2:
-            hira_answer = self.verb_base[0:-1] + 'れば'
-            if self.has_kanji:
-                kanji_answer = self.verb_kanji[0:-1] + 'れば'
-                self.right_answer.append(kanji_answer)
-            self.right_answer.append(hira_answer)
-        if self.verb_type == 3:
-            if self.verb_base == 'くる':
-                self.right_answer.append('来れば')
-                self.right_answer.append('くれば')
-            if self.verb_base == 'する':
-                self.right_answer.append('すれば')
+    def calc_right_answer(self):
+        '''
+        Calculate the right_answer according to the base and form
+        '''
+        self.get_verb_type()
+        self.right_answer = conjugate(self.verb_base, self.verb_kanji,
+                                      self.verb_form, self.verb_type)
 
     def get_verb_type(self):
         '''
@@ -500,363 +256,2453 @@ class Verb(object):
         2: 动2, v2
         3: 动3, v3
         '''
-        if self.verb_base in ('する', 'くる'):
-            self.verb_type = 3
-        else:
-            last_hira = self.verb_base[-1:]
-            if last_hira != 'る':
-                self.verb_type = 1
-            else:
-                last_2nd_hira = self.verb_base[-2:-1]
-                hira = Hiragana(last_2nd_hira)
-                hira.get_vowel()
-                if hira.vowel in ('う', 'あ', 'お' ):
-                    self.verb_type = 1
-                else:
-                    if self.verb_kanji in speacial_v1:
-                        self.verb_type = 1
-                    else:
-                        self.verb_type = 2
+        self.verb_type = verb_type_of(self.verb_base, self.verb_kanji)
 
     def check_answer(self):
         '''
         Check the user_answer with the right_answer, and set the error flag
         '''
-        if self.user_answer in self.right_answer:
-            self.error_flag = False
-        else:
-            self.error_flag = True
-            right_answer = '[]'
-            if self.right_answer:
-                right_answer = '['
-                for i, answer in enumerate(self.right_answer):
-                    if i == 0:
-                        right_answer = ' '.join([right_answer, answer])
-                    else:
-                        right_answer = ' '.join([right_answer, 'or', answer])
-                right_answer = ''.join([right_answer, ']'])
-            errormessage = ''.join(['Wrong answer! Correct answer: ', right_answer])
-            print(errormessage)
+        if self.grade():
+            print(wrong_answer_message(self.right_answer))
+
+    def grade(self):
+        '''
+        Check the user_answer with the right_answer without printing,
+        set and return the error flag. A wrong answer within
+        near_miss_distance edits of a right answer is a near miss
+        '''
+        self.error_flag = self.user_answer not in self.right_answer
+        self.near_miss = self.error_flag and \
+            classify_answer(self.user_answer, self.right_answer) == 'near_miss'
+        return self.error_flag
 
     def get_user_answer(self):
         '''
         Give the quiz information, and then get the user answer
         '''
-        key_word = ''
-        if self.verb_form in ('ます', 'て', 'た', 'ない', '意志', '命令', '假定'):
-            key_word = '形'
-        if self.verb_form in ('可能', '被动', '自发', '使役', '被动使役'):
-            key_word = '态'
-
         if self.has_kanji:
-            message = ''.join(['\nPlease enter the ', self.verb_form, key_word, ' of ',\
+            message = ''.join(['\nPlease enter the ', form_name(self.verb_form), ' of ',\
                                self.verb_kanji, ' (', self.verb_base, '): '])
         else:
-            message = ''.join(['\nPlease enter the ', self.verb_form, key_word, ' of ',\
+            message = ''.join(['\nPlease enter the ', form_name(self.verb_form), ' of ',\
                                self.verb_base, ': '])
         self.user_answer = get_input(message)
+        return self.user_answer
 
 
-class Practice(object):
+def rules_version():
     '''
-    Class Practice
+    Hash of everything the right answers depend on: the source of the
+    conjugation code, the conjugation rules, the kana table and the
+    special v1 verbs
     '''
+    digest = hashlib.md5()
+    for function in (verb_type_of, Verb.calc_right_answer, conjugate,
+                     compile_conjugation_rule):
+        try:
+            source = inspect.getsource(inspect.unwrap(function))
+        except (IOError, TypeError):
+            source = function.__name__
+        digest.update(source.encode('utf-8'))
+    for data in (hiragana_rows, speacial_v1, conjugation_rules,
+                 verb_overrides, surface_overrides):
+        digest.update(repr(data).encode('utf-8'))
+    return digest.hexdigest()
 
-    def __init__(self):
-        self.total_quiz_number = 0
-        self.verbs = []
-        self.verbs_base_avail = None
-        self.verbs_kanji_avail = None
-        self.verbs_form_avail = None
-        self.verbs_error = None
-        self.current_quiz_number = 0
-        self.practice_history = None
-        self.initial()
 
-    def initial(self):
+class ConjugationCache(object):
+    '''
+    Class ConjugationCache
+    LRU cache of (verb_type, right_answer) by (verb_base, verb_kanji,
+    verb_form), saved to disk together with the rules version
+    '''
+    def __init__(self, maxsize=4096, path='conjugation_cache.json'):
+        self.maxsize = maxsize
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.version = None
+        self.special = None
+        # the absolute paths loaded since the entries were last dropped,
+        # not loaded again as the entries in memory are the newer ones
+        self.loaded_paths = set()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def check_version(self):
         '''
-        Initial the quiz
+        Drop all the entries if speacial_v1 has been replaced and the rules
+        version changed with it
         '''
-        self.read_verb_lib()
-        self.read_form_lib()
-        self.load_practice_history()
+        if self.special is speacial_v1:
+            return
+        self.special = speacial_v1
+        version = rules_version()
+        if version != self.version:
+            self.entries.clear()
+            self.loaded_paths.clear()
+            self.version = version
 
-    def load_practice_history(self):
+    def get(self, key):
         '''
-        Load practice history. If there isn't a history, set up one
+        Return the cached value of the key, None if it is not cached
         '''
-        total_verbs_base = len(self.verbs_base_avail)
-        total_verbs_form = len(self.verbs_form_avail)
-        total_avail_verbs_number = total_verbs_base * total_verbs_form
-        # check whether the file exist
-        history_file = 'practice_history.csv'
-        history_exist = os.path.isfile(history_file)
-        if history_exist:
-            practice_history = pd.read_csv(history_file, index_col=0)
-            # all available in practice history?
-            for i in range(total_verbs_base):
-                if self.verbs_base_avail[i] not in \
-                        set(practice_history['verb_base'].tolist()):
-                    # add the verb
-                    for form in set(practice_history['verb_form'].tolist()):
-                        practice_history = practice_history.append(
-                            {'verb_base': self.verbs_base_avail[i],
-                             'verb_kanji': self.verbs_kanji_avail[i],
-                             'verb_form' : form,
-                             'sample_time': 0,
-                             'error_time': 0,
-                             'right_time': 0,
-                             'continue_error_time': 0,
-                             'continue_right_time': 0,
-                             'relative_weight': 3.0}, ignore_index=True)
-            for form in self.verbs_form_avail:
-                if form not in set(practice_history['verb_form'].tolist()):
-                    # add the form
-                    for j in range(total_verbs_base):
-                        practice_history = practice_history.append(
-                            {'verb_base': self.verbs_base_avail[j],
-                             'verb_kanji': self.verbs_kanji_avail[j],
-                             'verb_form' : form,
-                             'sample_time': 0,
-                             'error_time': 0,
-                             'right_time': 0,
-                             'continue_error_time': 0,
-                             'continue_right_time': 0,
-                             'relative_weight': 3.0}, ignore_index=True)
-            self.practice_history = practice_history
-        else:
-            # initial the practice history
-            history_array = np.empty(shape=(total_avail_verbs_number, 9),
-                                     dtype=object)
-            # set up the dictionary of the verbs
-            for i in range(total_verbs_base):
-                for j in range(total_verbs_form):
-                    verb = Verb(self.verbs_base_avail[i],
-                                self.verbs_kanji_avail[i],
-                                self.verbs_form_avail[j])
-                    history_array[i*total_verbs_form + j] = \
-                        [verb.verb_base, verb.verb_kanji, verb.verb_form, 0, \
-                         0, 0, 0, 0, 1.0]
-            # put the data into dataframe
-            self.practice_history = pd.DataFrame(data=history_array,
-                                                 columns = ['verb_base',
-                                                            'verb_kanji',
-                                                            'verb_form',
-                                                            'sample_time',
-                                                            'error_time',
-                                                            'right_time',
-                                                            'continue_error_time',
-                                                            'continue_right_time',
-                                                            'relative_weight'])
+        self.check_version()
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
 
-    def sample_verb(self):
+    def put(self, key, value):
         '''
-        Choose a verb according to the sample history
+        Cache a value, evict the least recently used entries when full
         '''
-        index = biased_verb_sample(self.practice_history['relative_weight'].tolist())
-        verb_base = self.practice_history.loc[index, 'verb_base']
-        verb_kanji = self.practice_history.loc[index, 'verb_kanji']
-        verb_form = self.practice_history.loc[index, 'verb_form']
-        verb = Verb(verb_base, verb_kanji, verb_form)
-        self.verbs.append(verb)
-        return verb
+        self.check_version()
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
 
-    def read_verb_lib(self):
+    def clear(self):
+        self.entries.clear()
+        self.loaded_paths.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {'size': len(self.entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+    def load(self, path=None):
         '''
-        Read the verbs lib, choose verb from that
+        Load the cache saved by save(), skip it if the rules changed since
+        or if it is already loaded
         '''
-        self.verbs_base_avail = []
-        self.verbs_kanji_avail = []
-        with open('Japanese_verb_base.jvp', encoding='utf-8') as f:
-            for line in f:
-                if line.strip():
-                    line = line.strip()
-                    verb_base_kanji = line.split()
-                    self.verbs_base_avail.append(verb_base_kanji[0])
-                    self.verbs_kanji_avail.append(verb_base_kanji[1])
+        path = path or self.path
+        self.check_version()
+        if os.path.abspath(path) in self.loaded_paths or \
+                not os.path.isfile(path):
+            return
+        self.loaded_paths.add(os.path.abspath(path))
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except ValueError:
+            return
+        if data.get('version') != self.version:
+            return
+        for verb_base, verb_kanji, verb_form, verb_type, right_answer in \
+                data['entries'][-self.maxsize:]:
+            self.put((verb_base, verb_kanji, verb_form),
+                     (verb_type, tuple(right_answer)))
 
-    def read_form_lib(self):
+    def save(self, path=None):
         '''
-        Read the form lib
+        Save the cache, from the least to the most recently used entry
         '''
-        self.verbs_form_avail = []
-        with open('Japanese_verb_form.jvp', encoding='utf-8',errors='ignore') as f:
-            for line in f:
-                if line.strip():
-                    verb_form = line.strip()
-                    self.verbs_form_avail.append(verb_form)
+        path = path or self.path
+        self.check_version()
+        entries = [list(key) + [value[0], list(value[1])]
+                   for key, value in self.entries.items()]
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.version, 'entries': entries}, f,
+                      ensure_ascii=False)
+        os.replace(temp_file, path)
+
+conjugation_cache = ConjugationCache()
+
 
-    def perform_quiz(self):
+# the spaced repetition schedule of a row, and its value before the row is
+# first answered: due_time in seconds since the epoch, 0 if not scheduled
+schedule_defaults = OrderedDict([('due_time', 0.0), ('ease', 2.5),
+                                 ('interval_days', 0.0)])
+history_columns = ['verb_base', 'verb_kanji', 'verb_form', 'sample_time',
+                   'error_time', 'right_time', 'continue_error_time',
+                   'continue_right_time', 'relative_weight'] + \
+                  list(schedule_defaults)
+counter_columns = history_columns[3:8]
+schedule_columns = history_columns[9:]
+
+# the typecodes of the array.array of the number columns
+column_typecodes = OrderedDict((column, 'q' if column in counter_columns else 'd')
+                               for column in history_columns[3:])
+
+
+class HistoryTable(object):
+    '''
+    Class HistoryTable
+    The practice history as columns of plain sequences, the row of index i
+    being item i of every column: lists of str for verb_base, verb_kanji
+    (None for a verb without kanji) and verb_form, array.array of int64
+    for the counters and of float64 for relative_weight and the schedule.
+    A store may keep its own sequences as columns, as the NumPy memmaps of
+    MemmapHistoryStore. A history saved without the schedule columns gets
+    them at their default values. to_dataframe() gives a pandas copy for
+    analytics
+    '''
+    def __init__(self, columns=None):
+        columns = columns or {}
+        self.columns = OrderedDict()
+        for column in history_columns[:3]:
+            values = columns.get(column, [])
+            self.columns[column] = values if isinstance(values, list) \
+                else list(values)
+        size = len(self.columns['verb_base'])
+        for column, typecode in column_typecodes.items():
+            if column in columns:
+                self.columns[column] = columns[column]
+            elif column in schedule_defaults:
+                self.columns[column] = array.array(
+                    typecode, [schedule_defaults[column]]) * size
+            else:
+                self.columns[column] = array.array(typecode, [0]) * size
+
+    @classmethod
+    def from_strings(cls, header, rows):
         '''
-        Perform quiz
-        Give quiz info, ask user input answer
-        Check answer and record
+        Build a table from rows of strings, as read from a CSV file, with
+        the columns named in header. The columns not in history_columns,
+        as the index column of a pandas CSV file, are skipped
         '''
-        total_quiz_number_help_info = 'How many verb do you want to practice? \
-Please enter a int number: '
-        input_string = get_input(total_quiz_number_help_info)
-        input_string = input_string.strip()
-        self.total_quiz_number = int(input_string)
-        for i in range(self.total_quiz_number):
-            verb = self.sample_verb()
-            verb.get_user_answer()
-            verb.get_right_answer()
-            verb.check_answer()
-            self.record(verb)
+        rows = list(rows)
+        values = list(zip(*rows)) if rows else [()] * len(header)
+        columns = {}
+        for column, column_values in zip(header, values):
+            if column not in history_columns:
+                continue
+            if column == 'verb_kanji':
+                column_values = [normalize_kanji(value or None)
+                                 for value in column_values]
+            elif column in column_typecodes:
+                column_values = parse_column(column_typecodes[column],
+                                             column_values)
+            columns[column] = column_values
+        return cls(columns)
 
-    def record(self, verb):
+    def __len__(self):
+        return len(self.columns['verb_base'])
+
+    def __contains__(self, column):
+        return column in self.columns
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __setitem__(self, column, values):
+        self.columns[column] = values
+
+    def row(self, index, columns=history_columns):
         '''
-        Record the practice history, include sample_time, error_time,
-        right_time, continue_error_time, continue_right_time,
-        relative_weight
+        Return the values of columns in the row of index, as Python str,
+        int and float
         '''
-        # Find the index of the verb
-        index = self.find_verb_in_practice_history(verb)
-        self.practice_history.loc[index, 'sample_time'] += 1
-        if verb.error_flag:
-            self.practice_history.loc[index, 'error_time'] += 1
-            self.practice_history.loc[index, 'continue_error_time'] += 1
-            self.practice_history.loc[index, 'continue_right_time'] = 0
-        else:
-            self.practice_history.loc[index, 'right_time'] += 1
-            self.practice_history.loc[index, 'continue_right_time'] += 1
-            if self.practice_history.loc[index, 'continue_right_time'] > 5:
-                self.practice_history.loc[index, 'continue_right_time'] = 0
-                self.practice_history.loc[index, 'error_time'] = 0
-            self.practice_history.loc[index, 'continue_error_time'] = 0
-        # calculate the relative weight
-        # relative_weight = [1 +(5*continue_error_time) + (3*error_time)] /
-        #                   [ 1 + sample_time + right_time + 2*continue_right_time]
-        self.practice_history.loc[index, 'relative_weight'] = \
-            (1.0 + self.practice_history.loc[index, 'error_time'] * 6.0 +
-             self.practice_history.loc[index, 'continue_error_time'] * 10.0) / \
-            (1.0 + self.practice_history.loc[index, 'sample_time'] +
-             self.practice_history.loc[index, 'right_time'] +
-             self.practice_history.loc[index, 'continue_right_time'] * 2)
-        self.practice_history.to_csv('practice_history.csv')
+        values = []
+        for column in columns:
+            value = self.columns[column][index]
+            typecode = column_typecodes.get(column)
+            if typecode == 'q':
+                value = int(value)
+            elif typecode == 'd':
+                value = float(value)
+            values.append(value)
+        return values
 
-    def find_verb_in_practice_history(self, verb):
+    def set_row(self, index, columns, values):
+        for column, value in zip(columns, values):
+            self.columns[column][index] = value
+
+    def iter_rows(self):
         '''
-        Find the verb in the practice history
-        return the index number
+        Yield every row, in the order of history_columns
         '''
-        found_index = []
-        base_index = self.practice_history.verb_base[
-            self.practice_history.verb_base == verb.verb_base].index.tolist()
-        form_index = self.practice_history.verb_form[
-            self.practice_history.verb_form == verb.verb_form].index.tolist()
-        kanji_index = self.practice_history.verb_kanji[
-            self.practice_history.verb_kanji == verb.verb_kanji].index.tolist()
-        if verb.has_kanji:
-            found_index = list(set.intersection(set(base_index), set(form_index),
-                                                set(kanji_index)))
-        else:
-            base_form_index = list(set.intersection(set(base_index), set(form_index)))
-            for index in base_form_index:
-                if (not isinstance(self.practice_history.verb_kanji[index], str)) or (self.practice_history.verb_kanji[index] == 'None'):
-                    found_index.append(index)
-
-        if len(found_index) == 1:
-            index = found_index[0]
-            return index
-        else:
-            if verb.has_kanji:
-                errormessage = ''.join(['Found more than one verb:', verb.verb_base,
-                                        verb.verb_kanji, '的', verb.verb_form,
-                                        '形 in practice_history!'])
+        for index in range(len(self)):
+            yield self.row(index)
+
+    def select(self, keep):
+        '''
+        Return a new table of the rows whose item of keep is true
+        '''
+        columns = {}
+        for column, values in self.columns.items():
+            kept = itertools.compress(values, keep)
+            typecode = column_typecodes.get(column)
+            if typecode is None:
+                columns[column] = list(kept)
             else:
-                errormessage = ''.join(['Found more than one verb:', verb.verb_base,
-                                        '的', verb.verb_form,
-                                        '形 in practice_history!'])
-            print(found_index)
-            raise ValueError(errormessage)
-            return -1
+                columns[column] = array.array(typecode, kept)
+        return HistoryTable(columns)
 
+    def append_rows(self, keys, relative_weight):
+        '''
+        Add a row of new counters for every (verb_base, verb_kanji,
+        verb_form) of keys, with relative_weight and the default schedule
+        '''
+        keys = list(keys)
+        for column, values in zip(history_columns[:3], zip(*keys)):
+            self.columns[column].extend(values)
+        new_values = dict(schedule_defaults)
+        new_values['relative_weight'] = float(relative_weight)
+        for column, typecode in column_typecodes.items():
+            values = self.columns[column]
+            if not isinstance(values, array.array):
+                values = array.array(typecode, values)
+                self.columns[column] = values
+            values.extend(array.array(typecode,
+                                      [new_values.get(column, 0)]) * len(keys))
 
-# Random-number sampling using the Walker-Vose alias method,
-# Copyright: Joachim Wuttke, Forschungszentrum Juelich GmbH (2013)
-# M. D. Vose, IEEE T. Software Eng. 17, 972 (1991)
-# A. J. Walker, Electronics Letters 10, 127 (1974); ACM TOMS 3, 253 (1977)
-class AliasTable(object):
+    def view(self, column):
+        '''
+        Return a NumPy array over a number column, without a copy
+        '''
+        values = self.columns[column]
+        if isinstance(values, array.array):
+            return np.frombuffer(values, dtype=values.typecode)
+        return np.asarray(values)
+
+    def to_dataframe(self):
+        '''
+        Return a pandas DataFrame copy of the table
+        '''
+        return pd.DataFrame(OrderedDict(
+            (column, list(values) if column not in column_typecodes
+             else np.array(self.view(column)))
+            for column, values in self.columns.items()))
+
+def parse_column(typecode, values):
     '''
-    Class AliasTable
+    Return an array.array of the strings of a number column
     '''
-    def __init__(self, pdf):
-        self.p = pdf[:]
-        self.alias = None
-        self.prob = None
-        self.calc_alias()
+    if typecode == 'd':
+        return array.array('d', map(float, values))
+    try:
+        return array.array('q', map(int, values))
+    except ValueError:
+        # counters written as floats
+        return array.array('q', [int(float(value)) for value in values])
 
-    def calc_alias(self):
-        n = len(self.p)
-        self.prob = [0.0] * n
-        self.alias = [0] * n
-        small = [0.0] * n
-        large = [0.0] * n
-        for i in range(n):
-            self.p[i] *= n
+def read_metadata(path):
+    '''
+    Return the metadata saved with a practice history, a dict, empty if
+    there is none or it cannot be read
+    '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            metadata = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
 
-         # Set separate index lists for small and large probabilities:
-        n_s, n_l = 0, 0
-        for i in range(n-1, -1, -1):
-            if self.p[i] < 1:
-                small[n_s] = i
-                n_s += 1
-            else:
-               large[n_l] = i
-               n_l += 1
+def write_metadata(path, metadata):
+    temp_file = path + '.tmp'
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False)
+    os.replace(temp_file, path)
 
-        # Work through index lists
-        while n_s and n_l:
-            n_s -= 1
-            a = small[n_s]
-            n_l -= 1
-            g = large[n_l]
-            self.prob[a] = self.p[a]
-            self.alias[a] = g
-            self.p[g] = self.p[g] + self.p[a] - 1
-            if self.p[g] < 1:
-                small[n_s] = g
-                n_s += 1
-            else:
-                large[n_l] = g
-                n_l += 1
 
-        while n_l:
-            n_l -= 1
-            self.prob[large[n_l]] = 1
+class CsvHistoryStore(object):
+    '''
+    Class CsvHistoryStore
+    The practice history is a CSV snapshot plus an append-only journal of
+    the rows changed since the snapshot. An answer appends one line to the
+    journal, and compact() folds the journal back into the snapshot. The
+    name of the weighting is kept in a JSON file next to the snapshot.
+    '''
+    def __init__(self, path='practice_history.csv', journal_path=None,
+                 compact_every=None):
+        self.path = path
+        if journal_path is None:
+            journal_path = path + '.journal'
+        self.journal_path = journal_path
+        self.metadata_path = path + '.meta.json'
+        self.compact_every = compact_every
+        self.journal = None
+        self.journal_rows = 0
 
-        while n_s:
-          # can only happen through numeric instability
-            n_s -= 1
-            self.prob[small[n_s] ] = 1;
+    def load(self):
+        '''
+        Load the snapshot, None if there isn't one
+        '''
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return None
+            return HistoryTable.from_strings(header, reader)
 
-    def sample_pdf(self):
-        rand1 = random.random()
-        rand2 = random.random()
-        i = int(len(self.p) * rand1)
-        if rand2 < self.prob[i]:
-            return i
-        else:
-            return self.alias[i]
+    def replay_journal(self, practice_history, history_index):
+        '''
+        Apply the journal to the practice history, the last line of a verb
+        wins. history_index maps (verb_base, verb_kanji, verb_form) to the
+        index of the row. Lines of verbs no longer in the practice history,
+        and a line torn by a crash, are skipped.
+        '''
+        self.journal_rows = 0
+        if not os.path.isfile(self.journal_path):
+            return 0
+        rows = OrderedDict()
+        with open(self.journal_path, encoding='utf-8', newline='') as f:
+            for line in csv.reader(f):
+                self.journal_rows += 1
+                # a line written before the schedule columns has 9 fields
+                if len(line) not in (len(history_columns),
+                                     len(history_columns) - len(schedule_columns)):
+                    continue
+                try:
+                    values = [int(value) for value in line[3:8]] + \
+                             [float(value) for value in line[8:]]
+                except ValueError:
+                    continue
+                values += [schedule_defaults[column]
+                           for column in history_columns[len(line):]]
+                rows[(line[0], line[1] or None, line[2])] = values
+        indexes = []
+        values = []
+        for key, value in rows.items():
+            if key in history_index:
+                indexes.append(history_index[key])
+                values.append(value)
+        for index, value in zip(indexes, values):
+            practice_history.set_row(index, history_columns[3:], value)
+        return len(indexes)
 
-def get_input(info):
-    '''
-    Get information from terminal input
-    '''
-    reponse = None
-    py3 = version_info[0] > 3
-    if py3:
-        response = input(info)
-    else:
-        response = input(info)
-    return response
+    def sync(self, practice_history, history_index):
+        '''
+        Apply the answers recorded since the last snapshot
+        '''
+        self.replay_journal(practice_history, history_index)
 
-def biased_verb_sample(p):
+    def write_row(self, practice_history, index, answers=(), weighting=None):
+        '''
+        Append the row of index to the journal
+        '''
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a', encoding='utf-8',
+                                newline='')
+        row = practice_history.row(index)
+        row[1] = row[1] or ''
+        csv.writer(self.journal).writerow(row)
+        self.journal.flush()
+        self.journal_rows += 1
+        if self.compact_every and self.journal_rows >= self.compact_every:
+            self.compact(practice_history)
+
+    def flush(self):
+        if self.journal is not None:
+            self.journal.flush()
+
+    def load_weighting(self):
+        return read_metadata(self.metadata_path).get('weighting')
+
+    def save_weighting(self, weighting):
+        metadata = read_metadata(self.metadata_path)
+        metadata['weighting'] = weighting
+        write_metadata(self.metadata_path, metadata)
+
+    def save(self, practice_history):
+        '''
+        Write a new snapshot, a CSV file with an index column first as
+        pandas writes it, and empty the journal it holds
+        '''
+        temp_file = self.path + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow([''] + history_columns)
+            for index, row in enumerate(practice_history.iter_rows()):
+                row[1] = row[1] or ''
+                writer.writerow([index] + row)
+        os.replace(temp_file, self.path)
+        self.empty_journal()
+
+    def compact(self, practice_history):
+        '''
+        Write a new snapshot and empty the journal
+        '''
+        self.save(practice_history)
+
+    def empty_journal(self):
+        '''
+        Remove the journal. It is removed only after the snapshot is in
+        place, replaying it again is harmless.
+        '''
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if os.path.isfile(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_rows = 0
+
+    def close(self, practice_history):
+        if self.journal_rows or not os.path.isfile(self.path):
+            self.compact(practice_history)
+
+
+class MemmapHistoryStore(object):
     '''
-    Uniformly sample a entity from a list
+    Class MemmapHistoryStore
+    The practice history as a directory of .npy columns opened with
+    numpy.memmap. verb_base, verb_kanji and verb_form are integer codes
+    into a string table, -1 for a verb without kanji. Loading maps the
+    columns instead of parsing them, and the practice history works on
+    the mapped number columns, so an answer updates its row in place. The
+    name of the weighting is kept in a JSON file next to the directory.
     '''
-    # normalize p
+    def __init__(self, path='practice_history.jvpdb'):
+        self.path = path
+        self.metadata_path = path + '.meta.json'
+        self.columns = None
+        self.loaded = None
+
+    def recover(self):
+        '''
+        Finish or undo a save stopped by a crash. A save writes the new
+        directory as path + '.tmp', strings.json last, renames the old one
+        to path + '.old', renames the new one into place, then removes the
+        old one
+        '''
+        temp_dir = self.path + '.tmp'
+        old_dir = self.path + '.old'
+        if not os.path.isdir(self.path) and os.path.isdir(old_dir):
+            if os.path.isfile(os.path.join(temp_dir, 'strings.json')):
+                os.rename(temp_dir, self.path)
+            else:
+                os.rename(old_dir, self.path)
+        for leftover in (temp_dir, old_dir):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+
+    def load(self):
+        '''
+        Map the practice history, None if there isn't one
+        '''
+        self.recover()
+        strings_file = os.path.join(self.path, 'strings.json')
+        if not os.path.isfile(strings_file):
+            return None
+        with open(strings_file, encoding='utf-8') as f:
+            strings = json.load(f)
+        self.columns = OrderedDict()
+        for column in history_columns:
+            column_file = os.path.join(self.path, column + '.npy')
+            # a history saved before the schedule columns lacks them
+            if os.path.isfile(column_file):
+                self.columns[column] = np.load(column_file, mmap_mode='r+')
+        data = OrderedDict()
+        for column in self.columns:
+            if column in strings:
+                values = [normalize_kanji(value) if column == 'verb_kanji'
+                          else value for value in strings[column]] + [None]
+                data[column] = [values[code]
+                                for code in self.columns[column].tolist()]
+            else:
+                data[column] = self.columns[column]
+        practice_history = HistoryTable(data)
+        # a history with missing columns is written again by sync
+        self.loaded = practice_history \
+            if len(self.columns) == len(history_columns) else None
+        return practice_history
+
+    def sync(self, practice_history, history_index):
+        '''
+        Write the practice history again if it is not the mapped one,
+        a new history or a history with verbs or forms added or removed
+        '''
+        if practice_history is not self.loaded:
+            self.save(practice_history)
+
+    def write_row(self, practice_history, index, answers=(), weighting=None):
+        '''
+        Update the row of index in the maps, the mapped columns of the
+        practice history are already updated in place
+        '''
+        for column in history_columns[3:]:
+            values = practice_history[column]
+            if values is not self.columns[column]:
+                self.columns[column][index] = values[index]
+
+    def save(self, practice_history):
+        '''
+        Write the whole practice history and map it. The directory is
+        written aside and swapped in by renames, see recover()
+        '''
+        temp_dir = self.path + '.tmp'
+        old_dir = self.path + '.old'
+        if os.path.isdir(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+        strings = {}
+        for column in history_columns[:3]:
+            # the code of None is -1
+            codes = {None: -1}
+            values = practice_history[column]
+            np.save(os.path.join(temp_dir, column + '.npy'), np.array(
+                [codes.setdefault(value, len(codes) - 1) for value in values],
+                dtype=np.int32))
+            strings[column] = [value for value in codes if value is not None]
+        for column in history_columns[3:]:
+            np.save(os.path.join(temp_dir, column + '.npy'),
+                    np.asarray(practice_history.view(column),
+                               dtype=np.int64 if column in counter_columns
+                               else np.float64))
+        with open(os.path.join(temp_dir, 'strings.json'), 'w',
+                  encoding='utf-8') as f:
+            json.dump(strings, f, ensure_ascii=False)
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.isdir(self.path):
+            os.rename(self.path, old_dir)
+        os.rename(temp_dir, self.path)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self.load()
+        # the practice history works on the maps from now on, not a copy
+        for column in history_columns[3:]:
+            practice_history[column] = self.columns[column]
+        self.loaded = practice_history
+
+    def flush(self):
+        if self.columns:
+            for column in history_columns[3:]:
+                self.columns[column].flush()
+
+    def load_weighting(self):
+        return read_metadata(self.metadata_path).get('weighting')
+
+    def save_weighting(self, weighting):
+        metadata = read_metadata(self.metadata_path)
+        metadata['weighting'] = weighting
+        write_metadata(self.metadata_path, metadata)
+
+    def close(self, practice_history):
+        self.flush()
+
+    def export_csv(self, practice_history, path='practice_history.csv'):
+        '''
+        Export the practice history in the CSV format of CsvHistoryStore
+        '''
+        CsvHistoryStore(path).save(practice_history)
+
+
+class SqliteHistoryStore(object):
+    '''
+    Class SqliteHistoryStore
+    The practice history as an indexed SQLite table in WAL mode. Answers are
+    kept until batch_size of them, or flush_interval seconds, then folded
+    into the rows as they are in the table, read again in the same write
+    transaction, so several practice processes can share one history file
+    without losing each other's answers. The name of the weighting is kept
+    in a metadata table.
+    '''
+    def __init__(self, path='practice_history.db', batch_size=20,
+                 flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.connection = None
+        self.loaded = None
+        self.pending = OrderedDict()
+        self.last_flush = time.time()
+        # the name of the weighting saved with the history, for the rows
+        # written without one
+        self.weighting = None
+
+    def connect(self):
+        if self.connection is not None:
+            return self.connection
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS practice_history (
+                id INTEGER PRIMARY KEY,
+                verb_base TEXT NOT NULL,
+                verb_kanji TEXT NOT NULL,
+                verb_form TEXT NOT NULL,
+                sample_time INTEGER NOT NULL DEFAULT 0,
+                error_time INTEGER NOT NULL DEFAULT 0,
+                right_time INTEGER NOT NULL DEFAULT 0,
+                continue_error_time INTEGER NOT NULL DEFAULT 0,
+                continue_right_time INTEGER NOT NULL DEFAULT 0,
+                relative_weight REAL NOT NULL DEFAULT 1.0,
+                due_time REAL NOT NULL DEFAULT 0.0,
+                ease REAL NOT NULL DEFAULT 2.5,
+                interval_days REAL NOT NULL DEFAULT 0.0,
+                UNIQUE (verb_base, verb_kanji, verb_form))''')
+            # a history created before the schedule columns
+            existing = [row[1] for row in self.connection.execute(
+                'PRAGMA table_info(practice_history)')]
+            for column in schedule_columns:
+                if column not in existing:
+                    self.connection.execute(''.join([
+                        'ALTER TABLE practice_history ADD COLUMN ', column,
+                        ' REAL NOT NULL DEFAULT ', repr(schedule_defaults[column])]))
+            self.connection.execute('''CREATE INDEX IF NOT EXISTS
+                practice_history_form ON practice_history (verb_form)''')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL)''')
+        return self.connection
+
+    def load_weighting(self):
+        row = self.connect().execute(
+            "SELECT value FROM metadata WHERE key = 'weighting'").fetchone()
+        self.weighting = row[0] if row is not None else None
+        return self.weighting
+
+    def save_weighting(self, weighting):
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES ('weighting', ?)",
+                (weighting,))
+        self.weighting = weighting
+
+    def query(self, where='', parameters=()):
+        '''
+        Select rows of the practice history into a HistoryTable,
+        verbs without kanji get None
+        '''
+        self.flush()
+        sql = ' '.join(['SELECT', ', '.join(history_columns),
+                        'FROM practice_history', where, 'ORDER BY id'])
+        rows = self.connect().execute(sql, parameters).fetchall()
+        values = list(zip(*rows)) if rows else [()] * len(history_columns)
+        columns = dict(zip(history_columns, values))
+        columns['verb_kanji'] = [normalize_kanji(verb_kanji or None)
+                                 for verb_kanji in columns['verb_kanji']]
+        for column, typecode in column_typecodes.items():
+            columns[column] = array.array(typecode, columns[column])
+        return HistoryTable(columns)
+
+    def load(self):
+        '''
+        Load the practice history, None if there isn't one
+        '''
+        if not os.path.isfile(self.path):
+            return None
+        count = self.connect().execute(
+            'SELECT COUNT(*) FROM practice_history').fetchone()[0]
+        if not count:
+            return None
+        self.loaded = self.query()
+        return self.loaded
+
+    def rows_for_form(self, verb_form):
+        return self.query('WHERE verb_form = ?', (verb_form,))
+
+    def rows_for_verb(self, verb_base):
+        return self.query('WHERE verb_base = ?', (verb_base,))
+
+    def sync(self, practice_history, history_index):
+        '''
+        Insert the verbs and forms added to the practice history since it
+        was loaded, and delete the removed ones
+        '''
+        if practice_history is self.loaded:
+            return
+        keys = set(history_index)
+        removed = []
+        if self.loaded is not None:
+            loaded_keys = set(zip(self.loaded['verb_base'],
+                                  self.loaded['verb_kanji'],
+                                  self.loaded['verb_form']))
+            removed = [(verb_base, verb_kanji or '', verb_form)
+                       for verb_base, verb_kanji, verb_form
+                       in loaded_keys - keys]
+            keys -= loaded_keys
+        rows = [self.row_values(practice_history, history_index[key])
+                for key in sorted(keys, key=history_index.get)]
+        connection = self.connect()
+        with connection:
+            connection.executemany(
+                '''DELETE FROM practice_history WHERE verb_base = ?
+                   AND verb_kanji = ? AND verb_form = ?''', removed)
+            connection.executemany(
+                ''.join(['INSERT OR IGNORE INTO practice_history (',
+                         ', '.join(history_columns), ') VALUES (',
+                         ', '.join(['?'] * len(history_columns)), ')']), rows)
+        self.loaded = practice_history
+
+    def row_values(self, practice_history, index):
+        row = practice_history.row(index)
+        row[1] = row[1] or ''
+        return row
+
+    def write_row(self, practice_history, index, answers=(), weighting=None):
+        '''
+        Keep the row of index and its answers, Answer tuples, for the next
+        batch. A row without answers is written as it is
+        '''
+        row = self.row_values(practice_history, index)
+        key = tuple(row[:3])
+        kept = self.pending.get(key)
+        kept_answers = list(kept[1]) if kept is not None else []
+        self.pending[key] = (row[3:], kept_answers + list(answers), weighting)
+        if len(self.pending) >= self.batch_size or \
+                time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        '''
+        Write the kept rows in one IMMEDIATE transaction: the rows with
+        answers are read again and the answers folded into them, so the
+        answers written by other processes since the load are kept
+        '''
+        self.last_flush = time.time()
+        if not self.pending:
+            return
+        where = ' WHERE verb_base = ? AND verb_kanji = ? AND verb_form = ?'
+        select = ''.join(['SELECT ', ', '.join(counter_columns + schedule_columns),
+                          ' FROM practice_history', where])
+        update = ''.join(['UPDATE practice_history SET ',
+                          ', '.join([column + ' = ?'
+                                     for column in history_columns[3:]]),
+                          where])
+        connection = self.connect()
+        saved_weighting = weighting_of(self.weighting or 'error')
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for key, (values, answers, weighting) in self.pending.items():
+                current = connection.execute(select, key).fetchone() \
+                    if answers else None
+                if current is not None:
+                    counters, schedule = fold_answers(
+                        current[:len(counter_columns)],
+                        current[len(counter_columns):], answers)
+                    values = list(counters) + \
+                        [relative_weight_of(counters,
+                                            weighting or saved_weighting)] + \
+                        list(schedule)
+                connection.execute(update, list(values) + list(key))
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        self.pending.clear()
+
+    def save(self, practice_history):
+        '''
+        Write the whole practice history
+        '''
+        connection = self.connect()
+        with connection:
+            connection.execute('DELETE FROM practice_history')
+        self.loaded = None
+        history_index = {}
+        for index, key in enumerate(zip(practice_history['verb_base'],
+                                        practice_history['verb_kanji'],
+                                        practice_history['verb_form'])):
+            history_index[key] = index
+        self.sync(practice_history, history_index)
+
+    def close(self, practice_history):
+        self.flush()
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class WriteBehindStore(object):
+    '''
+    Class WriteBehindStore
+    Keeps the rows changed by answers in memory, with their answers, and
+    writes them to the store it wraps only on flush(), off the path of the
+    answer. flush() may run on another thread than write_row()
+    '''
+    def __init__(self, store):
+        import threading
+        self.store = store
+        # the answers and the weighting of every changed row by index
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.practice_history = None
+
+    def load(self):
+        return self.store.load()
+
+    def sync(self, practice_history, history_index):
+        self.store.sync(practice_history, history_index)
+
+    def load_weighting(self):
+        return self.store.load_weighting()
+
+    def save_weighting(self, weighting):
+        self.store.save_weighting(weighting)
+
+    def write_row(self, practice_history, index, answers=(), weighting=None):
+        with self.lock:
+            self.practice_history = practice_history
+            kept = self.dirty.get(index)
+            kept_answers = kept[0] if kept is not None else []
+            self.dirty[index] = (kept_answers + list(answers), weighting)
+
+    def flush(self):
+        '''
+        Write the rows changed since the last flush. A row changed while it
+        is written is marked again, and written by the next flush
+        '''
+        with self.lock:
+            dirty = self.dirty
+            self.dirty = {}
+        for index in sorted(dirty):
+            answers, weighting = dirty[index]
+            self.store.write_row(self.practice_history, index, answers,
+                                 weighting)
+        self.store.flush()
+
+    def save(self, practice_history):
+        with self.lock:
+            self.dirty = {}
+        self.store.save(practice_history)
+
+    def close(self, practice_history):
+        self.flush()
+        self.store.close(practice_history)
+
+
+# the outcome of Practice.submit
+QuizResult = namedtuple('QuizResult',
+                        ['quiz', 'user_answer', 'correct', 'right_answer',
+                         'diagnosis', 'near_miss'])
+
+
+class QuizLoop(object):
+    '''
+    Class QuizLoop
+    The terminal session over the quizzes of iter_quizzes, for a class with
+    iter_quizzes, submit, record, diagnose and close
+    '''
+
+    def perform_quiz(self, pipelined=True):
+        '''
+        Perform quiz
+        Give quiz info, ask user input answer
+        Check answer and record
+        With pipelined, the next quiz is worked out and the answer is
+        recorded on a worker thread while the user types
+        '''
+        total_quiz_number_help_info = 'How many verb do you want to practice? \
+Please enter a int number: '
+        input_string = get_input(total_quiz_number_help_info)
+        input_string = input_string.strip()
+        self.total_quiz_number = int(input_string)
+        if pipelined:
+            self.perform_quiz_pipelined()
+        else:
+            for quiz in self.iter_quizzes(self.total_quiz_number):
+                result = self.submit(quiz, quiz.get_user_answer())
+                if not result.correct:
+                    print(wrong_answer_message(result.right_answer))
+                    message = diagnosis_message(quiz, result.diagnosis)
+                    if message:
+                        print(message)
+        self.close()
+
+    def perform_quiz_pipelined(self):
+        '''
+        Ask total_quiz_number quizzes. Only the terminal I/O and the grading
+        run here: sampling, conjugation and record, with the write of the
+        store, run in order on one worker thread, so the practice history
+        is only touched by one thread. The quiz after the current one is
+        sampled before the current answer is recorded.
+        '''
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=1)
+        recorded = None
+        try:
+            for quiz in self.iter_prefetched_quizzes(self.total_quiz_number,
+                                                     executor):
+                quiz.get_user_answer()
+                if recorded is not None:
+                    # raise the error of the last record, if any
+                    recorded.result()
+                if quiz.grade():
+                    print(wrong_answer_message(quiz.right_answer))
+                    message = diagnosis_message(quiz, self.diagnose(quiz))
+                    if message:
+                        print(message)
+                recorded = executor.submit(self.record, quiz)
+            if recorded is not None:
+                recorded.result()
+        finally:
+            executor.shutdown(wait=True)
+
+    def iter_prefetched_quizzes(self, total_quiz_number, executor):
+        '''
+        Yield the quizzes of iter_quizzes, the next quiz being worked out on
+        executor while the current one is answered
+        '''
+        quizzes = self.iter_quizzes(total_quiz_number)
+        future = executor.submit(next, quizzes, None)
+        while True:
+            quiz = future.result()
+            if quiz is None:
+                return
+            future = executor.submit(next, quizzes, None)
+            yield quiz
+
+
+class Practice(QuizLoop):
+    '''
+    Class Practice
+    '''
+
+    def __init__(self, store=None, session_log_size=100,
+                 lenient_near_miss=False, weighting=None, scheduled=True,
+                 verb_lib='Japanese_verb_base.jvp',
+                 form_lib='Japanese_verb_form.jvp', reverse_index=None,
+                 lexicon=None):
+        self.total_quiz_number = 0
+        self.verb_lib = verb_lib
+        self.form_lib = form_lib
+        # the Lexicon of verb_lib, loaded by read_verb_lib if not given
+        self.lexicon = lexicon
+        # record near misses without the penalty of a wrong answer streak
+        self.lenient_near_miss = lenient_near_miss
+        # the relative weight of the answers to come, the weighting saved
+        # with the practice history if not given, else error. If weighting
+        # is given and is not the saved one, the relative weights of the
+        # practice history are recomputed with it once loaded
+        self.weighting = weighting_of(weighting or 'error')
+        self.given_weighting = weighting
+        self.saved_weighting = None
+        self.weights_changed = False
+        # ask the verbs due for review first, by their spaced repetition
+        # schedule, then sample by the relative weights
+        self.scheduled = scheduled
+        self.scheduler = None
+        self.clock = time.time
+        # the last session_log_size quizzes of the session
+        self.verbs = deque(maxlen=session_log_size)
+        self.verbs_base_avail = None
+        self.verbs_kanji_avail = None
+        self.verbs_type_avail = None
+        self.verbs_form_avail = None
+        self.verbs_error = None
+        self.current_quiz_number = 0
+        # the HistoryTable of the practice history
+        self.practice_history = None
+        self.history_index = {}
+        self.weight_tree = None
+        # the ReverseConjugationIndex of the libs, shared_reverse_index if
+        # not given
+        self.reverse_index = reverse_index
+        if store is None:
+            store = CsvHistoryStore()
+        self.store = store
+        self.initial()
+
+    def initial(self):
+        '''
+        Initial the quiz
+        '''
+        self.read_verb_lib()
+        self.read_form_lib()
+        if self.reverse_index is None:
+            self.reverse_index = shared_reverse_index(
+                self.verb_lib, self.form_lib, self.verbs_base_avail,
+                self.verbs_kanji_avail, self.verbs_type_avail,
+                self.verbs_form_avail)
+        self.load_practice_history()
+        conjugation_cache.load()
+
+    def load_practice_history(self):
+        '''
+        Load practice history. If there isn't a history, set up one
+        Return the report of reconcile_practice_history
+        '''
+        practice_history = self.store.load()
+        if practice_history is not None:
+            # all available in practice history?
+            practice_history, self.reconcile_report = \
+                self.reconcile_practice_history(practice_history, 3.0)
+        else:
+            # initial the practice history
+            practice_history, self.reconcile_report = \
+                self.reconcile_practice_history(HistoryTable(), 1.0)
+        self.practice_history = practice_history
+        self.index_practice_history()
+        self.store.sync(self.practice_history, self.history_index)
+        self.weight_tree = WeightTree(self.practice_history['relative_weight'])
+        self.saved_weighting = self.store.load_weighting()
+        if self.given_weighting is None:
+            if self.saved_weighting in weighting_strategies:
+                self.weighting = weighting_of(self.saved_weighting)
+        elif self.given_weighting != self.saved_weighting:
+            self.set_weighting(self.given_weighting)
+        self.save_weighting()
+        if self.scheduled:
+            self.scheduler = Scheduler(self.practice_history['due_time'])
+        return self.reconcile_report
+
+    def set_weighting(self, weighting):
+        '''
+        Use weighting, a name of weighting_strategies or a function of the
+        counter columns, and recompute the relative_weight of the whole
+        practice history with it in one NumPy expression
+        '''
+        self.weighting = weighting_of(weighting)
+        practice_history = self.practice_history
+        relative_weights = np.empty(len(practice_history))
+        relative_weights[:] = self.weighting(*[practice_history.view(column)
+                                               for column in counter_columns])
+        current = practice_history.view('relative_weight')
+        if np.array_equal(relative_weights, current):
+            return
+        current[:] = relative_weights
+        self.weight_tree.rebuild(practice_history['relative_weight'])
+        # every row changed, close() saves the whole practice history
+        self.weights_changed = True
+
+    def save_weighting(self):
+        '''
+        Save the name of the weighting with the practice history, after the
+        whole practice history if set_weighting changed it, so the relative
+        weights saved are of one weighting. A weighting function not in
+        weighting_strategies is not saved, nor error for a practice history
+        without a saved weighting, as it is the default
+        '''
+        if self.weights_changed:
+            self.store.flush()
+            self.store.save(self.practice_history)
+            self.weights_changed = False
+        name = weighting_name(self.weighting)
+        if name is not None and name != (self.saved_weighting or 'error'):
+            self.store.save_weighting(name)
+            self.saved_weighting = name
+
+    def reconcile_practice_history(self, practice_history, new_weight):
+        '''
+        Add the rows of the available verbs and forms missing in the
+        practice history, with relative_weight new_weight, and drop the
+        rows of the verbs and forms no longer available.
+        Return the practice history, the same object if nothing changed,
+        and a report of the changes
+        '''
+        verbs = list(OrderedDict.fromkeys(
+            (verb_base, normalize_kanji(verb_kanji)) for verb_base, verb_kanji
+            in zip(self.verbs_base_avail, self.verbs_kanji_avail)))
+        forms = list(OrderedDict.fromkeys(self.verbs_form_avail))
+        verb_set = set(verbs)
+        form_set = set(forms)
+        keys = list(zip(practice_history['verb_base'],
+                        practice_history['verb_kanji'],
+                        practice_history['verb_form']))
+        history_verbs = set((verb_base, verb_kanji)
+                            for verb_base, verb_kanji, verb_form in keys)
+        history_forms = set(verb_form for verb_base, verb_kanji, verb_form in keys)
+        keep = [(verb_base, verb_kanji) in verb_set and verb_form in form_set
+                for verb_base, verb_kanji, verb_form in keys]
+        key_set = set(keys)
+        missing = [(verb_base, verb_kanji, verb_form)
+                   for verb_base, verb_kanji in verbs for verb_form in forms
+                   if (verb_base, verb_kanji, verb_form) not in key_set]
+        report = {
+            'added_verbs': [verb for verb in verbs if verb not in history_verbs],
+            'removed_verbs': sorted(history_verbs - verb_set,
+                                    key=lambda verb: (verb[0], verb[1] or '')),
+            'added_forms': [form for form in forms if form not in history_forms],
+            'removed_forms': sorted(history_forms - form_set),
+            'added_rows': len(missing),
+            'removed_rows': keep.count(False)}
+        if not missing and all(keep):
+            return practice_history, report
+        practice_history = practice_history.select(keep)
+        practice_history.append_rows(missing, new_weight)
+        return practice_history, report
+
+    def sample_verb(self):
+        '''
+        Choose a verb according to the sample history: the verb due for
+        review the longest, else a weighted sample
+        '''
+        index = self.pop_due()
+        if index is None:
+            index = self.weight_tree.sample()
+        return self.verb_at(index)
+
+    def pop_due(self):
+        '''
+        Take the index of the verb due for review the longest, None if no
+        verb is due or the practice is not scheduled
+        '''
+        if self.scheduler is None:
+            return None
+        return self.scheduler.pop_due(self.clock())
+
+    def release(self, quiz):
+        '''
+        Put a quiz dropped without an answer back in the schedule, if it was
+        taken by pop_due
+        '''
+        if self.scheduler is not None:
+            self.scheduler.release(self.find_verb_in_practice_history(quiz))
+
+    def peek_due(self):
+        '''
+        Return the due time of the verb pop_due would take, None if no verb
+        is due or the practice is not scheduled
+        '''
+        if self.scheduler is None:
+            return None
+        return self.scheduler.peek_due(self.clock())
+
+    def verb_at(self, index):
+        '''
+        Return the Verb of the row of index, logged in verbs
+        '''
+        verb = Verb(*self.practice_history.row(index, history_columns[:3]))
+        self.verbs.append(verb)
+        return verb
+
+    def iter_quizzes(self, total_quiz_number=None):
+        '''
+        Yield total_quiz_number quizzes, endless if None. A quiz is a Verb
+        with its right_answer worked out, sampled when it is asked for, so
+        the answers submitted before count in the sampling
+        '''
+        quiz_numbers = itertools.count() if total_quiz_number is None \
+            else range(total_quiz_number)
+        for i in quiz_numbers:
+            quiz = self.sample_verb()
+            quiz.get_right_answer()
+            yield quiz
+
+    def submit(self, quiz, user_answer):
+        '''
+        Grade the user_answer of a quiz of iter_quizzes and record it,
+        return a QuizResult, with what a wrong answer is the answer of
+        '''
+        quiz.user_answer = user_answer
+        quiz.grade()
+        self.record(quiz)
+        return QuizResult(quiz, user_answer, not quiz.error_flag,
+                          tuple(quiz.right_answer), self.diagnose(quiz),
+                          quiz.near_miss)
+
+    def diagnose(self, quiz):
+        '''
+        Return the (verb_base, verb_kanji, verb_form) the wrong user_answer
+        of a graded quiz is the right answer of
+        '''
+        if not quiz.error_flag:
+            return []
+        return self.reverse_index.diagnose(quiz, quiz.user_answer)
+
+    def read_verb_lib(self):
+        '''
+        Read the verbs lib, choose verb from that
+        '''
+        lexicon = self.lexicon
+        if lexicon is None:
+            lexicon = load_lexicon(self.verb_lib)
+            report_lexicon_errors(self.verb_lib, lexicon)
+        self.verbs_base_avail = lexicon.verbs_base
+        self.verbs_kanji_avail = lexicon.verbs_kanji
+        self.verbs_type_avail = lexicon.verb_types
+
+    def read_form_lib(self):
+        '''
+        Read the form lib
+        '''
+        self.verbs_form_avail = read_form_lib(self.form_lib)
+
+    def close(self, save_cache=True):
+        '''
+        Save the practice history, and the conjugation cache unless
+        save_cache is False, for the owner of several practices to save it
+        once
+        '''
+        self.save_weighting()
+        self.store.close(self.practice_history)
+        if save_cache:
+            conjugation_cache.save()
+
+    def record(self, verb):
+        '''
+        Record the practice history, include sample_time, error_time,
+        right_time, continue_error_time, continue_right_time,
+        relative_weight
+        '''
+        # Find the index of the verb
+        index = self.find_verb_in_practice_history(verb)
+        answers = [Answer(verb.error_flag, verb.near_miss,
+                          self.lenient_near_miss, self.clock())]
+        self.update_row(index, *fold_answers(
+            self.row_values(index, counter_columns),
+            self.row_values(index, schedule_columns), answers))
+        self.store.write_row(self.practice_history, index, answers,
+                             self.weighting)
+
+    def row_values(self, index, columns):
+        '''
+        Return the values of columns in the row of index
+        '''
+        return self.practice_history.row(index, columns)
+
+    def update_row(self, index, counters, schedule=None):
+        '''
+        Set the counters of the row of index, and its relative_weight by
+        the weighting, and its schedule (due_time, ease, interval_days)
+        if given. Return the relative_weight
+        '''
+        relative_weight = relative_weight_of(counters, self.weighting)
+        columns = history_columns[3:9]
+        values = list(counters) + [relative_weight]
+        if schedule is not None:
+            columns = history_columns[3:]
+            values += list(schedule)
+        self.practice_history.set_row(index, columns, values)
+        self.weight_tree.update(index, relative_weight)
+        if schedule is not None and self.scheduler is not None:
+            self.scheduler.update(index, schedule[0])
+        return relative_weight
+
+    def record_batch(self, answers):
+        '''
+        Record many answers at once. answers is an iterable of
+        (verb_base, verb_kanji, verb_form, error_flag, near_miss), read once: the
+        answers of a verb are folded in order, then every changed row is
+        updated and written once.
+        Return the number of answers recorded, and the number skipped
+        because the verb is not in the practice history or was not graded
+        '''
+        row_answers = OrderedDict()
+        recorded = 0
+        skipped = 0
+        now = self.clock()
+        for verb_base, verb_kanji, verb_form, error_flag, near_miss in answers:
+            index = self.history_index.get(
+                (verb_base, normalize_kanji(verb_kanji), verb_form))
+            if index is None or error_flag is None:
+                skipped += 1
+                continue
+            row_answers.setdefault(index, []).append(
+                Answer(error_flag, near_miss, self.lenient_near_miss, now))
+            recorded += 1
+        for index, index_answers in row_answers.items():
+            self.update_row(index, *fold_answers(
+                self.row_values(index, counter_columns),
+                self.row_values(index, schedule_columns), index_answers))
+            self.store.write_row(self.practice_history, index, index_answers,
+                                 self.weighting)
+        return recorded, skipped
+
+    def find_verb_in_practice_history(self, verb):
+        '''
+        Find the verb in the practice history
+        return the index number
+        '''
+        key = (verb.verb_base, normalize_kanji(verb.verb_kanji), verb.verb_form)
+        index = self.history_index.get(key)
+        if index is None:
+            errormessage = ''.join(['Not found verb:', verb_description(*key),
+                                    ' in practice_history!'])
+            raise ValueError(errormessage)
+        return index
+
+    def index_practice_history(self):
+        '''
+        Build the index from (verb_base, verb_kanji, verb_form) to the index
+        number of the practice history
+        '''
+        practice_history = self.practice_history
+        keys = list(zip(practice_history['verb_base'],
+                        practice_history['verb_kanji'],
+                        practice_history['verb_form']))
+        # the kanji of a HistoryTable are already normalized
+        self.history_index = dict(zip(keys, range(len(keys))))
+        if len(self.history_index) < len(keys):
+            # find the duplicated verb for the error
+            self.history_index = {}
+            for index, key in enumerate(keys):
+                self.add_to_history_index(index, *key)
+
+    def add_to_history_index(self, index, verb_base, verb_kanji, verb_form):
+        '''
+        Add a row of the practice history to the index
+        '''
+        key = (verb_base, normalize_kanji(verb_kanji), verb_form)
+        if key in self.history_index:
+            errormessage = ''.join(['Found more than one verb:',
+                                    verb_description(*key),
+                                    ' in practice_history!'])
+            raise ValueError(errormessage)
+        self.history_index[key] = index
+
+
+# the directory of the decks, a subdirectory for each deck with its verb lib,
+# Japanese_verb_base.jvp, its practice history, and its own form lib if it
+# has one, else the form lib of the current directory
+deck_dir = 'decks'
+
+def list_decks(path=None):
+    '''
+    Return the names of the decks under path, without reading them
+    '''
+    if path is None:
+        path = deck_dir
+    if not os.path.isdir(path):
+        return []
+    return sorted(name for name in os.listdir(path) if os.path.isfile(
+        os.path.join(path, name, 'Japanese_verb_base.jvp')))
+
+def open_deck(name, path=None, **options):
+    '''
+    Return the Practice of the deck name under path, with its practice
+    history shard. options are passed to Practice
+    '''
+    if path is None:
+        path = deck_dir
+    deck = os.path.join(path, name)
+    verb_lib = os.path.join(deck, 'Japanese_verb_base.jvp')
+    if not os.path.isfile(verb_lib):
+        errormessage = ''.join(['Not found deck: ', name, ' in ', path,
+                                ', expected one of: ', ', '.join(list_decks(path))])
+        raise ValueError(errormessage)
+    form_lib = os.path.join(deck, 'Japanese_verb_form.jvp')
+    if not os.path.isfile(form_lib):
+        form_lib = 'Japanese_verb_form.jvp'
+    if 'store' not in options:
+        options['store'] = CsvHistoryStore(
+            os.path.join(deck, 'practice_history.csv'))
+    return Practice(verb_lib=verb_lib, form_lib=form_lib, **options)
+
+
+class DeckSession(QuizLoop):
+    '''
+    Class DeckSession
+    A session over several decks, each with a Practice and a practice
+    history shard of its own. Every deck of the session is read on the
+    first draw, which needs the due times and the weights of all of them;
+    the decks not in the session are never read. A quiz is the verb due
+    for review the longest over all the decks, else a weighted sample
+    from a deck chosen by the total relative weight of its practice
+    history
+    '''
+
+    def __init__(self, decks, path=None, max_pending=100, **options):
+        if not decks:
+            raise ValueError('A deck session needs at least one deck')
+        self.path = path
+        self.options = options
+        self.total_quiz_number = 0
+        # the Practice of every deck, None until it is used
+        self.practices = OrderedDict((name, None) for name in decks)
+        # the deck of the quizzes not yet submitted
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+
+    def practice(self, name):
+        '''
+        Return the Practice of the deck name, opened on first use
+        '''
+        practice = self.practices[name]
+        if practice is None:
+            practice = open_deck(name, self.path, **self.options)
+            self.practices[name] = practice
+        return practice
+
+    def sample_verb(self):
+        '''
+        Choose a verb in the decks: the verb due for review the longest,
+        from the deck whose earliest due time is the smallest, else a
+        weighted sample of a deck drawn by its total weight. Return the
+        Verb, its deck is kept until it is submitted
+        '''
+        names = list(self.practices)
+        practices = [self.practice(name) for name in names]
+        due = [(due_time, i) for i, due_time in
+               enumerate(practice.peek_due() for practice in practices)
+               if due_time is not None]
+        if due:
+            i = min(due)[1]
+            index = practices[i].pop_due()
+            return self.add_pending(names[i], practices[i].verb_at(index))
+        totals = list(itertools.accumulate(
+            practice.weight_tree.total() for practice in practices))
+        value = random.random() * totals[-1]
+        for name, practice, total in zip(names, practices, totals):
+            if value < total:
+                break
+        return self.add_pending(name, practice.sample_verb())
+
+    def add_pending(self, name, quiz):
+        '''
+        Keep the deck of a quiz until it is submitted, the oldest quizzes
+        beyond max_pending are dropped and put back in their schedule
+        '''
+        self.pending[id(quiz)] = (quiz, name)
+        while len(self.pending) > self.max_pending:
+            dropped, dropped_name = self.pending.popitem(last=False)[1]
+            self.practice(dropped_name).release(dropped)
+        return quiz
+
+    def deck_of(self, quiz):
+        '''
+        Return the name of the deck of a quiz of sample_verb
+        '''
+        entry = self.pending.get(id(quiz))
+        if entry is None or entry[0] is not quiz:
+            raise ValueError(''.join(['Not a pending quiz: ',
+                                      verb_description(quiz.verb_base,
+                                                       quiz.verb_kanji,
+                                                       quiz.verb_form)]))
+        return entry[1]
+
+    def iter_quizzes(self, total_quiz_number=None):
+        '''
+        Yield total_quiz_number quizzes of the decks, endless if None
+        '''
+        quiz_numbers = itertools.count() if total_quiz_number is None \
+            else range(total_quiz_number)
+        for i in quiz_numbers:
+            quiz = self.sample_verb()
+            quiz.get_right_answer()
+            yield quiz
+
+    def submit(self, quiz, user_answer):
+        '''
+        Grade and record the user_answer of a quiz in its deck, return a
+        QuizResult
+        '''
+        result = self.practice(self.deck_of(quiz)).submit(quiz, user_answer)
+        self.pending.pop(id(quiz), None)
+        return result
+
+    def record(self, quiz):
+        self.practice(self.deck_of(quiz)).record(quiz)
+        self.pending.pop(id(quiz), None)
+
+    def diagnose(self, quiz):
+        return self.practice(self.deck_of(quiz)).diagnose(quiz)
+
+    def close(self):
+        '''
+        Save the practice histories of the decks used, then the conjugation
+        cache once
+        '''
+        practices = [practice for practice in self.practices.values()
+                     if practice is not None]
+        for practice in practices:
+            practice.close(save_cache=False)
+        if practices:
+            conjugation_cache.save()
+
+
+# Random-number sampling using the Walker-Vose alias method,
+# Copyright: Joachim Wuttke, Forschungszentrum Juelich GmbH (2013)
+# M. D. Vose, IEEE T. Software Eng. 17, 972 (1991)
+# A. J. Walker, Electronics Letters 10, 127 (1974); ACM TOMS 3, 253 (1977)
+class AliasTable(object):
+    '''
+    Class AliasTable
+    '''
+    def __init__(self, pdf):
+        self.p = pdf[:]
+        self.alias = None
+        self.prob = None
+        self.calc_alias()
+
+    def calc_alias(self):
+        n = len(self.p)
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        small = [0.0] * n
+        large = [0.0] * n
+        for i in range(n):
+            self.p[i] *= n
+
+         # Set separate index lists for small and large probabilities:
+        n_s, n_l = 0, 0
+        for i in range(n-1, -1, -1):
+            if self.p[i] < 1:
+                small[n_s] = i
+                n_s += 1
+            else:
+               large[n_l] = i
+               n_l += 1
+
+        # Work through index lists
+        while n_s and n_l:
+            n_s -= 1
+            a = small[n_s]
+            n_l -= 1
+            g = large[n_l]
+            self.prob[a] = self.p[a]
+            self.alias[a] = g
+            self.p[g] = self.p[g] + self.p[a] - 1
+            if self.p[g] < 1:
+                small[n_s] = g
+                n_s += 1
+            else:
+                large[n_l] = g
+                n_l += 1
+
+        while n_l:
+            n_l -= 1
+            self.prob[large[n_l]] = 1
+
+        while n_s:
+          # can only happen through numeric instability
+            n_s -= 1
+            self.prob[small[n_s] ] = 1;
+
+    def sample_pdf(self):
+        rand1 = random.random()
+        rand2 = random.random()
+        i = int(len(self.p) * rand1)
+        if rand2 < self.prob[i]:
+            return i
+        else:
+            return self.alias[i]
+
+class NumpyAliasTable(object):
+    '''
+    Class NumpyAliasTable
+    Walker-Vose alias table built and sampled with NumPy
+    '''
+    def __init__(self, pdf, rng=None):
+        # pdf is used as it is when it already is a float ndarray
+        self.p = np.asarray(pdf, dtype=float)
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.prob = None
+        self.alias = None
+        self.calc_alias()
+
+    def calc_alias(self):
+        '''
+        Vectorized Vose construction. Lay the deficits 1 - n*p of the small
+        entries end to end, and the surpluses n*p - 1 of the large entries
+        end to end on the same line. A small entry takes the large entry
+        whose surplus covers the start of its deficit as alias. A large
+        entry is left below 1 by the small entry it has overshot on, and
+        takes the next large entry as alias.
+        '''
+        n = len(self.p)
+        q = self.p * (n / self.p.sum())
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+        small = np.flatnonzero(q < 1)
+        large = np.flatnonzero(q >= 1)
+        if not len(small) or not len(large):
+            return
+        deficit = 1 - q[small]
+        deficit_end = np.cumsum(deficit)
+        deficit_start = deficit_end - deficit
+        surplus_end = np.cumsum(q[large] - 1)
+        donor = np.searchsorted(surplus_end, deficit_start, side='right')
+        self.prob[small] = q[small]
+        self.alias[small] = large[np.minimum(donor, len(large) - 1)]
+        # small entries started before each surplus end
+        started = np.searchsorted(deficit_start, surplus_end[:-1], side='left')
+        overshoot = np.where(started > 0,
+                             deficit_end[np.maximum(started - 1, 0)] -
+                             surplus_end[:-1], 0.0)
+        self.prob[large[:-1]] = np.clip(1 - overshoot, 0.0, 1.0)
+        self.alias[large[:-1]] = large[1:]
+
+    def sample(self, k):
+        '''
+        Draw k indices at once
+        '''
+        n = len(self.p)
+        i = self.rng.integers(n, size=k)
+        u = self.rng.random(k)
+        return np.where(u < self.prob[i], i, self.alias[i])
+
+    def sample_pdf(self):
+        return int(self.sample(1)[0])
+
+class WeightTree(object):
+    '''
+    Class WeightTree
+    Fenwick tree of sample weights, a weight can be changed and a weighted
+    sample drawn in O(log n), and all the weights set at once in O(n).
+    The weights and the nodes are array.array of float64
+    '''
+    def __init__(self, weights):
+        self.rebuild(weights)
+
+    def rebuild(self, weights):
+        '''
+        Set all the weights at once. Every node adds its sum to its parent,
+        the next node covering it, in one pass
+        '''
+        self.weights = array.array('d', weights)
+        self.n = len(self.weights)
+        tree = array.array('d', [0.0])
+        tree.extend(self.weights)
+        n = self.n
+        for i in range(1, n + 1):
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.top_bit = 1
+        while self.top_bit * 2 <= self.n:
+            self.top_bit *= 2
+
+    def __len__(self):
+        return self.n
+
+    def update(self, index, weight):
+        '''
+        Set the weight of index
+        '''
+        weight = float(weight)
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        i = index + 1
+        while i <= self.n:
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, count):
+        '''
+        Sum of the first count weights
+        '''
+        total = 0.0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+    def total(self):
+        return self.prefix_sum(self.n)
+
+    def find(self, value):
+        '''
+        Return the index whose cumulative weight interval contains value
+        '''
+        pos = 0
+        bit = self.top_bit
+        while bit:
+            next_pos = pos + bit
+            if next_pos <= self.n and self.tree[next_pos] <= value:
+                pos = next_pos
+                value -= self.tree[next_pos]
+            bit >>= 1
+        return min(pos, self.n - 1)
+
+    def sample(self):
+        '''
+        Draw an index with probability proportional to its weight
+        '''
+        return self.find(random.random() * self.total())
+
+class Scheduler(object):
+    '''
+    Class Scheduler
+    Min-heap of (due_time, index) of the scheduled rows of the practice
+    history, the rows never answered (due_time 0) left to the weighted
+    sample. A new due time of a row is pushed, and its old entry dropped
+    only when it comes to the top, so a change and taking the next due
+    row are O(log n). The heap is rebuilt when the dropped entries
+    outnumber the rows. The rows taken and not yet answered are kept, to
+    be put back with release() if their quiz is dropped.
+    '''
+    def __init__(self, due_times):
+        self.due_times = [float(due_time) for due_time in due_times]
+        self.rebuild()
+
+    def rebuild(self):
+        self.heap = [(due_time, index)
+                     for index, due_time in enumerate(self.due_times)
+                     if due_time > 0]
+        heapq.heapify(self.heap)
+        self.scheduled = len(self.heap)
+        self.taken = set()
+
+    def __len__(self):
+        return self.scheduled
+
+    def update(self, index, due_time):
+        '''
+        Set the due time of the row of index
+        '''
+        due_time = float(due_time)
+        if self.due_times[index] <= 0 < due_time:
+            self.scheduled += 1
+        self.due_times[index] = due_time
+        self.taken.discard(index)
+        heapq.heappush(self.heap, (due_time, index))
+        if len(self.heap) > 2 * self.scheduled + 64:
+            self.rebuild()
+
+    def pop_due(self, now):
+        '''
+        Take the row due the longest at time now, None if no row is due.
+        It is not due again before its next update, its release, or the
+        next rebuild
+        '''
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            due_time, index = heapq.heappop(heap)
+            if self.due_times[index] == due_time:
+                self.taken.add(index)
+                return index
+        return None
+
+    def release(self, index):
+        '''
+        Put back a row taken by pop_due whose quiz was dropped unanswered,
+        due at its due time again
+        '''
+        if index in self.taken:
+            self.taken.discard(index)
+            heapq.heappush(self.heap, (self.due_times[index], index))
+
+    def peek_due(self, now):
+        '''
+        Return the due time of the row pop_due(now) would take, None if no
+        row is due. The dropped entries on top are popped on the way
+        '''
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            due_time, index = heap[0]
+            if self.due_times[index] == due_time:
+                return due_time
+            heapq.heappop(heap)
+        return None
+
+    def due_count(self, now):
+        '''
+        Number of the rows due at time now, in O(n)
+        '''
+        return sum(1 for due_time in self.due_times if 0 < due_time <= now)
+
+
+class ReverseConjugationIndex(object):
+    '''
+    Class ReverseConjugationIndex
+    Finds the verbs and forms a surface can be the answer of. An answer is
+    a stem of the verb plus an ending of the compiled rules, so only the
+    kana and kanji stems of the verbs are kept, with the set of endings;
+    the verbs not following their rule (type 3 and the overrides) keep
+    all their answers. A lookup tries the endings by length, a hash
+    lookup each, then checks the candidate verbs with conjugate()
+    '''
+    def __init__(self, forms):
+        self.form_ids = [form_table.id_of(verb_form)
+                         for verb_form in OrderedDict.fromkeys(forms)]
+        self.stems = {}
+        self.surfaces = {}
+        self.endings = set()
+        self.ending_lengths = []
+        self.verb_types = {}
+        self.rule_groups = set()
+        # the verb bases and kanjis with overrides
+        self.irregular_verbs = set(surface for verb_form, surface
+                                   in list(verb_overrides) + list(surface_overrides))
+
+    def __len__(self):
+        return len(self.verb_types)
+
+    def add_entry(self, table, key, verb_id):
+        # a single verb id, or a tuple of them for the shared keys
+        verb_ids = table.get(key)
+        if verb_ids is None:
+            table[key] = verb_id
+        elif isinstance(verb_ids, tuple):
+            if verb_id not in verb_ids:
+                table[key] = verb_ids + (verb_id,)
+        elif verb_ids != verb_id:
+            table[key] = (verb_ids, verb_id)
+
+    def add_verb(self, verb_base, verb_kanji, verb_type=None):
+        '''
+        Index a verb in all the forms, verb_type is worked out if not given
+        '''
+        verb_kanji = normalize_kanji(verb_kanji)
+        verb_id = verb_table.id_of((verb_base, verb_kanji))
+        if verb_id in self.verb_types:
+            return
+        if verb_type is None:
+            verb_type = verb_type_of(verb_base, verb_kanji)
+        self.verb_types[verb_id] = verb_type
+        final = verb_base if verb_type == 3 else verb_base[-1:]
+        if verb_type == 3 or verb_base in self.irregular_verbs or \
+                verb_kanji in self.irregular_verbs:
+            for form_id in self.form_ids:
+                for surface in conjugate(verb_base, verb_kanji,
+                                         form_table[form_id], verb_type):
+                    self.add_entry(self.surfaces, surface, verb_id)
+            if verb_type == 3:
+                return
+        self.add_entry(self.stems, verb_base[:-1], verb_id)
+        if verb_kanji is not None:
+            self.add_entry(self.stems, verb_kanji[:-1], verb_id)
+        if (verb_type, final) in self.rule_groups:
+            return
+        self.rule_groups.add((verb_type, final))
+        for form_id in self.form_ids:
+            drop, ending, kanji_ending, answers, overridden = \
+                conjugation_rule(form_table[form_id], verb_type, final)
+            self.endings.add(ending)
+            self.endings.add(kanji_ending)
+        self.ending_lengths = sorted(set(len(ending) for ending in self.endings))
+
+    def add_verbs(self, bases, kanjis, types=None):
+        if types is None:
+            types = [None] * len(bases)
+        for verb_base, verb_kanji, verb_type in zip(bases, kanjis, types):
+            self.add_verb(verb_base, verb_kanji, verb_type)
+
+    def lookup(self, surface):
+        '''
+        Return the (verb_id, form_id) the surface is an answer of
+        '''
+        candidates = []
+        for table_verb_ids in [self.surfaces.get(surface)] + \
+                [self.stems.get(surface[:len(surface) - length])
+                 for length in self.ending_lengths
+                 if length <= len(surface) and
+                 surface[len(surface) - length:] in self.endings]:
+            if table_verb_ids is None:
+                continue
+            if not isinstance(table_verb_ids, tuple):
+                table_verb_ids = (table_verb_ids,)
+            for verb_id in table_verb_ids:
+                if verb_id not in candidates:
+                    candidates.append(verb_id)
+        matches = []
+        for verb_id in candidates:
+            verb_base, verb_kanji = verb_table[verb_id]
+            for form_id in self.form_ids:
+                if surface in conjugate(verb_base, verb_kanji, form_table[form_id],
+                                        self.verb_types[verb_id]):
+                    matches.append((verb_id, form_id))
+        return matches
+
+    def diagnose(self, quiz, user_answer):
+        '''
+        Return the (verb_base, verb_kanji, verb_form) a wrong answer to the
+        quiz is the right answer of, the forms of the verb of the quiz first
+        '''
+        if not isinstance(user_answer, str) or not user_answer:
+            return []
+        matches = [match for match in self.lookup(user_answer)
+                   if match != (quiz.verb_id, quiz.form_id)]
+        matches.sort(key=lambda match: match[0] != quiz.verb_id)
+        return [verb_table[verb_id] + (form_table[form_id],)
+                for verb_id, form_id in matches]
+
+# the ReverseConjugationIndex of a (verb lib, form lib) by their paths, with
+# the modification times and sizes of the libs it was built from
+reverse_indexes = {}
+
+def shared_reverse_index(verb_lib, form_lib, bases, kanjis, types, forms):
+    '''
+    Return the ReverseConjugationIndex of the verbs and forms read from
+    verb_lib and form_lib, built on the first call for the libs, and again
+    only when one of them changes
+    '''
+    key = (os.path.abspath(verb_lib), os.path.abspath(form_lib))
+    stats = tuple((stat.st_mtime_ns, stat.st_size)
+                  for stat in (os.stat(verb_lib), os.stat(form_lib)))
+    entry = reverse_indexes.get(key)
+    if entry is not None and entry[0] == stats:
+        return entry[1]
+    index = ReverseConjugationIndex(forms)
+    index.add_verbs(bases, kanjis, types)
+    reverse_indexes[key] = (stats, index)
+    return index
+
+class Instrumentation(object):
+    '''
+    Class Instrumentation
+    Per phase timers of the quiz loop, as latency histograms. enable()
+    wraps the methods of the phases with timers, and disable() puts the
+    original methods back, so a disabled instrumentation costs nothing.
+    With profile, a cProfile of the whole session is captured, and with
+    trace_memory the allocations are traced with tracemalloc.
+    '''
+    # upper bounds of the histogram buckets, in seconds
+    buckets = (1e-06, 2.5e-06, 5e-06, 1e-05, 2.5e-05, 5e-05, 0.0001, 0.00025,
+               0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0, 10.0)
+    # (class name, method name) of the phases
+    phases = (('Practice', 'load_practice_history'),
+              ('Practice', 'sample_verb'),
+              ('Scheduler', 'pop_due'),
+              ('Verb', 'get_right_answer'),
+              ('Verb', 'calc_right_answer'),
+              ('Practice', 'find_verb_in_practice_history'),
+              ('Practice', 'record'),
+              ('Practice', 'submit'),
+              ('Practice', 'diagnose'),
+              ('CsvHistoryStore', 'write_row'),
+              ('CsvHistoryStore', 'flush'),
+              ('CsvHistoryStore', 'save'),
+              ('MemmapHistoryStore', 'write_row'),
+              ('MemmapHistoryStore', 'save'),
+              ('SqliteHistoryStore', 'write_row'),
+              ('SqliteHistoryStore', 'flush'),
+              ('Practice', 'close'))
+
+    def __init__(self):
+        import threading
+        self.lock = threading.Lock()
+        self.originals = {}
+        self.histograms = OrderedDict()
+        self.profiler = None
+        self.profile = None
+        self.trace_memory = False
+        self.memory = None
+
+    @property
+    def enabled(self):
+        return bool(self.originals)
+
+    def enable(self, profile=False, trace_memory=False):
+        '''
+        Start timing the phases, and profiling or tracing the memory
+        '''
+        if not self.enabled:
+            for class_name, method_name in self.phases:
+                owner = globals()[class_name]
+                method = owner.__dict__[method_name]
+                self.originals[(class_name, method_name)] = method
+                setattr(owner, method_name,
+                        self.timed(''.join([class_name, '.', method_name]),
+                                   method))
+        if profile and self.profiler is None:
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if trace_memory and not self.trace_memory:
+            import tracemalloc
+            tracemalloc.start()
+            self.trace_memory = True
+
+    def disable(self, top=20):
+        '''
+        Put the original methods back, and keep the top functions of the
+        profile and the top allocations
+        '''
+        for (class_name, method_name), method in self.originals.items():
+            setattr(globals()[class_name], method_name, method)
+        self.originals = {}
+        if self.profiler is not None:
+            import pstats
+            self.profiler.disable()
+            stats = pstats.Stats(self.profiler).stats
+            functions = sorted(stats.items(), key=lambda item: -item[1][3])
+            self.profile = [
+                {'function': ''.join([os.path.basename(filename), ':',
+                                      str(line), '(', name, ')']),
+                 'calls': calls, 'self_seconds': self_seconds,
+                 'cumulative_seconds': cumulative_seconds}
+                for (filename, line, name), (primitive_calls, calls, self_seconds,
+                                             cumulative_seconds, callers)
+                in functions[:top]]
+            self.profiler = None
+        if self.trace_memory:
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.trace_memory = False
+            self.memory = {'current_bytes': current, 'peak_bytes': peak,
+                           'top': [{'where': str(stat.traceback),
+                                    'bytes': stat.size, 'blocks': stat.count}
+                                   for stat in snapshot.statistics('lineno')[:top]]}
+
+    def timed(self, phase, method):
+        '''
+        Wrap a method with a timer of the phase
+        '''
+        import functools
+        observe = self.observe
+
+        @functools.wraps(method)
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                observe(phase, time.perf_counter() - start)
+        return timed_method
+
+    def observe(self, phase, seconds):
+        '''
+        Add a time of the phase to its histogram
+        '''
+        import bisect
+        with self.lock:
+            histogram = self.histograms.get(phase)
+            if histogram is None:
+                histogram = {'count': 0, 'sum': 0.0, 'max': 0.0,
+                             'buckets': [0] * (len(self.buckets) + 1)}
+                self.histograms[phase] = histogram
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            if seconds > histogram['max']:
+                histogram['max'] = seconds
+            histogram['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+        self.profile = None
+        self.memory = None
+
+    def quantile(self, histogram, fraction):
+        '''
+        Upper bound of the bucket of the quantile, the max in the last one
+        '''
+        rank = fraction * histogram['count']
+        total = 0
+        for bound, count in zip(self.buckets, histogram['buckets']):
+            total += count
+            if total >= rank:
+                return min(bound, histogram['max'])
+        return histogram['max']
+
+    def report(self):
+        '''
+        The histograms with their p50 and p99, the profile and the memory
+        '''
+        phases = OrderedDict()
+        with self.lock:
+            for phase, histogram in self.histograms.items():
+                phases[phase] = {
+                    'count': histogram['count'], 'sum': histogram['sum'],
+                    'mean': histogram['sum'] / histogram['count'],
+                    'p50': self.quantile(histogram, 0.5),
+                    'p99': self.quantile(histogram, 0.99),
+                    'max': histogram['max'],
+                    'buckets': OrderedDict(zip(
+                        [repr(bound) for bound in self.buckets] + ['+Inf'],
+                        histogram['buckets']))}
+        report = {'phases': phases}
+        if self.profile is not None:
+            report['profile'] = self.profile
+        if self.memory is not None:
+            report['memory'] = self.memory
+        return report
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def to_prometheus(self, prefix='jvp'):
+        '''
+        The histograms in the Prometheus text format
+        '''
+        name = prefix + '_phase_seconds'
+        lines = ['# HELP ' + name + ' Time spent in the phases of quiz sessions',
+                 '# TYPE ' + name + ' histogram']
+        with self.lock:
+            for phase, histogram in self.histograms.items():
+                label = ''.join(['phase="', phase, '"'])
+                total = 0
+                for bound, count in zip(
+                        [repr(bound) for bound in self.buckets] + ['+Inf'],
+                        histogram['buckets']):
+                    total += count
+                    lines.append(''.join([name, '_bucket{', label, ',le="',
+                                          bound, '"} ', str(total)]))
+                lines.append(''.join([name, '_sum{', label, '} ',
+                                      repr(histogram['sum'])]))
+                lines.append(''.join([name, '_count{', label, '} ',
+                                      str(histogram['count'])]))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path):
+        '''
+        Write the report, in the Prometheus text format for a .prom file,
+        else as JSON
+        '''
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+instrumentation = Instrumentation()
+
+# the final kana of a verb
+verb_endings = 'うくぐすつぬぶむる'
+# the version of the layout of the lexicon cache
+lexicon_cache_format = 2
+# the header of the lexicon cache: the magic, the format, the modification
+# time and size of the verb lib, lexicon_version in hex, the byte lengths of
+# the UTF-8 verb bases and verb kanjis, the number of verbs, the byte length
+# of the errors as UTF-8 JSON and the number of duplicates. The verb bases,
+# the verb kanjis, one byte of verb type per verb and the errors follow
+lexicon_cache_magic = b'JVPL'
+lexicon_cache_header = '<4sHqq32sIIIII'
+
+# a line of a verb lib skipped, and why
+LexiconError = namedtuple('LexiconError', ['line_number', 'line', 'message'])
+# the verbs of a verb lib, in the order of the file without duplicates, 'None'
+# for a verb without kanji, with their verb type, the errors of the lines
+# skipped, and the number of duplicate lines dropped
+Lexicon = namedtuple('Lexicon', ['verbs_base', 'verbs_kanji', 'verb_types',
+                                 'errors', 'duplicates'])
+
+def iter_lexicon_lines(path):
+    '''
+    Yield the (line_number, line, fields) of a verb lib one line at a time,
+    fields is [verb_base, verb_kanji], verb_kanji may be missing, or a
+    message if the line cannot be read. The format is by the extension:
+    JSON lines with these keys for .jsonl, CSV rows for .csv, tab separated
+    for .tsv, else whitespace separated as in .jvp. A first line of the
+    column names, empty lines and lines starting with # are skipped
+    '''
+    header = ['verb_base', 'verb_kanji']
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.csv'):
+            reader = csv.reader(f)
+            for row in reader:
+                fields = [field.strip() for field in row]
+                if not any(fields) or fields[0].startswith('#') or \
+                        (reader.line_num == 1 and fields[:2] == header):
+                    continue
+                yield reader.line_num, ','.join(row), fields
+            return
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if path.endswith('.jsonl'):
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    yield line_number, line, 'not valid JSON'
+                    continue
+                if not isinstance(row, dict) or 'verb_base' not in row:
+                    yield line_number, line, 'expected a JSON object with verb_base'
+                    continue
+                fields = [row['verb_base'], row.get('verb_kanji')]
+            elif path.endswith('.tsv'):
+                fields = [field.strip() for field in line.split('\t')]
+                if line_number == 1 and fields[:2] == header:
+                    continue
+            else:
+                fields = line.split()
+            yield line_number, line, fields
+
+def check_verb(verb_base, verb_kanji):
+    '''
+    Return what is wrong with a verb of a verb lib, None if it is valid:
+    verb_base is hiragana ending in a kana of the u row, and verb_kanji,
+    None for a verb without kanji, ends in the same kana
+    '''
+    if not isinstance(verb_base, str) or not verb_base:
+        return 'empty verb_base'
+    if not all('ぁ' <= kana <= 'ゖ' for kana in verb_base):
+        return ''.join(['verb_base: ', verb_base, ' is not all hiragana'])
+    if verb_base[-1] not in verb_endings:
+        return ''.join(['verb_base: ', verb_base,
+                        ' does not end in a kana of the u row'])
+    if verb_kanji is None:
+        return None
+    if not isinstance(verb_kanji, str) or \
+            any(char.isspace() or char < '\x80' for char in verb_kanji):
+        return ''.join(['verb_kanji: ', str(verb_kanji), ' is not Japanese'])
+    if verb_kanji[-1] != verb_base[-1]:
+        return ''.join(['verb_kanji: ', verb_kanji, ' does not end in ',
+                        verb_base[-1], ' as verb_base: ', verb_base])
+    return None
+
+def parse_lexicon(path):
+    '''
+    Read a verb lib line by line into a Lexicon. A line with more than two
+    fields or an invalid verb is skipped with a LexiconError, and a verb
+    read before is dropped as a duplicate
+    '''
+    verbs_base = []
+    verbs_kanji = []
+    verb_types = []
+    errors = []
+    duplicates = 0
+    seen = set()
+    for line_number, line, fields in iter_lexicon_lines(path):
+        if isinstance(fields, str):
+            errors.append(LexiconError(line_number, line, fields))
+            continue
+        if len(fields) > 2:
+            errors.append(LexiconError(
+                line_number, line, ''.join(['expected verb_base and verb_kanji, '
+                                            'got ', str(len(fields)), ' fields'])))
+            continue
+        verb_base = fields[0]
+        verb_kanji = fields[1] if len(fields) > 1 else None
+        if verb_kanji in ('', 'None'):
+            verb_kanji = None
+        message = check_verb(verb_base, verb_kanji)
+        if message is None:
+            try:
+                verb_type = verb_type_of(verb_base, verb_kanji)
+            except ValueError as error:
+                message = str(error)
+        if message is not None:
+            errors.append(LexiconError(line_number, line, message))
+            continue
+        if (verb_base, verb_kanji) in seen:
+            duplicates += 1
+            continue
+        seen.add((verb_base, verb_kanji))
+        verbs_base.append(verb_base)
+        verbs_kanji.append('None' if verb_kanji is None else verb_kanji)
+        verb_types.append(verb_type)
+    return Lexicon(verbs_base, verbs_kanji, verb_types, errors, duplicates)
+
+def lexicon_version():
+    '''
+    Hash of what the verb types of a lexicon depend on: the code of
+    verb_type_of, the kana table and the special v1 verbs
+    '''
+    code = inspect.unwrap(verb_type_of).__code__
+    digest = hashlib.md5(code.co_code)
+    digest.update(repr((code.co_consts, hiragana_rows, speacial_v1,
+                        lexicon_cache_format)).encode('utf-8'))
+    return digest.hexdigest()
+
+def load_lexicon(path, cache_path=None):
+    '''
+    Return the Lexicon of a verb lib, from its binary cache, path +
+    '.lexcache' by default, if the verb lib has the same modification time
+    and size as when the cache was written, else parsed and cached again.
+    A malformed cache is parsed again too
+    '''
+    if cache_path is None:
+        cache_path = path + '.lexcache'
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size, lexicon_version().encode('ascii'))
+    try:
+        with open(cache_path, 'rb') as f:
+            lexicon = read_lexicon_cache(f.read(), key)
+        if lexicon is not None:
+            return lexicon
+    except (IOError, ValueError, struct.error):
+        pass
+    lexicon = parse_lexicon(path)
+    temp_file = cache_path + '.tmp'
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(lexicon_cache_data(lexicon, key))
+        os.replace(temp_file, cache_path)
+    except IOError:
+        pass
+    return lexicon
+
+def lexicon_cache_data(lexicon, key):
+    '''
+    The bytes of the lexicon cache of a Lexicon, for the key of its verb lib
+    '''
+    verbs_base = '\n'.join(lexicon.verbs_base).encode('utf-8')
+    verbs_kanji = '\n'.join(lexicon.verbs_kanji).encode('utf-8')
+    errors = json.dumps([list(error) for error in lexicon.errors],
+                        ensure_ascii=False).encode('utf-8')
+    header = struct.pack(lexicon_cache_header, lexicon_cache_magic,
+                         lexicon_cache_format, key[0], key[1], key[2],
+                         len(verbs_base), len(verbs_kanji),
+                         len(lexicon.verb_types), len(errors),
+                         lexicon.duplicates)
+    return b''.join([header, verbs_base, verbs_kanji,
+                     bytes(lexicon.verb_types), errors])
+
+def read_lexicon_cache(data, key):
+    '''
+    The Lexicon in the bytes of a lexicon cache, None if it was written for
+    another key. Raise ValueError if the data is not a well formed cache
+    '''
+    header_size = struct.calcsize(lexicon_cache_header)
+    if len(data) < header_size:
+        raise ValueError('truncated lexicon cache')
+    (magic, cache_format, mtime_ns, size, version, bases_size, kanjis_size,
+     verb_count, errors_size, duplicates) = struct.unpack_from(
+        lexicon_cache_header, data)
+    if magic != lexicon_cache_magic or cache_format != lexicon_cache_format:
+        raise ValueError('not a lexicon cache')
+    if (mtime_ns, size, version) != key:
+        return None
+    sizes = [bases_size, kanjis_size, verb_count, errors_size]
+    if len(data) != header_size + sum(sizes):
+        raise ValueError('lexicon cache of the wrong size')
+    blobs = []
+    offset = header_size
+    for blob_size in sizes:
+        blobs.append(data[offset:offset + blob_size])
+        offset += blob_size
+    verbs_base = split_strings(blobs[0])
+    verbs_kanji = split_strings(blobs[1])
+    verb_types = list(blobs[2])
+    if len(verbs_base) != verb_count or len(verbs_kanji) != verb_count:
+        raise ValueError('lexicon cache with a wrong number of verbs')
+    # the verb types of verb_type_of
+    if not set(verb_types) <= set([1, 2, 3]):
+        raise ValueError('lexicon cache with an unknown verb type')
+    errors = []
+    for error in json.loads(blobs[3].decode('utf-8')):
+        if not isinstance(error, list) or len(error) != 3 or \
+                not isinstance(error[0], int) or \
+                not all(isinstance(field, str) for field in error[1:]):
+            raise ValueError('lexicon cache with a malformed error')
+        errors.append(LexiconError(*error))
+    return Lexicon(verbs_base, verbs_kanji, verb_types, errors, duplicates)
+
+def split_strings(data):
+    '''
+    The strings joined by newlines in the UTF-8 data of the lexicon cache
+    '''
+    if not data:
+        return []
+    return data.decode('utf-8').split('\n')
+
+def report_lexicon_errors(path, lexicon):
+    '''
+    Print the lines of the verb lib path skipped by the lexicon on stderr
+    '''
+    for error in lexicon.errors:
+        print(''.join([path, ':', str(error.line_number), ': ', error.message,
+                       ': ', error.line]), file=sys.stderr)
+
+def read_verb_lib(path='Japanese_verb_base.jvp'):
+    '''
+    Read the verbs lib, return the lists of verb bases and verb kanjis.
+    The lines skipped are reported on stderr
+    '''
+    lexicon = load_lexicon(path)
+    report_lexicon_errors(path, lexicon)
+    return lexicon.verbs_base, lexicon.verbs_kanji
+
+def read_form_lib(path='Japanese_verb_form.jvp'):
+    '''
+    Read the form lib, return the list of forms
+    '''
+    verbs_form = []
+    with open(path, encoding='utf-8',errors='ignore') as f:
+        for line in f:
+            if line.strip():
+                verb_form = line.strip()
+                verbs_form.append(verb_form)
+    return verbs_form
+
+def get_input(info):
+    '''
+    Get information from terminal input
+    '''
+    reponse = None
+    py3 = version_info[0] > 3
+    if py3:
+        response = input(info)
+    else:
+        response = input(info)
+    return response
+
+def biased_verb_sample(p):
+    '''
+    Uniformly sample a entity from a list
+    '''
+    # normalize p
     sum_p = 0.0
     for i in range(len(p)):
         sum_p += p[i]
@@ -867,6 +2713,744 @@ def biased_verb_sample(p):
     #index = int(random.random() * len(l))
     return index
 
+def biased_verb_samples(p, k, rng=None):
+    '''
+    Sample k entities at once from a list of weights
+    '''
+    at = NumpyAliasTable(p, rng)
+    return at.sample(k)
+
+def verb_type_of(verb_base, verb_kanji):
+    '''
+    Calculate the verb type of a verb
+    1: 动1, v1
+    2: 动2, v2
+    3: 动3, v3
+    '''
+    if verb_base in ('する', 'くる'):
+        return 3
+    last_hira = verb_base[-1:]
+    if last_hira != 'る':
+        return 1
+    last_2nd_hira = verb_base[-2:-1]
+    position = kana_index.get(last_2nd_hira)
+    if position is None:
+        errormessage = ''.join(['hiragana: ', last_2nd_hira, ' not found!'])
+        raise ValueError(errormessage)
+    if position[1] in ('u', 'a', 'o'):
+        return 1
+    if verb_kanji in speacial_v1:
+        return 1
+    return 2
+
+def format_answers(right_answer):
+    '''
+    Format the right answers as [ A or B ]
+    '''
+    if not right_answer:
+        return '[]'
+    return ''.join(['[ ', ' or '.join(right_answer), ']'])
+
+def wrong_answer_message(right_answer):
+    return ''.join(['Wrong answer! Correct answer: ', format_answers(right_answer)])
+
+def form_name(verb_form):
+    '''
+    Name a form in messages: ます -> ます形, 可能 -> 可能态
+    '''
+    if verb_form in ('ます', 'て', 'た', 'ない', '意志', '命令', '假定'):
+        return verb_form + '形'
+    if verb_form in ('可能', '被动', '自发', '使役', '被动使役'):
+        return verb_form + '态'
+    return verb_form
+
+def diagnosis_message(quiz, diagnosis):
+    '''
+    Tell what a wrong answer is the right answer of, None if nothing
+    '''
+    if not diagnosis:
+        return None
+    verb_base, verb_kanji, verb_form = diagnosis[0]
+    if (verb_base, verb_kanji) == (quiz.verb_base, quiz.verb_kanji):
+        return ''.join(['You gave the ', form_name(verb_form), ' instead of the ',
+                        form_name(quiz.verb_form)])
+    if verb_kanji is None:
+        verb_content = verb_base
+    else:
+        verb_content = ''.join([verb_kanji, ' (', verb_base, ')'])
+    return ''.join(['You gave the ', form_name(verb_form), ' of ', verb_content])
+
+def verb_description(verb_base, verb_kanji, verb_form):
+    '''
+    Describe a verb of the practice history in error messages
+    '''
+    if verb_kanji is None:
+        return ''.join([verb_base, '的', verb_form, '形'])
+    return ''.join([verb_base, verb_kanji, '的', verb_form, '形'])
+
+def normalize_kanji(verb_kanji):
+    '''
+    Return the kanji of a verb, None for verbs without kanji
+    ('None' in the verb lib, NaN in a loaded practice history)
+    '''
+    if not isinstance(verb_kanji, str) or verb_kanji == 'None':
+        return None
+    return verb_kanji
+
+# edits a wrong answer can be from a right answer to be a near miss
+near_miss_distance = 1
+
+def bounded_levenshtein(a, b, bound):
+    '''
+    Return the Levenshtein distance of a and b if it is at most bound,
+    else bound + 1. Only the band of bound cells around the diagonal is
+    computed, and it stops at the first row over bound
+    '''
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = bound + 1
+    if bound == 1:
+        # one edit: the rests after the first difference must match
+        i = 0
+        while i < len(a) and a[i] == b[i]:
+            i += 1
+        if len(a) == len(b):
+            return 1 if a[i + 1:] == b[i + 1:] else over
+        return 1 if a[i:] == b[i + 1:] else over
+    previous = [j if j <= bound else over for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        low = max(1, i - bound)
+        high = min(len(b), i + bound)
+        current = [over] * (len(b) + 1)
+        if i <= bound:
+            current[0] = i
+        row_min = current[0]
+        char = a[i - 1]
+        for j in range(low, high + 1):
+            value = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if value > over:
+                value = over
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > bound:
+            return over
+        previous = current
+    return min(previous[len(b)], over)
+
+def classify_answer(user_answer, right_answer, max_distance=None):
+    '''
+    Classify an answer against the right answers as 'right', 'near_miss'
+    (at most max_distance edits from a right answer, near_miss_distance
+    if None) or 'wrong'
+    '''
+    if user_answer in right_answer:
+        return 'right'
+    if not isinstance(user_answer, str) or not user_answer:
+        return 'wrong'
+    if max_distance is None:
+        max_distance = near_miss_distance
+    for answer in right_answer:
+        if bounded_levenshtein(user_answer, answer, max_distance) <= max_distance:
+            return 'near_miss'
+    return 'wrong'
+
+def update_counters(counters, error_flag, near_miss=False):
+    '''
+    Return the counters (sample_time, error_time, right_time,
+    continue_error_time, continue_right_time) after one more answer.
+    A near_miss counts as an error, but does not make the wrong answer
+    streak longer
+    '''
+    sample_time, error_time, right_time, continue_error_time, \
+        continue_right_time = [int(counter) for counter in counters]
+    sample_time += 1
+    if error_flag and near_miss:
+        error_time += 1
+        continue_right_time = 0
+    elif error_flag:
+        error_time += 1
+        continue_error_time += 1
+        continue_right_time = 0
+    else:
+        right_time += 1
+        continue_right_time += 1
+        if continue_right_time > 5:
+            continue_right_time = 0
+            error_time = 0
+        continue_error_time = 0
+    return (sample_time, error_time, right_time, continue_error_time,
+            continue_right_time)
+
+def error_weighting(sample_time, error_time, right_time, continue_error_time,
+                    continue_right_time):
+    '''
+    relative_weight = [1 +(5*continue_error_time) + (3*error_time)] /
+                      [ 1 + sample_time + right_time + 2*continue_right_time]
+    '''
+    return (1.0 + error_time * 6.0 + continue_error_time * 10.0) / \
+           (1.0 + sample_time + right_time + continue_right_time * 2)
+
+def unseen_weighting(sample_time, error_time, right_time, continue_error_time,
+                     continue_right_time):
+    '''
+    The verbs asked the least come first, then the ones with errors
+    '''
+    return (1.0 + error_time * 2.0 + continue_error_time * 4.0) / \
+           (1.0 + sample_time * sample_time)
+
+def accuracy_weighting(sample_time, error_time, right_time, continue_error_time,
+                       continue_right_time):
+    '''
+    The odds of a wrong answer, from all the answers
+    '''
+    return (1.0 + error_time) / (1.0 + right_time)
+
+def uniform_weighting(sample_time, error_time, right_time, continue_error_time,
+                      continue_right_time):
+    '''
+    Every verb as likely
+    '''
+    return 1.0 + sample_time * 0.0
+
+# The relative weight of a row, from its counters. A weighting takes the
+# counter_columns, numbers of one row or NumPy arrays of the whole practice
+# history, and returns the relative weights
+weighting_strategies = OrderedDict([('error', error_weighting),
+                                    ('unseen', unseen_weighting),
+                                    ('accuracy', accuracy_weighting),
+                                    ('uniform', uniform_weighting)])
+
+def weighting_of(weighting):
+    '''
+    Return the weighting function of a name of weighting_strategies, or
+    weighting itself if it is a function
+    '''
+    if callable(weighting):
+        return weighting
+    if weighting not in weighting_strategies:
+        errormessage = ''.join(['Unknown weighting: ', str(weighting),
+                                ', expected one of: ',
+                                ', '.join(weighting_strategies)])
+        raise ValueError(errormessage)
+    return weighting_strategies[weighting]
+
+def weighting_name(weighting):
+    '''
+    Return the name of a weighting function in weighting_strategies, None
+    if it is not one of them
+    '''
+    for name, strategy in weighting_strategies.items():
+        if strategy is weighting:
+            return name
+    return None
+
+def relative_weight_of(counters, weighting=error_weighting):
+    return float(weighting(*counters))
+
+# the lowest ease of SM-2, and the delay of a verb answered wrong
+minimum_ease = 1.3
+relearn_seconds = 600.0
+
+def answer_quality(error_flag, near_miss=False, lenient=False):
+    '''
+    Return the SM-2 quality of an answer, 0 (blackout) to 5 (perfect):
+    4 for a right answer, 1 for a wrong one, 2 for a near miss, 3 for a
+    near miss of a lenient practice
+    '''
+    if not error_flag:
+        return 4
+    if near_miss:
+        return 3 if lenient else 2
+    return 1
+
+def sm2_schedule(schedule, quality, now):
+    '''
+    Return the schedule (due_time, ease, interval_days) after an answer of
+    quality at time now, by SM-2: the ease goes up by 0.1 for a perfect
+    answer and down for a worse one, a pass (quality 3 or more) is due
+    again after 1 day, then 6 days, then the interval times the ease, and
+    a fail is due again in relearn_seconds, starting over
+    '''
+    due_time, ease, interval_days = schedule
+    ease = max(minimum_ease,
+               float(ease) + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    if quality < 3:
+        return (now + relearn_seconds, ease, 0.0)
+    if interval_days < 1.0:
+        interval_days = 1.0
+    elif interval_days < 6.0:
+        interval_days = 6.0
+    else:
+        interval_days = float(interval_days) * ease
+    return (now + interval_days * 86400.0, ease, interval_days)
+
+# an answer to record: the error flag and the near miss of the graded quiz,
+# whether the practice is lenient with near misses, and the time of the answer
+Answer = namedtuple('Answer', ['error_flag', 'near_miss', 'lenient', 'time'])
+
+def fold_answers(counters, schedule, answers):
+    '''
+    Return the counters and the schedule of a row after the answers, in
+    order
+    '''
+    for error_flag, near_miss, lenient, now in answers:
+        lenient_miss = lenient and near_miss
+        counters = update_counters(counters, error_flag, lenient_miss)
+        schedule = sm2_schedule(schedule,
+                                answer_quality(error_flag, near_miss,
+                                               lenient_miss), now)
+    return counters, schedule
+
+# the sound changes of the て and た forms of godan verbs, by final kana
+te_sounds = {'う': 'って', 'つ': 'って', 'る': 'って', 'ぶ': 'んで', 'む': 'んで',
+             'ぬ': 'んで', 'く': 'いて', 'ぐ': 'いで', 'す': 'して'}
+ta_sounds = {'う': 'った', 'つ': 'った', 'る': 'った', 'ぶ': 'んだ', 'む': 'んだ',
+             'ぬ': 'んだ', 'く': 'いた', 'ぐ': 'いだ', 'す': 'した'}
+
+# The conjugation rules: for each form, the rule of each verb type
+# 1: (vowel, suffix), the final kana is shifted to the vowel, or dropped
+#    if vowel is None, then suffix is added. A shifted う becomes わ.
+#    A dict suffix is chosen by the final kana.
+# 2: suffix, added in place of the final る
+# 3: the answers of する and くる, or (vowel, suffix) shifting the kana
+#    before る, the kanji verb only gets the suffix
+conjugation_rules = OrderedDict([
+    ('ます', {1: ('i', 'ます'), 2: 'ます', 3: ('i', 'ます')}),
+    ('て', {1: (None, te_sounds), 2: 'て',
+           3: {'くる': ('来て', 'きて'), 'する': ('して',)}}),
+    ('た', {1: (None, ta_sounds), 2: 'た',
+           3: {'くる': ('来た', 'きた'), 'する': ('した',)}}),
+    ('ない', {1: ('a', 'ない'), 2: 'ない',
+            3: {'くる': ('来ない', 'こない'), 'する': ('しない',)}}),
+    ('意志', {1: ('o', 'う'), 2: 'よう',
+            3: {'くる': ('来よう', 'こよう'), 'する': ('しよう',)}}),
+    ('命令', {1: ('e', ''), 2: 'ろ',
+            3: {'くる': ('来い', 'こい'), 'する': ('しろ',)}}),
+    ('假定', {1: ('e', 'ば'), 2: 'れば',
+            3: {'くる': ('来れば', 'くれば'), 'する': ('すれば',)}}),
+    ('可能', {1: ('e', 'る'), 2: 'られる',
+            3: {'くる': ('来られる', 'こられる'), 'する': ('できる',)}}),
+    ('使役', {1: ('a', 'せる'), 2: 'させる',
+            3: {'くる': ('来させる', 'こさせる'), 'する': ('させる',)}}),
+    ('被动', {1: ('a', 'れる'), 2: 'られる',
+            3: {'くる': ('来られる', 'こられる'), 'する': ('される',)}}),
+    ('使役被动', {1: ('a', 'される'), 2: 'させられる',
+              3: {'くる': ('来させられる', 'こさせられる'),
+                  'する': ('させられる',)}}),
+])
+
+# godan verbs that do not follow the rule of their form: all the answers
+# by verb_base, or one answer by verb_base or verb_kanji
+verb_overrides = {('ない', 'ある'): ('ない',)}
+surface_overrides = {('て', 'いく'): 'いって', ('て', '行く'): '行って',
+                     ('た', 'いく'): 'いった', ('た', '行く'): '行った'}
+
+# (verb_form, verb_type, final kana, the verb for type 3) -> compiled rule,
+# filled by conjugation_rule on the first use of a key
+conjugation_dispatch = {}
+
+def compile_conjugation_rule(verb_form, verb_type, final):
+    '''
+    Compile the rule of a form and verb type for the verbs ending with
+    final, the whole verb for type 3, into
+    (drop, ending, kanji_ending, answers, overridden): the answers are
+    verb_base[:-drop] + ending and verb_kanji[:-1] + kanji_ending, or
+    answers if it is not None. overridden tells that some verbs of the
+    form are in verb_overrides or surface_overrides
+    '''
+    rules = conjugation_rules.get(verb_form)
+    if rules is None:
+        raise ValueError('Unsupported form')
+    rule = rules[verb_type]
+    if verb_type == 2:
+        return (1, rule, rule, None, False)
+    if isinstance(rule, dict):
+        return (0, '', '', rule.get(final, ()), False)
+    vowel, suffix = rule
+    kana = ''
+    if vowel is not None:
+        hira = Hiragana(final[-2:-1] if verb_type == 3 else final)
+        hira.change_vowel(vowel)
+        kana = hira.hiragana
+        if vowel == 'a' and kana == 'あ':
+            kana = 'わ'
+    if verb_type == 3:
+        return (2, kana + suffix, suffix, None, False)
+    if isinstance(suffix, dict):
+        suffix = suffix.get(final, '')
+    overridden = any(key_form == verb_form for key_form, surface
+                     in list(verb_overrides) + list(surface_overrides))
+    return (1, kana + suffix, kana + suffix, None, overridden)
+
+def conjugation_rule(verb_form, verb_type, final):
+    '''
+    Return the compiled rule of compile_conjugation_rule from
+    conjugation_dispatch, compiled and kept there on its first use
+    '''
+    key = (verb_form, verb_type, final)
+    rule = conjugation_dispatch.get(key)
+    if rule is None:
+        rule = compile_conjugation_rule(verb_form, verb_type, final)
+        conjugation_dispatch[key] = rule
+    return rule
+
+def conjugate(verb_base, verb_kanji, verb_form, verb_type):
+    '''
+    Return the right answers of a verb in a form, the kanji answer first.
+    The rule is compiled on the first use of its key
+    '''
+    key = (verb_form, verb_type, verb_base if verb_type == 3 else verb_base[-1:])
+    drop, ending, kanji_ending, answers, overridden = \
+        conjugation_dispatch.get(key) or conjugation_rule(*key)
+    if answers is not None:
+        return answers
+    if overridden:
+        answers = verb_overrides.get((verb_form, verb_base))
+        if answers is not None:
+            return answers
+        hira_answer = surface_overrides.get((verb_form, verb_base),
+                                            verb_base[:-drop] + ending)
+        if verb_kanji is None:
+            return (hira_answer,)
+        return (surface_overrides.get((verb_form, verb_kanji),
+                                      verb_kanji[:-1] + kanji_ending),
+                hira_answer)
+    if verb_kanji is None:
+        return (verb_base[:-drop] + ending,)
+    return (verb_kanji[:-1] + kanji_ending, verb_base[:-drop] + ending)
+
+def conjugate_table(bases, kanjis, forms):
+    '''
+    Conjugate every verb into every form in one pass. The compiled rules
+    of all the forms are looked up once for the verbs of the same type and
+    final kana, then an answer is a concatenation to the stem.
+    Return a list of (verb_base, verb_kanji, verb_form, right_answer) rows,
+    verb by verb and form by form as in a new practice_history
+    '''
+    table = []
+    form_rules = {}
+    for verb_base, verb_kanji in zip(bases, kanjis):
+        verb_kanji = normalize_kanji(verb_kanji)
+        verb_type = verb_type_of(verb_base, verb_kanji)
+        final = verb_base if verb_type == 3 else verb_base[-1:]
+        rules = form_rules.get((verb_type, final))
+        if rules is None:
+            rules = [conjugation_rule(verb_form, verb_type, final)
+                     for verb_form in forms]
+            form_rules[(verb_type, final)] = rules
+        stem = verb_base[:-1]
+        for verb_form, (drop, ending, kanji_ending, answers, overridden) in \
+                zip(forms, rules):
+            if answers is None:
+                if overridden or drop != 1:
+                    answers = conjugate(verb_base, verb_kanji, verb_form,
+                                        verb_type)
+                elif verb_kanji is None:
+                    answers = (stem + ending,)
+                else:
+                    answers = (verb_kanji[:-1] + kanji_ending, stem + ending)
+            table.append((verb_base, verb_kanji, verb_form, answers))
+    return table
+
+answer_columns = ['verb_base', 'verb_kanji', 'verb_form', 'user_answer']
+graded_columns = answer_columns + ['correct', 'right_answer', 'near_miss']
+
+def read_answer_file(path):
+    '''
+    Yield the (verb_base, verb_kanji, verb_form, user_answer) of an answer
+    file one at a time: JSON lines with these keys for .jsonl, else CSV
+    rows in this order with an optional header. An empty or 'None' kanji
+    is None. A JSON line that is not an object has empty fields, as a key
+    missing or not a string, so the row is graded invalid
+    '''
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if not isinstance(row, dict):
+                    row = {}
+                fields = [row.get(column) for column in answer_columns]
+                fields = [field if isinstance(field, str) else ''
+                          for field in fields]
+                yield (fields[0], fields[1] or None, fields[2], fields[3])
+        else:
+            for i, row in enumerate(csv.reader(f)):
+                if not row or (i == 0 and row[:4] == answer_columns):
+                    continue
+                if len(row) < 4:
+                    row = row + [''] * (4 - len(row))
+                yield (row[0], normalize_kanji(row[1] or None), row[2], row[3])
+
+def grade_answer_rows(rows):
+    '''
+    Grade (verb_base, verb_kanji, verb_form, user_answer) rows like
+    Verb.check_answer, without printing. Return the rows with the error
+    flag, the right answers and the near miss flag added, the error flag
+    is None for a row that cannot be conjugated
+    '''
+    graded = []
+    for verb_base, verb_kanji, verb_form, user_answer in rows:
+        verb = Verb(verb_base, verb_kanji, verb_form)
+        verb.user_answer = user_answer
+        try:
+            verb.get_right_answer()
+        except (ValueError, KeyError, IndexError):
+            graded.append((verb_base, verb_kanji, verb_form, user_answer,
+                           None, (), False))
+            continue
+        verb.grade()
+        graded.append((verb_base, verb.verb_kanji, verb_form, user_answer,
+                       verb.error_flag, tuple(verb.right_answer),
+                       verb.near_miss))
+    return graded
+
+def chunks_of(rows, chunk_size):
+    '''
+    Yield lists of chunk_size rows, the last one may be shorter
+    '''
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def grade_chunks(rows, processes=None, chunk_size=10000):
+    '''
+    Yield the graded rows in the order of rows, graded in chunks by a pool
+    of processes. At most two chunks a process are read ahead, so memory
+    does not grow with the number of rows
+    '''
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1:
+        for chunk in chunks_of(rows, chunk_size):
+            for row in grade_answer_rows(chunk):
+                yield row
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for chunk in chunks_of(rows, chunk_size):
+            pending.append(pool.apply_async(grade_answer_rows, (chunk,)))
+            if len(pending) >= 2 * processes:
+                for row in pending.popleft().get():
+                    yield row
+        while pending:
+            for row in pending.popleft().get():
+                yield row
+    finally:
+        pool.terminate()
+        pool.join()
+
+def grade_answers(rows, output, output_format='csv', practice=None,
+                  processes=None, chunk_size=10000):
+    '''
+    Grade the answer rows to the output stream, CSV or JSON lines, and
+    update the counters of practice in one step at the end.
+    Return a summary of the grading
+    '''
+    summary = {'rows': 0, 'right': 0, 'wrong': 0, 'near_miss': 0,
+               'invalid': 0, 'recorded': 0, 'skipped': 0}
+    writer = None
+    if output_format == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(graded_columns)
+
+    def written():
+        for verb_base, verb_kanji, verb_form, user_answer, error_flag, \
+                right_answer, near_miss in grade_chunks(rows, processes,
+                                                        chunk_size):
+            summary['rows'] += 1
+            if error_flag is None:
+                summary['invalid'] += 1
+            elif error_flag:
+                summary['wrong'] += 1
+                summary['near_miss'] += near_miss
+            else:
+                summary['right'] += 1
+            correct = None if error_flag is None else not error_flag
+            if writer is not None:
+                writer.writerow([verb_base, verb_kanji or '', verb_form,
+                                 user_answer, '' if correct is None else correct,
+                                 ' or '.join(right_answer), near_miss])
+            else:
+                output.write(json.dumps(OrderedDict(zip(
+                    graded_columns,
+                    [verb_base, verb_kanji, verb_form, user_answer, correct,
+                     list(right_answer), near_miss])), ensure_ascii=False) + '\n')
+            yield verb_base, verb_kanji, verb_form, error_flag, near_miss
+
+    if practice is None:
+        for answer in written():
+            pass
+    else:
+        summary['recorded'], summary['skipped'] = practice.record_batch(written())
+        practice.close()
+    return summary
+
+def grade_answer_file(path, output_path=None, practice=None, processes=None,
+                      chunk_size=10000):
+    '''
+    Grade an answer file to output_path, stdout if None. The output is
+    JSON lines when output_path ends with .jsonl, or when it is stdout and
+    path ends with .jsonl, else CSV
+    '''
+    jsonl = (output_path or path).endswith('.jsonl')
+    output_format = 'jsonl' if jsonl else 'csv'
+    rows = read_answer_file(path)
+    if output_path is None:
+        return grade_answers(rows, sys.stdout, output_format, practice,
+                             processes, chunk_size)
+    with open(output_path, 'w', encoding='utf-8', newline='') as output:
+        return grade_answers(rows, output, output_format, practice,
+                             processes, chunk_size)
+
+def startup_report(budget_file=None, top=10):
+    '''
+    Measure the startup in a fresh interpreter against the startup budget:
+    the import of jvp, the time to the first question in the current
+    directory, and the import time of the modules (python -X importtime)
+    '''
+    import subprocess
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if budget_file is None:
+        budget_file = os.path.join(script_dir, 'startup_budget.json')
+    with open(budget_file, encoding='utf-8') as f:
+        budget = json.load(f)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([script_dir, env.get('PYTHONPATH', '')])
+    code = '; '.join(['import time',
+                      'start = time.perf_counter()',
+                      'import jvp',
+                      'imported = time.perf_counter()',
+                      'verb = jvp.Practice().sample_verb()',
+                      'verb.get_right_answer()',
+                      'print(imported - start, time.perf_counter() - start)'])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True)
+    import_time, first_question_time = result.stdout.split()
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # nested imports are indented by two spaces a level
+        if name[1:].startswith(' '):
+            continue
+        modules.append({'name': name.strip(),
+                        'self_ms': int(self_us) / 1000.0,
+                        'cumulative_ms': int(cumulative_us) / 1000.0})
+    modules.sort(key=lambda module: -module['cumulative_ms'])
+    report = {'import_ms': float(import_time) * 1000,
+              'first_question_ms': float(first_question_time) * 1000,
+              'budget': budget,
+              'modules': modules[:top]}
+    report['over_budget'] = sorted(key for key in budget
+                                   if report[key] > budget[key])
+    report['within_budget'] = not report['over_budget']
+    return report
+
 if __name__ == '__main__':
-    practice = Practice()
-    practice.perform_quiz()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Practice Japanese verb conjugation')
+    parser.add_argument('--startup-report', action='store_true',
+                        help='measure the startup against startup_budget.json '
+                             'and print it as JSON')
+    parser.add_argument('--grade', metavar='ANSWER_FILE',
+                        help='grade a CSV or JSON lines file of verb_base, '
+                             'verb_kanji, verb_form, user_answer and record '
+                             'the answers in the practice history')
+    parser.add_argument('--output', help='write the graded answers to this '
+                                         'file instead of stdout')
+    parser.add_argument('--processes', type=int,
+                        help='processes grading the answers, default all CPUs')
+    parser.add_argument('--chunk-size', type=int, default=10000,
+                        help='answers graded by a process at a time')
+    parser.add_argument('--no-record', action='store_true',
+                        help='grade without updating the practice history')
+    parser.add_argument('--lenient', action='store_true',
+                        help='record near misses, answers one kana off, '
+                             'without the penalty of a wrong answer streak')
+    parser.add_argument('--weighting', choices=list(weighting_strategies),
+                        help='recompute the relative weights of the practice '
+                             'history with this weighting, and use it for the '
+                             'answers to come')
+    parser.add_argument('--deck', action='append', metavar='NAME',
+                        help='practice the deck NAME under --deck-dir, with '
+                             'its own practice history; repeat it for a '
+                             'session over several decks')
+    parser.add_argument('--deck-dir', default=deck_dir,
+                        help='directory of the decks, one subdirectory each')
+    parser.add_argument('--list-decks', action='store_true',
+                        help='print the decks under --deck-dir')
+    parser.add_argument('--no-schedule', action='store_true',
+                        help='sample by the relative weights only, not the '
+                             'verbs due for review first')
+    parser.add_argument('--instrument', metavar='REPORT_FILE',
+                        help='time the phases of the session and write the '
+                             'histograms to this file, Prometheus text for '
+                             '.prom, else JSON')
+    parser.add_argument('--profile', action='store_true',
+                        help='with --instrument, add a cProfile and a '
+                             'tracemalloc capture to the report')
+    parser.add_argument('--no-pipeline', action='store_true',
+                        help='work out the next quiz only after the answer '
+                             'is recorded')
+    args = parser.parse_args()
+    if args.instrument:
+        instrumentation.enable(args.profile, args.profile)
+    if args.grade:
+        # the report is saved even if the grading is interrupted
+        try:
+            summary = grade_answer_file(
+                args.grade, args.output,
+                None if args.no_record else Practice(
+                    lenient_near_miss=args.lenient, weighting=args.weighting,
+                    scheduled=not args.no_schedule),
+                args.processes, args.chunk_size)
+            print(json.dumps(summary), file=sys.stderr)
+        finally:
+            if args.instrument:
+                instrumentation.disable()
+                instrumentation.save(args.instrument)
+        sys.exit(0)
+    if args.startup_report:
+        report = startup_report()
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(0 if report['within_budget'] else 1)
+    if args.list_decks:
+        for name in list_decks(args.deck_dir):
+            print(name)
+        sys.exit(0)
+    options = {'lenient_near_miss': args.lenient, 'weighting': args.weighting,
+               'scheduled': not args.no_schedule}
+    # the report is saved even if the quiz is stopped with Ctrl-C
+    try:
+        if args.deck:
+            practice = DeckSession(args.deck, args.deck_dir, **options)
+        else:
+            practice = Practice(**options)
+        practice.perform_quiz(not args.no_pipeline)
+    finally:
+        if args.instrument:
+            instrumentation.disable()
+            instrumentation.save(args.instrument)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+Load test of jvp_server.py: --users learners take --quizzes quizzes each
+over kept-alive connections, asking for a quiz and answering it. Prints
+the requests per second and the latency percentiles as JSON.
+
+Run against a running server: python jvp_loadtest.py --port 8080
+Or start one on a temporary history directory: python jvp_loadtest.py --spawn
+'''
+
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+async def request(reader, writer, method, path, payload=None):
+    '''
+    Send one request on a kept-alive connection, return the decoded JSON
+    '''
+    body = b''
+    if payload is not None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = ''.join([method, ' ', path, ' HTTP/1.1\r\n',
+                    'Host: localhost\r\n',
+                    'Content-Type: application/json\r\n',
+                    'Content-Length: ', str(len(body)), '\r\n\r\n'])
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+    status_line = await reader.readline()
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    data = json.loads((await reader.readexactly(length)).decode('utf-8'))
+    if status != 200:
+        raise RuntimeError(''.join([method, ' ', path, ': ', str(status), ' ',
+                                    str(data)]))
+    return data
+
+
+async def learner(host, port, user, quizzes, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in range(quizzes):
+            start = time.perf_counter()
+            quiz = await request(reader, writer, 'GET', '/quiz?user=' + user)
+            latencies.append(time.perf_counter() - start)
+            # a wrong answer every third quiz
+            answer = quiz['verb_base'] if i % 3 == 0 else ''
+            start = time.perf_counter()
+            await request(reader, writer, 'POST', '/answer',
+                          {'user': user, 'quiz_id': quiz['quiz_id'],
+                           'answer': answer})
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        await request(reader, writer, 'GET', '/stats?user=' + user)
+        latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def load_test(host, port, users, quizzes):
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[learner(host, port, 'learner%d' % i, quizzes, latencies)
+                           for i in range(users)])
+    elapsed = time.perf_counter() - start
+    return {'users': users,
+            'requests': len(latencies),
+            'seconds': elapsed,
+            'requests_per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': max(latencies) * 1000}
+
+
+def spawn_server(port):
+    '''
+    Start jvp_server.py on a temporary history directory, wait for it
+    '''
+    history_dir = tempfile.mkdtemp()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(script_dir, 'jvp_server.py'),
+         '--port', str(port), '--history-dir', history_dir],
+        cwd=script_dir, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 1).close()
+            return server, history_dir
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('the server did not start')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test of jvp_server.py')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--quizzes', type=int, default=100,
+                        help='quizzes taken by every user')
+    parser.add_argument('--spawn', action='store_true',
+                        help='start a server on a temporary history directory')
+    args = parser.parse_args()
+    server = None
+    if args.spawn:
+        server, history_dir = spawn_server(args.port)
+    try:
+        report = asyncio.run(load_test(args.host, args.port, args.users,
+                                       args.quizzes))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(history_dir)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+'''
+Local HTTP/JSON quiz server for many learners, on asyncio and the standard
+library only. Every user has an in-memory practice history of their own,
+loaded on a worker thread and saved under --history-dir by a write-behind
+flush; the lexicon, the reverse conjugation index and the conjugation
+cache of the right answers are shared by all users.
+
+GET  /quiz?user=NAME
+     -> {"quiz_id", "verb_base", "verb_kanji", "verb_form", "prompt"}
+POST /answer  {"user": NAME, "quiz_id": ID, "answer": ANSWER}
+     -> {"correct", "near_miss", "right_answer", "diagnosis"}
+GET  /stats?user=NAME
+     -> {"answered", "right", "wrong", "sample_time", "error_time", ...}
+GET  /metrics
+     -> the phase histograms of jvp.instrumentation, Prometheus text format,
+        empty unless the server runs with --instrument
+
+Run: python jvp_server.py --port 8080
+'''
+
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import jvp
+
+user_pattern = re.compile(r'^\w{1,64}$')
+
+status_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                  405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class RequestError(Exception):
+    '''
+    Class RequestError
+    A request that gets an error status
+    '''
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+        self.message = message
+
+
+class UserSession(object):
+    '''
+    Class UserSession
+    The practice of one user and the quizzes waiting for an answer
+    '''
+    def __init__(self, practice, max_pending):
+        self.practice = practice
+        self.quizzes = practice.iter_quizzes()
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.next_quiz_id = 0
+        self.answered = 0
+        self.right = 0
+
+    def add_quiz(self, quiz):
+        '''
+        Keep a quiz until it is answered, the oldest quizzes beyond
+        max_pending are dropped and put back in the schedule
+        '''
+        self.next_quiz_id += 1
+        self.pending[self.next_quiz_id] = quiz
+        while len(self.pending) > self.max_pending:
+            self.practice.release(self.pending.popitem(last=False)[1])
+        return self.next_quiz_id
+
+
+class QuizServer(object):
+    '''
+    Class QuizServer
+    '''
+    def __init__(self, history_dir='histories', flush_interval=5.0,
+                 max_pending=100, lenient_near_miss=False):
+        self.history_dir = history_dir
+        self.lenient_near_miss = lenient_near_miss
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.sessions = {}
+        # the futures of the sessions being loaded, by user
+        self.loading = {}
+        # one flush or close of the histories at a time, a flush running
+        # on a worker thread
+        self.flush_lock = threading.Lock()
+        if not os.path.isdir(history_dir):
+            os.makedirs(history_dir)
+        # load the libs and work out the answers of all the verbs once for
+        # all the users
+        verb_lib, form_lib = 'Japanese_verb_base.jvp', 'Japanese_verb_form.jvp'
+        self.lexicon = jvp.load_lexicon(verb_lib)
+        jvp.report_lexicon_errors(verb_lib, self.lexicon)
+        forms = jvp.read_form_lib(form_lib)
+        self.reverse_index = jvp.shared_reverse_index(
+            verb_lib, form_lib, self.lexicon.verbs_base,
+            self.lexicon.verbs_kanji, self.lexicon.verb_types, forms)
+        jvp.conjugation_cache.maxsize = max(
+            jvp.conjugation_cache.maxsize,
+            len(self.lexicon.verbs_base) * len(forms))
+        jvp.conjugation_cache.load()
+        for verb_base, verb_kanji, verb_form, right_answer in jvp.conjugate_table(
+                self.lexicon.verbs_base, self.lexicon.verbs_kanji, forms):
+            jvp.conjugation_cache.put(
+                (verb_base, verb_kanji, verb_form),
+                (jvp.verb_type_of(verb_base, verb_kanji), right_answer))
+
+    def new_session(self, user):
+        '''
+        Load the practice history of a new user, on the shared lexicon and
+        reverse index
+        '''
+        store = jvp.WriteBehindStore(jvp.CsvHistoryStore(
+            os.path.join(self.history_dir, user + '.csv')))
+        return UserSession(
+            jvp.Practice(store, lenient_near_miss=self.lenient_near_miss,
+                         reverse_index=self.reverse_index,
+                         lexicon=self.lexicon),
+            self.max_pending)
+
+    async def session(self, user):
+        '''
+        Return the session of user. The session of a new user is loaded on
+        a worker thread, the requests of the other users being served
+        meanwhile; the requests of the user wait for the same load
+        '''
+        if not user or not user_pattern.match(user):
+            raise RequestError(400, 'user must be 1 to 64 letters, digits or _')
+        session = self.sessions.get(user)
+        if session is None:
+            loading = self.loading.get(user)
+            if loading is None:
+                loading = asyncio.get_running_loop().run_in_executor(
+                    None, self.new_session, user)
+                self.loading[user] = loading
+            try:
+                session = await loading
+            finally:
+                self.loading.pop(user, None)
+            self.sessions[user] = session
+        return session
+
+    def next_quiz(self, session):
+        quiz = next(session.quizzes)
+        quiz_id = session.add_quiz(quiz)
+        if quiz.has_kanji:
+            prompt = ''.join([quiz.verb_kanji, ' (', quiz.verb_base, ')'])
+        else:
+            prompt = quiz.verb_base
+        return {'quiz_id': quiz_id, 'verb_base': quiz.verb_base,
+                'verb_kanji': quiz.verb_kanji if quiz.has_kanji else None,
+                'verb_form': quiz.verb_form, 'prompt': prompt}
+
+    def answer(self, session, quiz_id, user_answer):
+        quiz = session.pending.pop(quiz_id, None)
+        if quiz is None:
+            raise RequestError(404, 'quiz not found')
+        result = session.practice.submit(quiz, user_answer)
+        session.answered += 1
+        if result.correct:
+            session.right += 1
+        return {'correct': result.correct,
+                'near_miss': result.near_miss,
+                'right_answer': list(result.right_answer),
+                'diagnosis': jvp.diagnosis_message(quiz, result.diagnosis)}
+
+    def stats(self, session):
+        practice_history = session.practice.practice_history
+        stats = {'answered': session.answered, 'right': session.right,
+                 'wrong': session.answered - session.right,
+                 'pending': len(session.pending),
+                 'verbs': len(practice_history)}
+        for column in jvp.counter_columns:
+            stats[column] = int(sum(practice_history[column]))
+        return stats
+
+    async def dispatch(self, method, target, body):
+        '''
+        Return the status and the payload of a request, JSON unless a str
+        '''
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        user = query.get('user', [''])[0]
+        if url.path == '/metrics':
+            if method != 'GET':
+                raise RequestError(405, 'use GET')
+            return 200, jvp.instrumentation.to_prometheus()
+        if url.path == '/quiz':
+            if method != 'GET':
+                raise RequestError(405, 'use GET')
+            return 200, self.next_quiz(await self.session(user))
+        if url.path == '/stats':
+            if method != 'GET':
+                raise RequestError(405, 'use GET')
+            return 200, self.stats(await self.session(user))
+        if url.path == '/answer':
+            if method != 'POST':
+                raise RequestError(405, 'use POST')
+            try:
+                data = json.loads(body.decode('utf-8'))
+                quiz_id = int(data['quiz_id'])
+                user_answer = data['answer']
+            except (ValueError, KeyError, TypeError):
+                raise RequestError(400, 'expected JSON with quiz_id and answer')
+            session = await self.session(data.get('user', user))
+            return 200, self.answer(session, quiz_id, user_answer)
+        raise RequestError(404, 'unknown path')
+
+    async def read_request(self, reader):
+        '''
+        Return the method, target, version, headers and body of the next
+        request of a connection, None at its end. Raise ValueError if the
+        request is malformed
+        '''
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        method, target, version = request_line.decode('latin-1').split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = b''
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError('negative Content-Length')
+        if length:
+            body = await reader.readexactly(length)
+        return method, target, version, headers, body
+
+    async def respond(self, writer, status, payload, keep_alive):
+        '''
+        Write a response, payload being JSON unless a str
+        '''
+        if isinstance(payload, str):
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            data = payload.encode('utf-8')
+        else:
+            content_type = 'application/json; charset=utf-8'
+            data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = ''.join([
+            'HTTP/1.1 ', str(status), ' ', status_reasons[status], '\r\n',
+            'Content-Type: ', content_type, '\r\n',
+            'Content-Length: ', str(len(data)), '\r\n',
+            'Connection: ', 'keep-alive' if keep_alive else 'close',
+            '\r\n\r\n'])
+        writer.write(head.encode('latin-1') + data)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        '''
+        Serve the HTTP/1.1 requests of one connection, kept alive unless
+        the client asks to close it. A malformed request gets a 400 and
+        closes the connection, an error of the server a 500, logged on
+        stderr
+        '''
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except ValueError:
+                    await self.respond(writer, 400,
+                                       {'error': 'malformed request'}, False)
+                    break
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except RequestError as error:
+                    status, payload = error.status, {'error': error.message}
+                except Exception:
+                    print(''.join(['Error serving ', method, ' ', target]),
+                          file=sys.stderr)
+                    traceback.print_exc()
+                    status, payload = 500, {'error': 'internal server error'}
+                keep_alive = version == 'HTTP/1.1' and \
+                    headers.get('connection', '').lower() != 'close'
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def flush(self):
+        '''
+        Write the answers of all the users since the last flush
+        '''
+        with self.flush_lock:
+            for session in list(self.sessions.values()):
+                session.practice.store.flush()
+
+    async def flush_forever(self):
+        '''
+        Flush every flush_interval seconds on a worker thread, the requests
+        being served meanwhile
+        '''
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except Exception:
+                print('Error flushing the histories', file=sys.stderr)
+                traceback.print_exc()
+
+    def close(self):
+        '''
+        Save the histories of all the users, then the conjugation cache
+        once, after the flush running if any
+        '''
+        with self.flush_lock:
+            for session in self.sessions.values():
+                session.practice.close(save_cache=False)
+            jvp.conjugation_cache.save()
+
+    async def serve(self, host, port, ready=None):
+        '''
+        Serve until SIGINT or SIGTERM, then save the histories of all users
+        '''
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, stop.cancel)
+            except (NotImplementedError, RuntimeError):
+                pass
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        flusher = asyncio.ensure_future(self.flush_forever())
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await stop
+        except asyncio.CancelledError:
+            pass
+        finally:
+            flusher.cancel()
+            self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Japanese verb quiz server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--history-dir', default='histories',
+                        help='directory of the practice histories of the users')
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help='seconds between two writes of the histories')
+    parser.add_argument('--lenient', action='store_true',
+                        help='record near misses without the penalty of a '
+                             'wrong answer streak')
+    parser.add_argument('--instrument', action='store_true',
+                        help='time the phases of the quizzes, served on /metrics')
+    args = parser.parse_args()
+    if args.instrument:
+        jvp.instrumentation.enable()
+    quiz_server = QuizServer(args.history_dir, args.flush_interval,
+                             lenient_near_miss=args.lenient)
+    try:
+        asyncio.run(quiz_server.serve(
+            args.host, args.port,
+            lambda server: print('Serving on', args.host, args.port)))
+    except KeyboardInterrupt:
+        pass
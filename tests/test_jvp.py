@@ -3,7 +3,41 @@
 
 from nose.tools import *
 from ..jvp import *
+from .. import jvp
 from random import uniform, seed
+import contextlib
+import os
+import shutil
+import tempfile
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+
+@contextlib.contextmanager
+def temporary_dir(libs=True):
+    '''
+    Work in a new temporary directory, with a copy of the verb libs, and
+    remove it at the end of the block
+    '''
+    temp_dir = tempfile.mkdtemp()
+    if libs:
+        for lib in ('Japanese_verb_base.jvp', 'Japanese_verb_form.jvp'):
+            shutil.copy(os.path.join(test_dir, lib), temp_dir)
+    cwd = os.getcwd()
+    os.chdir(temp_dir)
+    try:
+        yield temp_dir
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+@contextlib.contextmanager
+def new_practice(store=None):
+    '''
+    Set up a Practice with a new practice history in a temporary directory,
+    and work in that directory until the end of the block
+    '''
+    with temporary_dir() as temp_dir:
+        yield Practice(store), temp_dir
 
 def hiragana_change_vowel_test():
     '''
@@ -26,6 +60,24 @@ def hiragana_change_vowel_test():
     hira.change_vowel('o')
     assert_equal(hira.hiragana, 'こ')
 
+def hiragana_ambiguous_row_test():
+    '''
+    Test that い, う, え belong to the あ row, and katakana keep their script
+    '''
+    hira = Hiragana('う')
+    hira.get_consonant()
+    assert_equal(hira.consonant, 'a')
+    hira.change_vowel('a')
+    assert_equal(hira.hiragana, 'あ')
+
+    kata = Hiragana('カ')
+    kata.get_vowel()
+    assert_equal(kata.vowel, 'あ')
+    kata.change_vowel('i')
+    assert_equal(kata.hiragana, 'キ')
+
+    assert_raises(ValueError, Hiragana('ん').get_vowel)
+
 def get_verb_type_test():
     '''
     Calculate the type of verb
@@ -52,15 +104,15 @@ def verb_trun_to_masu_test():
     '''
     verb1 = Verb('かく', '書く', 'ます')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書きます', 'かきます'])
+    assert_equal(verb1.right_answer, ('書きます', 'かきます'))
 
     verb2 = Verb('みる', '見る', 'ます')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見ます', 'みます'])
+    assert_equal(verb2.right_answer, ('見ます', 'みます'))
 
     verb3 = Verb('くる', '来る', 'ます')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来ます', 'きます'])
+    assert_equal(verb3.right_answer, ('来ます', 'きます'))
 
 def verb_turn_to_te_test():
     '''
@@ -68,15 +120,15 @@ def verb_turn_to_te_test():
     '''
     verb1 = Verb('かく', '書く', 'て')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書いて', 'かいて'])
+    assert_equal(verb1.right_answer, ('書いて', 'かいて'))
 
     verb2 = Verb('みる', '見る', 'て')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見て', 'みて'])
+    assert_equal(verb2.right_answer, ('見て', 'みて'))
 
     verb3 = Verb('くる', '来る', 'て')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来て', 'きて'])
+    assert_equal(verb3.right_answer, ('来て', 'きて'))
 
 def verb_turn_to_ta_test():
     '''
@@ -84,15 +136,15 @@ def verb_turn_to_ta_test():
     '''
     verb1 = Verb('かく', '書く', 'た')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書いた', 'かいた'])
+    assert_equal(verb1.right_answer, ('書いた', 'かいた'))
 
     verb2 = Verb('みる', '見る', 'た')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見た', 'みた'])
+    assert_equal(verb2.right_answer, ('見た', 'みた'))
 
     verb3 = Verb('くる', '来る', 'た')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来た', 'きた'])
+    assert_equal(verb3.right_answer, ('来た', 'きた'))
 
 def verb_turn_to_nai_test():
     '''
@@ -100,23 +152,23 @@ def verb_turn_to_nai_test():
     '''
     verb1 = Verb('かく', '書く', 'ない')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書かない', 'かかない'])
+    assert_equal(verb1.right_answer, ('書かない', 'かかない'))
 
     verb1_2 = Verb('ある', 'None', 'ない')
     verb1_2.get_right_answer()
-    assert_equal(verb1_2.right_answer, ['ない'])
+    assert_equal(verb1_2.right_answer, ('ない',))
 
     verb11 = Verb('うたう', '歌う', 'ない')
     verb11.get_right_answer()
-    assert_equal(verb11.right_answer, ['歌わない', 'うたわない'])
+    assert_equal(verb11.right_answer, ('歌わない', 'うたわない'))
 
     verb2 = Verb('みる', '見る', 'ない')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見ない', 'みない'])
+    assert_equal(verb2.right_answer, ('見ない', 'みない'))
 
     verb3 = Verb('くる', '来る', 'ない')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来ない', 'こない'])
+    assert_equal(verb3.right_answer, ('来ない', 'こない'))
 
 def turn_to_yizhi_test():
     '''
@@ -124,15 +176,15 @@ def turn_to_yizhi_test():
     '''
     verb1 = Verb('かく', '書く', '意志')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書こう', 'かこう'])
+    assert_equal(verb1.right_answer, ('書こう', 'かこう'))
 
     verb2 = Verb('みる', '見る', '意志')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見よう', 'みよう'])
+    assert_equal(verb2.right_answer, ('見よう', 'みよう'))
 
     verb3 = Verb('くる', '来る', '意志')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来よう', 'こよう'])
+    assert_equal(verb3.right_answer, ('来よう', 'こよう'))
 
 def turn_to_mingling_test():
     '''
@@ -140,15 +192,15 @@ def turn_to_mingling_test():
     '''
     verb1 = Verb('かく', '書く', '命令')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書け', 'かけ'])
+    assert_equal(verb1.right_answer, ('書け', 'かけ'))
 
     verb2 = Verb('みる', '見る', '命令')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['見ろ', 'みろ'])
+    assert_equal(verb2.right_answer, ('見ろ', 'みろ'))
 
     verb3 = Verb('くる', '来る', '命令')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来い', 'こい'])
+    assert_equal(verb3.right_answer, ('来い', 'こい'))
 
 
 def turn_to_jiading_test():
@@ -157,15 +209,15 @@ def turn_to_jiading_test():
     '''
     verb1 = Verb('かく', '書く', '假定')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書けば', 'かけば'])
+    assert_equal(verb1.right_answer, ('書けば', 'かけば'))
 
     verb2 = Verb('たべる', '食べる', '假定')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['食べれば', 'たべれば'])
+    assert_equal(verb2.right_answer, ('食べれば', 'たべれば'))
 
     verb3 = Verb('くる', '来る', '假定')
     verb3.get_right_answer()
-    assert_equal(verb3.right_answer, ['来れば', 'くれば'])
+    assert_equal(verb3.right_answer, ('来れば', 'くれば'))
 
 def turn_to_keneng_test():
     '''
@@ -173,19 +225,19 @@ def turn_to_keneng_test():
     '''
     verb1 = Verb('かく', '書く', '可能')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書ける', 'かける'])
+    assert_equal(verb1.right_answer, ('書ける', 'かける'))
 
     verb2 = Verb('たべる', '食べる', '可能')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['食べられる', 'たべられる'])
+    assert_equal(verb2.right_answer, ('食べられる', 'たべられる'))
 
     verb3_k = Verb('くる', '来る', '可能')
     verb3_k.get_right_answer()
-    assert_equal(verb3_k.right_answer, ['来られる', 'こられる'])
+    assert_equal(verb3_k.right_answer, ('来られる', 'こられる'))
 
     verb3_s = Verb('する', 'None', '可能')
     verb3_s.get_right_answer()
-    assert_equal(verb3_s.right_answer, ['できる'])
+    assert_equal(verb3_s.right_answer, ('できる',))
 
 def turn_to_shiyi_test():
     '''
@@ -193,19 +245,19 @@ def turn_to_shiyi_test():
     '''
     verb1 = Verb('かく', '書く', '使役')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書かせる', 'かかせる'])
+    assert_equal(verb1.right_answer, ('書かせる', 'かかせる'))
 
     verb2 = Verb('たべる', '食べる', '使役')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['食べさせる', 'たべさせる'])
+    assert_equal(verb2.right_answer, ('食べさせる', 'たべさせる'))
 
     verb3_k = Verb('くる', '来る', '使役')
     verb3_k.get_right_answer()
-    assert_equal(verb3_k.right_answer, ['来させる', 'こさせる'])
+    assert_equal(verb3_k.right_answer, ('来させる', 'こさせる'))
 
     verb3_s = Verb('する', 'None', '使役')
     verb3_s.get_right_answer()
-    assert_equal(verb3_s.right_answer, ['させる'])
+    assert_equal(verb3_s.right_answer, ('させる',))
 
 def turn_to_beidong_test():
     '''
@@ -213,19 +265,19 @@ def turn_to_beidong_test():
     '''
     verb1 = Verb('かく', '書く', '被动')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書かれる', 'かかれる'])
+    assert_equal(verb1.right_answer, ('書かれる', 'かかれる'))
 
     verb2 = Verb('たべる', '食べる', '被动')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['食べられる', 'たべられる'])
+    assert_equal(verb2.right_answer, ('食べられる', 'たべられる'))
 
     verb3_k = Verb('くる', '来る', '被动')
     verb3_k.get_right_answer()
-    assert_equal(verb3_k.right_answer, ['来られる', 'こられる'])
+    assert_equal(verb3_k.right_answer, ('来られる', 'こられる'))
 
     verb3_s = Verb('する', 'None', '被动')
     verb3_s.get_right_answer()
-    assert_equal(verb3_s.right_answer, ['される'])
+    assert_equal(verb3_s.right_answer, ('される',))
 
 def turn_to_shiyibeidong_test():
     '''
@@ -233,19 +285,19 @@ def turn_to_shiyibeidong_test():
     '''
     verb1 = Verb('かく', '書く', '使役被动')
     verb1.get_right_answer()
-    assert_equal(verb1.right_answer, ['書かされる', 'かかされる'])
+    assert_equal(verb1.right_answer, ('書かされる', 'かかされる'))
 
     verb2 = Verb('たべる', '食べる', '使役被动')
     verb2.get_right_answer()
-    assert_equal(verb2.right_answer, ['食べさせられる', 'たべさせられる'])
+    assert_equal(verb2.right_answer, ('食べさせられる', 'たべさせられる'))
 
     verb3_k = Verb('くる', '来る', '使役被动')
     verb3_k.get_right_answer()
-    assert_equal(verb3_k.right_answer, ['来させられる', 'こさせられる'])
+    assert_equal(verb3_k.right_answer, ('来させられる', 'こさせられる'))
 
     verb3_s = Verb('する', 'None', '使役被动')
     verb3_s.get_right_answer()
-    assert_equal(verb3_s.right_answer, ['させられる'])
+    assert_equal(verb3_s.right_answer, ('させられる',))
 
 
 def test_alias_table():
@@ -285,3 +337,1032 @@ def find_verb_in_practice_history_test():
     index = p.find_verb_in_practice_history(verb3)
     assert(index >= 0)
 
+
+def conjugate_table_test():
+    '''
+    Test that the batched conjugation gives the same answers as Verb
+    '''
+    bases = ['かく', 'みる', 'くる', 'する', 'ある', 'いく', 'きる', 'かう']
+    kanjis = ['書く', '見る', '来る', 'None', 'None', '行く', '切る', '買う']
+    forms = ['ます', 'て', 'ない', '使役被动']
+    table = conjugate_table(bases, kanjis, forms)
+    assert_equal(len(table), len(bases) * len(forms))
+    for i in range(len(bases)):
+        for j, form in enumerate(forms):
+            verb = Verb(bases[i], kanjis[i], form)
+            verb.get_right_answer()
+            row = table[i*len(forms) + j]
+            assert_equal(row[:3], (verb.verb_base, verb.verb_kanji, form))
+            assert_equal(row[3], verb.right_answer)
+
+def conjugation_cache_test():
+    '''
+    Test the LRU eviction, the counters and the persistence of the cache
+    '''
+    cache = ConjugationCache(maxsize=2)
+    cache.put(('かく', '書く', 'ます'), (1, ('書きます', 'かきます')))
+    cache.put(('みる', '見る', 'ます'), (2, ('見ます', 'みます')))
+    assert_equal(cache.get(('かく', '書く', 'ます'))[0], 1)
+    cache.put(('くる', '来る', 'ます'), (3, ('来ます', 'きます')))
+    assert_equal(cache.get(('みる', '見る', 'ます')), None)
+    assert_equal(cache.stats()['hits'], 1)
+    assert_equal(cache.stats()['misses'], 1)
+
+    with temporary_dir(libs=False):
+        path = 'conjugation_cache.json'
+        cache.save(path)
+        loaded = ConjugationCache(maxsize=2)
+        loaded.load(path)
+        assert_equal(list(loaded.entries), list(cache.entries))
+        # a path already loaded is not loaded again
+        loaded.get(list(cache.entries)[0])
+        loaded.load(path)
+        assert_equal(list(loaded.entries), list(cache.entries)[::-1])
+
+        # changing the special v1 verbs changes the rules version
+        old_speacial_v1 = jvp.speacial_v1
+        jvp.speacial_v1 = old_speacial_v1 + ('散る',)
+        try:
+            assert_equal(cache.get(('かく', '書く', 'ます')), None)
+            stale = ConjugationCache(maxsize=2)
+            stale.load(path)
+            assert_equal(len(stale), 0)
+        finally:
+            jvp.speacial_v1 = old_speacial_v1
+
+def get_right_answer_cached_test():
+    '''
+    Test that a cached answer is the same as the calculated one
+    '''
+    verb1 = Verb('はしる', '走る', 'ない')
+    verb1.get_right_answer()
+    verb2 = Verb('はしる', '走る', 'ない')
+    verb2.get_right_answer()
+    assert_equal(verb2.right_answer, ('走らない', 'はしらない'))
+    assert_equal(verb2.verb_type, 1)
+
+def weight_tree_test():
+    '''
+    Test the weighted sample and the weight update of WeightTree
+    '''
+    seed(1953)
+    tree = WeightTree([1.0, 2.0, 7.0])
+    assert_equal(tree.total(), 10.0)
+    assert_equal(tree.find(0.5), 0)
+    assert_equal(tree.find(2.5), 1)
+    assert_equal(tree.find(9.9), 2)
+    tree.update(2, 0.0)
+    assert_equal(tree.total(), 3.0)
+    num_samples = 30000
+    tally = [0, 0, 0]
+    for i in range(num_samples):
+        tally[tree.sample()] += 1
+    assert_equal(tally[2], 0)
+    assert(abs(tally[1] / float(num_samples) - 2.0 / 3) < 0.02)
+
+def practice_record_weight_tree_test():
+    '''
+    Test that record keeps the weight tree in step with relative_weight
+    '''
+    verb = Verb('かく', '書く', 'ます')
+    verb.error_flag = True
+    with new_practice() as (p, temp_dir):
+        p.record(verb)
+    index = p.find_verb_in_practice_history(verb)
+    assert_equal(p.weight_tree.weights[index],
+                 p.practice_history['relative_weight'][index])
+    assert(abs(p.weight_tree.total() -
+               sum(p.practice_history['relative_weight'])) < 1e-9)
+
+def numpy_alias_table_test():
+    '''
+    Test that NumpyAliasTable keeps the mass of every entry, samples in the
+    ratios of the PDF, and repeats itself with the same seed
+    '''
+    pdf = np.array([0.1, 0.2, 0.7, 0.0, 0.5, 1.5])
+    at = NumpyAliasTable(pdf, np.random.default_rng(1953))
+    mass = at.prob.copy()
+    np.add.at(mass, at.alias, 1 - at.prob)
+    assert(np.allclose(mass, pdf * len(pdf) / pdf.sum()))
+
+    num_samples = 200000
+    tally = np.bincount(at.sample(num_samples), minlength=len(pdf))
+    expected = pdf / pdf.sum()
+    assert_equal(tally[3], 0)
+    for i in (0, 1, 2, 4, 5):
+        assert(abs(tally[i] / float(num_samples) - expected[i]) / expected[i] < 0.05)
+
+    samples1 = biased_verb_samples(pdf, 100, np.random.default_rng(7))
+    samples2 = biased_verb_samples(pdf, 100, np.random.default_rng(7))
+    assert_equal(samples1.tolist(), samples2.tolist())
+
+def history_index_test():
+    '''
+    Test the index of the practice history and the duplicated verb check
+    '''
+    with new_practice() as (p, temp_dir):
+        pass
+    assert_equal(len(p.history_index), len(p.practice_history))
+    for verb_base, verb_kanji in (('とる', '撮る'), ('とる', 'None'),
+                                  ('ある', 'None')):
+        verb = Verb(verb_base, verb_kanji, 'ます')
+        index = p.find_verb_in_practice_history(verb)
+        assert_equal(p.practice_history['verb_base'][index], verb_base)
+        assert_equal(normalize_kanji(p.practice_history['verb_kanji'][index]),
+                     verb.verb_kanji)
+    assert_raises(ValueError, p.find_verb_in_practice_history,
+                  Verb('とる', '取る', 'ます'))
+    assert_raises(ValueError, p.add_to_history_index,
+                  len(p.practice_history), 'とる', None, 'ます')
+
+def history_journal_test():
+    '''
+    Test that recorded answers survive a restart through the journal,
+    and that closing folds the journal into the snapshot
+    '''
+    with new_practice() as (p, temp_dir):
+        verb = Verb('ある', 'None', 'ない')
+        verb.error_flag = True
+        p.record(verb)
+        p.record(verb)
+        assert(os.path.isfile('practice_history.csv.journal'))
+        assert(not os.path.isfile('practice_history.csv'))
+
+        p2 = Practice()
+        index = p2.find_verb_in_practice_history(verb)
+        assert_equal(p2.practice_history['error_time'][index], 2)
+        assert_equal(p2.practice_history['continue_error_time'][index], 2)
+        assert_equal(p2.weight_tree.weights[index],
+                     p.practice_history['relative_weight'][index])
+
+        p2.close()
+        assert(os.path.isfile('practice_history.csv'))
+        assert(not os.path.isfile('practice_history.csv.journal'))
+        p3 = Practice()
+        assert_equal(p3.practice_history['sample_time'][index], 2)
+
+def memmap_history_store_test():
+    '''
+    Test that the memmap store updates counters in place and maps them
+    back on the next start
+    '''
+    with new_practice(MemmapHistoryStore()) as (p, temp_dir):
+        verb = Verb('とる', 'None', '命令')
+        verb.error_flag = True
+        p.record(verb)
+        index = p.find_verb_in_practice_history(verb)
+        weight = p.practice_history['relative_weight'][index]
+
+        p2 = Practice(MemmapHistoryStore())
+        assert(isinstance(p2.store.columns['error_time'], np.memmap))
+        # a new and a loaded practice history work on the maps
+        for practice in (p, p2):
+            for column in history_columns[3:]:
+                assert(np.shares_memory(practice.practice_history.view(column),
+                                        practice.store.columns[column]))
+        assert_equal(p2.find_verb_in_practice_history(verb), index)
+        assert_equal(p2.practice_history['error_time'][index], 1)
+        assert_equal(p2.practice_history['relative_weight'][index], weight)
+        assert_equal(normalize_kanji(
+            p2.practice_history['verb_kanji'][index]), None)
+
+        p2.store.export_csv(p2.practice_history, 'exported.csv')
+        exported = CsvHistoryStore('exported.csv').load()
+        assert_equal(exported['error_time'][index], 1)
+
+        # a save stopped by a crash is finished or undone on load
+        path = p2.store.path
+        p2.close()
+        shutil.copytree(path, path + '.tmp')
+        for complete in (False, True):
+            os.rename(path, path + '.old')
+            open(os.path.join(path + '.tmp', 'new'), 'w').close()
+            if not complete:
+                os.remove(os.path.join(path + '.tmp', 'strings.json'))
+            assert_equal(MemmapHistoryStore().load()['error_time'][index], 1)
+            # the new directory is kept only if it was written to the end
+            assert_equal(os.path.exists(os.path.join(path, 'new')), complete)
+            assert(not os.path.exists(path + '.old'))
+            assert(not os.path.exists(path + '.tmp'))
+            shutil.copytree(path, path + '.tmp')
+        os.makedirs(path + '.old')
+        assert_equal(MemmapHistoryStore().load()['error_time'][index], 1)
+        assert_equal(sorted(name for name in os.listdir('.')
+                            if name.startswith(path)),
+                     [path])
+
+def sqlite_history_store_test():
+    '''
+    Test that two practices sharing one SQLite history keep each other's
+    answers
+    '''
+    with new_practice(SqliteHistoryStore(batch_size=2)) as (p1, temp_dir):
+        p2 = Practice(SqliteHistoryStore(batch_size=2))
+        verb1 = Verb('かく', '書く', 'て')
+        verb1.error_flag = True
+        verb2 = Verb('する', 'None', '可能')
+        p1.record(verb1)
+        p2.record(verb2)
+        p1.close()
+        p2.close()
+
+        store = SqliteHistoryStore()
+        p3 = Practice(store)
+        index1 = p3.find_verb_in_practice_history(verb1)
+        index2 = p3.find_verb_in_practice_history(verb2)
+        assert_equal(p3.practice_history['error_time'][index1], 1)
+        assert_equal(p3.practice_history['right_time'][index2], 1)
+        assert_equal(len(p3.practice_history), len(p1.practice_history))
+
+        rows = store.rows_for_form('可能')
+        assert_equal(set(rows['verb_form']), set(['可能']))
+        assert_equal(len(rows), len(p3.verbs_base_avail))
+        plan = store.connect().execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM practice_history '
+            'WHERE verb_form = ?', ('可能',)).fetchall()
+        assert('practice_history_form' in str(plan))
+        store.close(p3.practice_history)
+
+def record_in_process(barrier, user_answers):
+    '''
+    Answer かく in the ます form in a practice on the shared SQLite history
+    of the current directory, once every process has loaded it
+    '''
+    p = Practice(SqliteHistoryStore(batch_size=100))
+    barrier.wait()
+    for user_answer in user_answers:
+        quiz = Verb('かく', '書く', 'ます')
+        quiz.get_right_answer()
+        p.submit(quiz, user_answer)
+    p.close()
+
+def sqlite_history_store_processes_test():
+    '''
+    Test that two processes answering the same verb on one SQLite history
+    keep all the answers
+    '''
+    import multiprocessing
+    with new_practice(SqliteHistoryStore()) as (p, temp_dir):
+        p.close()
+        barrier = multiprocessing.Barrier(2)
+        processes = [multiprocessing.Process(target=record_in_process,
+                                             args=(barrier, user_answers))
+                     for user_answers in (['x', 'y', 'z'],
+                                          ['かきます', '書きます'])]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        assert_equal([process.exitcode for process in processes], [0, 0])
+        p2 = Practice(SqliteHistoryStore())
+        index = p2.find_verb_in_practice_history(Verb('かく', '書く', 'ます'))
+        row = p2.practice_history.row(index, counter_columns)
+        assert_equal(row[:3], [5, 3, 2])
+        assert_equal(p2.practice_history['relative_weight'][index],
+                     relative_weight_of(row))
+        p2.close()
+
+def reconcile_practice_history_test():
+    '''
+    Test that verbs and forms added to or removed from the libs are added
+    to or dropped from the practice history, keeping the other rows
+    '''
+    verb = Verb('かく', '書く', 'て')
+    verb.error_flag = True
+    with new_practice() as (p, temp_dir):
+        assert_equal(p.reconcile_report['added_rows'], len(p.practice_history))
+        p.record(verb)
+        p.close()
+        with open('Japanese_verb_base.jvp', encoding='utf-8') as f:
+            lines = [line for line in f if not line.startswith('あう')]
+        lines.append('おどる\t踊る\n')
+        with open('Japanese_verb_base.jvp', 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        with open('Japanese_verb_form.jvp', encoding='utf-8') as f:
+            forms = [line for line in f if line.strip() != '命令']
+        with open('Japanese_verb_form.jvp', 'w', encoding='utf-8') as f:
+            f.writelines(forms)
+        p2 = Practice()
+    report = p2.reconcile_report
+    assert_equal(report['added_verbs'], [('おどる', '踊る')])
+    assert_equal(report['removed_verbs'], [('あう', '会う')])
+    assert_equal(report['removed_forms'], ['命令'])
+    assert_equal(report['added_forms'], [])
+    assert_equal(report['added_rows'], len(forms))
+    assert_equal(len(p2.practice_history),
+                 len(p2.verbs_base_avail) * len(p2.verbs_form_avail))
+    assert_equal(len(p2.history_index), len(p2.practice_history))
+    index = p2.find_verb_in_practice_history(verb)
+    assert_equal(p2.practice_history['error_time'][index], 1)
+    new_verb = Verb('おどる', '踊る', 'て')
+    index = p2.find_verb_in_practice_history(new_verb)
+    assert_equal(p2.practice_history['relative_weight'][index], 3.0)
+    assert_raises(ValueError, p2.find_verb_in_practice_history,
+                  Verb('かく', '書く', '命令'))
+
+def startup_budget_test():
+    '''
+    Test that neither importing jvp nor asking the first question imports
+    numpy or pandas, and the shape of the startup report. The timings are
+    checked against the budget by the exit code of --startup-report
+    '''
+    import subprocess
+    import sys
+    package_dir = os.path.dirname(test_dir)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = package_dir
+    modules = 'print(sorted(set(["numpy", "pandas"]) & set(sys.modules)))'
+    with temporary_dir():
+        for code in ['import sys; import jvp; ' + modules,
+                     'import sys; import jvp; '
+                     'jvp.Practice().sample_verb().get_right_answer(); '
+                     + modules]:
+            output = subprocess.check_output([sys.executable, '-c', code],
+                                             env=env, universal_newlines=True)
+            assert_equal(output.strip(), '[]')
+        report = jvp.startup_report()
+    assert_equal(sorted(report['budget']), ['first_question_ms', 'import_ms'])
+    assert_equal(report['within_budget'], not report['over_budget'])
+    assert(report['modules'])
+
+def bench_jvp_test():
+    '''
+    Smoke test of the benchmark suite on small synthetic lexicons
+    '''
+    import json
+    import subprocess
+    import sys
+    with temporary_dir(libs=False) as temp_dir:
+        output = os.path.join(temp_dir, 'bench.json')
+        subprocess.check_call(
+            [sys.executable, 'bench_jvp.py', '--sizes', '50', '100',
+             '--calls', '20', '--output', output, '--max-growth', '1000'],
+            cwd=os.path.dirname(test_dir))
+        with open(output, encoding='utf-8') as f:
+            report = json.load(f)
+    assert_equal(sorted(report['results']), ['100', '50'])
+    assert_equal(sorted(report['results']['50']),
+                 ['find_verb_in_practice_history', 'get_right_answer',
+                  'load_practice_history', 'new_practice_history', 'record',
+                  'sample_verb'])
+
+def quiz_server_load_test():
+    '''
+    Test the quiz server end to end with a small load test
+    '''
+    import json
+    import socket
+    import subprocess
+    import sys
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    output = subprocess.check_output(
+        [sys.executable, 'jvp_loadtest.py', '--spawn', '--port', str(port),
+         '--users', '3', '--quizzes', '5'],
+        cwd=os.path.dirname(test_dir), universal_newlines=True)
+    report = json.loads(output)
+    assert_equal(report['requests'], 3 * (2 * 5 + 1))
+    assert(report['requests_per_second'] > 0)
+    assert(report['p99_ms'] >= report['p50_ms'])
+
+def quiz_server_sessions_test():
+    '''
+    Test that the sessions of the quiz server are loaded once per user on
+    a worker thread, share the lexicon and the reverse index, and that
+    closing the server saves the conjugation cache once
+    '''
+    import subprocess
+    import sys
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(test_dir)
+    code = '''
+import asyncio, threading, jvp, jvp_server
+server = jvp_server.QuizServer('histories')
+threads = set()
+new_session = server.new_session
+def record_thread(user):
+    threads.add(threading.current_thread())
+    return new_session(user)
+server.new_session = record_thread
+async def main():
+    return await asyncio.gather(server.session('a'), server.session('a'),
+                                server.session('b'))
+a1, a2, b = asyncio.run(main())
+print(a1 is a2, a1 is not b, threading.main_thread() not in threads)
+print(a1.practice.lexicon is b.practice.lexicon is server.lexicon,
+      a1.practice.reverse_index is b.practice.reverse_index)
+saves = []
+save = jvp.conjugation_cache.save
+jvp.conjugation_cache.save = lambda *args: saves.append(save(*args))
+server.close()
+print(len(saves), sorted(__import__('os').listdir('histories')))
+'''
+    with temporary_dir():
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         env=env, universal_newlines=True)
+    assert_equal(output.split('\n')[:3],
+                 ['True True True', 'True True', "1 ['a.csv', 'b.csv']"])
+
+def quiz_server_errors_test():
+    '''
+    Test that the quiz server answers a malformed request with a 400, an
+    error loading a history with a 500 logged on stderr, and keeps serving
+    '''
+    import subprocess
+    import sys
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(test_dir)
+    code = '''
+import asyncio, json, os, signal, jvp_server
+async def ask(port, request):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(request)
+    response = await reader.read()
+    writer.close()
+    return response.split(b' ')[1].decode(), response.split(b'\\r\\n\\r\\n')[1]
+async def client(port):
+    for request in [b'GET /quiz?user=broken HTTP/1.1\\r\\nConnection: close\\r\\n\\r\\n',
+                    b'garbage\\r\\n\\r\\n',
+                    b'GET /stats?user=a HTTP/1.1\\r\\nContent-Length: x\\r\\n\\r\\n',
+                    b'GET /quiz?user=a HTTP/1.1\\r\\nConnection: close\\r\\n\\r\\n']:
+        status, body = await ask(port, request)
+        print(status, json.loads(body.decode()).get('error'))
+    os.kill(os.getpid(), signal.SIGINT)
+os.makedirs('histories')
+with open(os.path.join('histories', 'broken.csv'), 'w') as f:
+    f.write(',verb_base,verb_kanji,verb_form,sample_time\\n0,かく,書く,ます,x\\n')
+server = jvp_server.QuizServer('histories')
+clients = []
+asyncio.run(server.serve('127.0.0.1', 0, lambda s: clients.append(
+    asyncio.ensure_future(client(s.sockets[0].getsockname()[1])))))
+'''
+    with temporary_dir():
+        result = subprocess.run([sys.executable, '-c', code], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+    assert_equal(result.stdout.split('\n')[:4],
+                 ['500 internal server error', '400 malformed request',
+                  '400 malformed request', '200 None'])
+    assert('Error serving GET /quiz?user=broken' in result.stderr)
+    assert('ValueError' in result.stderr)
+
+def grade_answers_test():
+    '''
+    Test that batch grading gives the answers of check_answer, and the
+    counters of recording the answers one by one
+    '''
+    import csv
+    import json
+    answers = [('かく', '書く', 'ます', '書きます'),
+               ('かく', '書く', 'ます', 'かくます'),
+               ('かく', None, 'て', 'かいて'),
+               ('ある', None, 'ない', 'ない'),
+               ('かく', '書く', 'ます', 'かきます'),
+               ('およぐ', '泳ぐ', '未知', 'およぐ'),
+               ('はしる', '走る', 'て', 'はしって'),
+               ('かく', '書く', 'ます', 'かく')]
+    # the same due times for both
+    clock = lambda: 1000.0
+    with new_practice() as (p1, temp_dir):
+        p1.clock = clock
+        with open('answers.csv', 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(jvp.answer_columns)
+            for row in answers:
+                writer.writerow([row[0], row[1] or 'None', row[2], row[3]])
+        summary = grade_answer_file('answers.csv', 'graded.csv', p1,
+                                    processes=2, chunk_size=3)
+        with open('graded.csv', encoding='utf-8', newline='') as f:
+            graded = list(csv.reader(f))
+        with open('answers.jsonl', 'w', encoding='utf-8') as f:
+            for row in answers:
+                f.write(json.dumps(dict(zip(jvp.answer_columns, row)),
+                                   ensure_ascii=False) + '\n')
+            # malformed lines are graded invalid, not raised
+            f.write('{"verb_base": "かく", "verb_for\n')
+            f.write('{"verb_base": "かく", "user_answer": "かきます"}\n')
+            f.write('{"verb_form": "ます", "user_answer": "かきます"}\n')
+            f.write('["かく", "書く", "ます", "かきます"]\n')
+        summary_jsonl = grade_answer_file('answers.jsonl', 'graded.jsonl',
+                                          processes=1)
+        with open('graded.jsonl', encoding='utf-8') as f:
+            graded_jsonl = [json.loads(line) for line in f]
+    with new_practice() as (p2, temp_dir):
+        p2.clock = clock
+        for verb_base, verb_kanji, verb_form, user_answer in answers:
+            verb = Verb(verb_base, verb_kanji, verb_form)
+            if verb_form == '未知':
+                continue
+            verb.user_answer = user_answer
+            verb.get_right_answer()
+            verb.grade()
+            if verb.has_kanji and verb.verb_kanji == '走る':
+                continue
+            p2.record(verb)
+    assert_equal(summary, {'rows': 8, 'right': 5, 'wrong': 2, 'near_miss': 1,
+                           'invalid': 1, 'recorded': 6, 'skipped': 2})
+    assert_equal(summary_jsonl['rows'], 12)
+    assert_equal(summary_jsonl['invalid'], 5)
+    assert_equal(summary_jsonl['recorded'], 0)
+    assert_equal(graded[0], jvp.graded_columns)
+    assert_equal([row[4] for row in graded[1:]],
+                 ['True', 'False', 'True', 'True', 'True', '', 'True', 'False'])
+    assert_equal(graded[1][5], '書きます or かきます')
+    assert_equal([row['correct'] for row in graded_jsonl],
+                 [True, False, True, True, True, None, True, False] +
+                 [None] * 4)
+    for column in jvp.history_columns[3:]:
+        assert_equal(list(p1.practice_history[column]),
+                     list(p2.practice_history[column]))
+    assert(abs(p1.weight_tree.total() -
+               sum(p1.practice_history['relative_weight'])) < 1e-9)
+
+def iter_quizzes_submit_test():
+    '''
+    Test a session driven by iter_quizzes and submit, without the terminal
+    '''
+    with new_practice() as (p, temp_dir):
+        quizzes = list(p.iter_quizzes(3))
+        assert_equal(len(quizzes), 3)
+        quiz = quizzes[0]
+        assert(quiz.right_answer)
+        index = p.find_verb_in_practice_history(quiz)
+        sample_time = p.practice_history['sample_time'][index]
+        result = p.submit(quiz, quiz.right_answer[-1])
+        assert_equal(result.correct, True)
+        assert_equal(result.right_answer, tuple(quiz.right_answer))
+        result = p.submit(quiz, 'x')
+        assert_equal(result.correct, False)
+        assert_equal(result.user_answer, 'x')
+        assert_equal(p.practice_history['sample_time'][index],
+                     sample_time + 2)
+        assert_equal(p.practice_history['continue_error_time'][index], 1)
+        endless = p.iter_quizzes()
+        for i in range(5):
+            next(endless)
+
+def perform_quiz_pipelined_test():
+    '''
+    Test that a pipelined session records every answer, like a
+    sequential one
+    '''
+    answers = iter(['4', 'x', 'y', 'z', 'w', '3', 'x', 'y', 'z'])
+    get_input = jvp.get_input
+    jvp.get_input = lambda info: next(answers)
+    try:
+        for pipelined in (True, False):
+            with new_practice() as (p, temp_dir):
+                p.perform_quiz(pipelined)
+                p2 = Practice()
+            total = 4 if pipelined else 3
+            assert_equal(sum(p2.practice_history['sample_time']), total)
+            assert_equal(sum(p2.practice_history['error_time']), total)
+            assert_equal(list(p2.practice_history['relative_weight']),
+                         list(p.practice_history['relative_weight']))
+    finally:
+        jvp.get_input = get_input
+
+def compact_verb_test():
+    '''
+    Test that Verbs share their strings and answers, and that the session
+    log of Practice is bounded
+    '''
+    verb1 = Verb('かく', '書く', 'ます')
+    verb2 = Verb(''.join(['か', 'く']), '書く', 'ます')
+    assert(not hasattr(verb1, '__dict__'))
+    assert_equal(verb1.verb_id, verb2.verb_id)
+    assert_equal(verb1.form_id, verb2.form_id)
+    assert(verb1.verb_base is verb2.verb_base)
+    verb1.get_right_answer()
+    verb2.get_right_answer()
+    assert(verb1.right_answer is verb2.right_answer)
+    verb3 = Verb('ある', 'None', 'ない')
+    assert_equal(verb3.verb_kanji, None)
+    assert_equal(verb3.has_kanji, False)
+
+    with new_practice() as (p, temp_dir):
+        for quiz in p.iter_quizzes(p.verbs.maxlen + 50):
+            pass
+    assert_equal(len(p.verbs), p.verbs.maxlen)
+
+def conjugation_rules_test():
+    '''
+    Test that the conjugation rules are compiled on their first use, and
+    the irregular overrides
+    '''
+    conjugation_dispatch.clear()
+    for verb_form in read_form_lib(os.path.join(test_dir,
+                                                'Japanese_verb_form.jvp')):
+        assert(verb_form in conjugation_rules)
+    assert_equal(conjugate('かく', '書く', 'て', 1), ('書いて', 'かいて'))
+    assert_equal(list(conjugation_dispatch), [('て', 1, 'く')])
+    rule = conjugation_rule('て', 1, 'く')
+    assert(conjugation_dispatch[('て', 1, 'く')] is rule)
+    assert_equal(rule, compile_conjugation_rule('て', 1, 'く'))
+    conjugation_rule('ます', 2, 'る')
+    assert_equal(len(conjugation_dispatch), 2)
+    assert_equal(conjugate('いく', '行く', 'て', 1), ('行って', 'いって'))
+    assert_equal(conjugate('ゆく', '行く', 'た', 1), ('行った', 'ゆいた'))
+    assert_equal(conjugate('ある', '有る', 'ない', 1), ('ない',))
+    assert_equal(conjugate('かう', None, '使役', 1), ('かわせる',))
+    assert_equal(conjugate('する', '為る', 'ます', 3), ('為ます', 'します'))
+    assert_equal(conjugate('くる', None, 'て', 3), ('来て', 'きて'))
+    assert_raises(ValueError, conjugate, 'かく', '書く', '未知', 1)
+
+def reverse_conjugation_index_test():
+    '''
+    Test that every answer of the lexicon is found back, and the
+    diagnosis of wrong answers
+    '''
+    bases, kanjis = read_verb_lib(os.path.join(test_dir,
+                                               'Japanese_verb_base.jvp'))
+    forms = read_form_lib(os.path.join(test_dir, 'Japanese_verb_form.jvp'))
+    index = ReverseConjugationIndex(forms)
+    index.add_verbs(bases, kanjis)
+    for verb_base, verb_kanji, verb_form, right_answer in \
+            conjugate_table(bases, kanjis, forms):
+        verb = Verb(verb_base, verb_kanji, verb_form)
+        for answer in right_answer:
+            assert((verb.verb_id, verb.form_id) in index.lookup(answer))
+    assert_equal(index.lookup('ぬぬぬ'), [])
+
+    with new_practice() as (p, temp_dir):
+        quiz = Verb('たべる', '食べる', '可能')
+        quiz.get_right_answer()
+        result = p.submit(quiz, 'たべます')
+        assert_equal(result.diagnosis, [('たべる', '食べる', 'ます')])
+        assert_equal(diagnosis_message(quiz, result.diagnosis),
+                     'You gave the ます形 instead of the 可能态')
+        quiz = Verb('かく', '書く', 'ます')
+        quiz.get_right_answer()
+        result = p.submit(quiz, 'みます')
+        assert_equal(diagnosis_message(quiz, result.diagnosis),
+                     'You gave the ます形 of 見る (みる)')
+        result = p.submit(quiz, 'かきます')
+        assert_equal(result.diagnosis, [])
+
+        # one index for the practices of the same libs, until a lib changes
+        assert(Practice().reverse_index is p.reverse_index)
+        assert(Practice(reverse_index=index).reverse_index is index)
+        with open('Japanese_verb_form.jvp', 'a', encoding='utf-8') as f:
+            f.write('\n')
+        assert(Practice().reverse_index is not p.reverse_index)
+
+def near_miss_test():
+    '''
+    Test the bounded edit distance and the near miss of an answer
+    '''
+    assert_equal(bounded_levenshtein('かきます', 'かきます', 1), 0)
+    assert_equal(bounded_levenshtein('かきまう', 'かきます', 1), 1)
+    assert_equal(bounded_levenshtein('かきま', 'かきます', 1), 1)
+    assert_equal(bounded_levenshtein('かまきす', 'かきます', 1), 2)
+    assert_equal(bounded_levenshtein('かまきす', 'かきます', 2), 2)
+    assert_equal(bounded_levenshtein('たべられる', 'かきます', 2), 3)
+    right_answer = ('書きます', 'かきます')
+    assert_equal(classify_answer('書きます', right_answer), 'right')
+    assert_equal(classify_answer('書きまう', right_answer), 'near_miss')
+    assert_equal(classify_answer('書くます', right_answer), 'near_miss')
+    assert_equal(classify_answer('書かまう', right_answer), 'wrong')
+    assert_equal(classify_answer('書かまう', right_answer, 2), 'near_miss')
+    assert_equal(classify_answer('', right_answer), 'wrong')
+    assert_equal(classify_answer(None, right_answer), 'wrong')
+
+    # a lenient practice does not grow the wrong answer streak
+    for lenient in (False, True):
+        with new_practice() as (p, temp_dir):
+            p.lenient_near_miss = lenient
+            quiz = Verb('かく', '書く', 'ます')
+            quiz.get_right_answer()
+            result = p.submit(quiz, '書きまう')
+        assert_equal(result.correct, False)
+        assert_equal(result.near_miss, True)
+        index = p.find_verb_in_practice_history(quiz)
+        assert_equal(p.practice_history['error_time'][index], 1)
+        assert_equal(p.practice_history['continue_error_time'][index],
+                     0 if lenient else 1)
+
+def instrumentation_test():
+    '''
+    Test the phase histograms and their exports, and that disable puts the
+    original methods back
+    '''
+    record = Practice.record
+    version = rules_version()
+    instruments = jvp.Instrumentation()
+    with new_practice() as (p, temp_dir):
+        instruments.enable()
+        assert(Practice.record is not record)
+        assert_equal(rules_version(), version)
+        for quiz in p.iter_quizzes(5):
+            p.submit(quiz, 'x')
+        p.close()
+        instruments.disable()
+    assert(Practice.record is record)
+    report = instruments.report()
+    phases = report['phases']
+    assert_equal(phases['Practice.submit']['count'], 5)
+    assert_equal(phases['Practice.record']['count'], 5)
+    assert_equal(phases['Practice.sample_verb']['count'], 5)
+    assert_equal(sum(phases['Practice.submit']['buckets'].values()), 5)
+    assert(phases['Practice.submit']['p50'] <= phases['Practice.submit']['p99']
+           <= phases['Practice.submit']['max'])
+    assert_equal(json.loads(instruments.to_json())['phases']['Practice.record']
+                 ['count'], 5)
+    text = instruments.to_prometheus()
+    assert('jvp_phase_seconds_count{phase="Practice.submit"} 5\n' in text)
+    assert('jvp_phase_seconds_bucket{phase="Practice.submit",le="+Inf"} 5\n'
+           in text)
+    instruments.reset()
+    assert_equal(instruments.report()['phases'], {})
+
+def instrumentation_interrupted_test():
+    '''
+    Test that the report of an instrumented quiz is saved when the quiz
+    stops on an error, as the end of the input
+    '''
+    import json
+    import subprocess
+    import sys
+    with temporary_dir() as temp_dir:
+        result = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(test_dir), 'jvp.py'),
+             '--instrument', 'report.json'],
+            input='3\n', stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        assert(result.returncode != 0)
+        assert('EOFError' in result.stderr)
+        with open('report.json', encoding='utf-8') as f:
+            report = json.load(f)
+    assert('phases' in report)
+
+def weighting_test():
+    '''
+    Test the weighting strategies over whole columns and over one row,
+    that set_weighting recomputes the whole practice history, and that the
+    weighting is saved with it for the next practice of every store
+    '''
+    counters = (4, 2, 2, 1, 0)
+    assert_equal(relative_weight_of(counters), (1.0 + 12 + 10) / (1.0 + 4 + 2))
+    for weighting in weighting_strategies.values():
+        columns = [jvp.np.array([4, 0]), jvp.np.array([2, 0]),
+                   jvp.np.array([2, 0]), jvp.np.array([1, 0]),
+                   jvp.np.array([0, 0])]
+        weights = jvp.np.empty(2)
+        weights[:] = weighting(*columns)
+        assert_equal(weights[0], relative_weight_of(counters, weighting))
+    assert_raises(ValueError, weighting_of, 'unknown')
+
+    with new_practice() as (p, temp_dir):
+        quiz = Verb('かく', '書く', 'ます')
+        quiz.get_right_answer()
+        p.submit(quiz, 'x')
+        index = p.find_verb_in_practice_history(quiz)
+        p.set_weighting('unseen')
+        row = p.practice_history.row(index, counter_columns)
+        assert_equal(p.practice_history['relative_weight'][index],
+                     unseen_weighting(*row))
+        assert_equal(p.practice_history['relative_weight'][
+            0 if index else 1], 1.0)
+        assert(abs(p.weight_tree.total() -
+                   sum(p.practice_history['relative_weight'])) < 1e-9)
+        p.submit(quiz, 'x')
+        row = p.practice_history.row(index, counter_columns)
+        assert_equal(row[0], 2)
+        assert_equal(p.weight_tree.weights[index], unseen_weighting(*row))
+        p.close()
+        # the recomputed weights are saved
+        p2 = Practice()
+        assert_equal(list(p2.practice_history['relative_weight']),
+                     list(p.practice_history['relative_weight']))
+        p2.close()
+        p3 = Practice(weighting='uniform')
+        assert_equal(set(p3.practice_history['relative_weight']), set([1.0]))
+        assert_equal(p3.weight_tree.total(), float(len(p3.practice_history)))
+        p3.close()
+    for store_class in (CsvHistoryStore, MemmapHistoryStore,
+                        SqliteHistoryStore):
+        with new_practice(store_class()) as (p, temp_dir):
+            p.close()
+            p2 = Practice(store_class(), weighting='uniform')
+            p2.close()
+            p3 = Practice(store_class())
+            assert(p3.weighting is uniform_weighting)
+            quiz = Verb('かく', '書く', 'ます')
+            quiz.get_right_answer()
+            p3.submit(quiz, 'x')
+            p3.close()
+            p4 = Practice(store_class())
+            assert_equal(set(p4.practice_history['relative_weight']),
+                         set([1.0]))
+            p4.close()
+
+def scheduler_test():
+    '''
+    Test the SM-2 schedule, the due heap, and that a due verb is asked
+    before the weighted sample
+    '''
+    day = 86400.0
+    schedule = (0.0, 2.5, 0.0)
+    schedule = sm2_schedule(schedule, answer_quality(False), 0.0)
+    assert_equal(schedule, (day, 2.5, 1.0))
+    schedule = sm2_schedule(schedule, answer_quality(False), day)
+    assert_equal(schedule, (7 * day, 2.5, 6.0))
+    schedule = sm2_schedule(schedule, answer_quality(False), 7 * day)
+    assert_equal(schedule, (22 * day, 2.5, 15.0))
+    due_time, ease, interval_days = sm2_schedule(
+        schedule, answer_quality(True), 22 * day)
+    assert_equal((due_time, interval_days), (22 * day + jvp.relearn_seconds, 0.0))
+    assert(abs(ease - 1.96) < 1e-9)
+    assert_equal(answer_quality(True, True), 2)
+    assert_equal(answer_quality(True, True, True), 3)
+    assert_equal(sm2_schedule((0.0, 1.3, 0.0), 0, 0.0)[1], jvp.minimum_ease)
+
+    scheduler = Scheduler([0.0, 30.0, 10.0, 0.0])
+    assert_equal(len(scheduler), 2)
+    assert_equal(scheduler.pop_due(5.0), None)
+    scheduler.update(2, 50.0)
+    scheduler.update(3, 20.0)
+    assert_equal(scheduler.due_count(40.0), 2)
+    assert_equal(scheduler.peek_due(5.0), None)
+    assert_equal(scheduler.peek_due(40.0), 20.0)
+    assert_equal(scheduler.pop_due(40.0), 3)
+    assert_equal(scheduler.pop_due(40.0), 1)
+    # the stale entry of row 2 at 10.0 is dropped
+    assert_equal(scheduler.pop_due(40.0), None)
+    assert_equal(scheduler.pop_due(50.0), 2)
+    for i in range(200):
+        scheduler.update(0, 100.0 + i)
+    assert(len(scheduler.heap) <= 2 * len(scheduler) + 64)
+    # the rebuild takes back the rows taken but not answered
+    assert_equal([scheduler.pop_due(1000.0) for i in range(5)],
+                 [3, 1, 2, 0, None])
+    # a row released is due again, once, and a row not taken is not pushed
+    scheduler.release(1)
+    scheduler.release(1)
+    scheduler.update(3, 20.0)
+    scheduler.release(3)
+    assert_equal([scheduler.pop_due(1000.0) for i in range(3)], [3, 1, None])
+
+    now = [1000.0]
+    with new_practice() as (p, temp_dir):
+        p.clock = lambda: now[0]
+        quiz = Verb('かく', '書く', 'ます')
+        quiz.get_right_answer()
+        p.submit(quiz, 'x')
+        index = p.find_verb_in_practice_history(quiz)
+        assert_equal(p.practice_history['due_time'][index],
+                     1000.0 + jvp.relearn_seconds)
+        assert_equal(p.scheduler.pop_due(now[0]), None)
+        now[0] += jvp.relearn_seconds
+        verb = p.sample_verb()
+        assert_equal((verb.verb_base, verb.verb_kanji, verb.verb_form),
+                     ('かく', '書く', 'ます'))
+        p.close()
+        p2 = Practice()
+        assert_equal(p2.practice_history['due_time'][index],
+                     1000.0 + jvp.relearn_seconds)
+        assert_equal(len(p2.scheduler), 1)
+        p3 = Practice(scheduled=False)
+        assert_equal(p3.scheduler, None)
+
+def deck_session_test():
+    '''
+    Test that a session over decks keeps a practice history shard for each
+    deck, and reads only the decks it uses
+    '''
+    with open(os.path.join(test_dir, 'Japanese_verb_base.jvp'),
+              encoding='utf-8') as f:
+        lines = [line for line in f if line.strip()]
+    decks = {'n5': lines[:10], 'n4': lines[10:30], 'n3': lines[30:]}
+    answers = iter(['6', 'x', 'y', 'z', 'w', 'v', 'u'])
+    get_input = jvp.get_input
+    jvp.get_input = lambda info: next(answers)
+    try:
+        with temporary_dir(libs=False):
+            shutil.copy(os.path.join(test_dir, 'Japanese_verb_form.jvp'), '.')
+            for name, deck_lines in decks.items():
+                os.makedirs(os.path.join('decks', name))
+                with open(os.path.join('decks', name,
+                                       'Japanese_verb_base.jvp'), 'w',
+                          encoding='utf-8') as f:
+                    f.writelines(deck_lines)
+            assert_equal(list_decks(), ['n3', 'n4', 'n5'])
+            session = DeckSession(['n5', 'n4'])
+            assert_equal(list(session.practices.values()), [None, None])
+            session.perform_quiz()
+            assert_equal(session.pending, {})
+            assert('n3' not in session.practices)
+            assert(not os.path.isfile(os.path.join('decks', 'n3',
+                                                   'practice_history.csv')))
+            sample_time = 0
+            for name in ('n5', 'n4'):
+                practice = open_deck(name)
+                assert_equal(len(practice.practice_history),
+                             len(decks[name]) * len(practice.verbs_form_avail))
+                sample_time += sum(practice.practice_history['sample_time'])
+            assert_equal(sample_time, 6)
+            assert_raises(ValueError, open_deck, 'n1')
+            session = DeckSession(['n5'])
+            quiz = next(session.iter_quizzes())
+            result = session.submit(quiz, quiz.right_answer[0])
+            assert_equal(result.correct, True)
+            assert_raises(ValueError, session.submit, quiz, 'x')
+
+            # the verb due the longest comes first, whatever its deck
+            session = DeckSession(['n5', 'n4'])
+            for name, index, due_time in (('n5', 0, 500.0), ('n4', 1, 100.0)):
+                practice = session.practice(name)
+                practice.clock = lambda: 1000.0
+                practice.scheduler.update(index, due_time)
+            for name, index in (('n4', 1), ('n5', 0)):
+                quiz = session.sample_verb()
+                assert_equal(session.deck_of(quiz), name)
+                assert_equal(quiz.verb_base, session.practice(name).
+                             practice_history['verb_base'][index])
+
+            # a due quiz dropped from the pending quizzes is due again
+            session = DeckSession(['n5', 'n4'], max_pending=1)
+            for name, index, due_time in (('n5', 0, 500.0), ('n4', 1, 100.0)):
+                practice = session.practice(name)
+                practice.clock = lambda: 1000.0
+                practice.scheduler.update(index, due_time)
+            quizzes = [session.sample_verb() for i in range(3)]
+            assert_equal([quiz.verb_base for quiz in quizzes],
+                         [quizzes[0].verb_base, quizzes[1].verb_base,
+                          quizzes[0].verb_base])
+            assert_equal(session.deck_of(quizzes[2]), 'n4')
+    finally:
+        jvp.get_input = get_input
+
+def lexicon_test():
+    '''
+    Test that the lexicon loader reads every format, skips and reports the
+    bad lines, drops duplicates, and reads the cache until the verb lib
+    changes
+    '''
+    with temporary_dir(libs=False):
+        lines = ['verb_base,verb_kanji', 'かく,書く', 'する,None',
+                 'はしる,走る', 'かく,書く', 'カク,書く', 'かか,書か',
+                 'かく,書く,x', 'みる,見た', 'たべる']
+        csv_file = 'verbs.csv'
+        with open(csv_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        lexicon = load_lexicon(csv_file)
+        assert_equal(lexicon.verbs_base, ['かく', 'する', 'はしる', 'たべる'])
+        assert_equal(lexicon.verbs_kanji, ['書く', 'None', '走る', 'None'])
+        assert_equal(lexicon.verb_types, [1, 3, 1, 2])
+        assert_equal(lexicon.duplicates, 1)
+        assert_equal([error.line_number for error in lexicon.errors],
+                     [6, 7, 8, 9])
+        assert_equal(lexicon.errors[2].line, 'かく,書く,x')
+
+        jsonl_file = 'verbs.jsonl'
+        with open(jsonl_file, 'w', encoding='utf-8') as f:
+            f.write('{"verb_base": "かく", "verb_kanji": "書く"}\n')
+            f.write('{"verb_base": "くる"}\n')
+            f.write('{"verb_kanji": "書く"}\n')
+            f.write('not json\n')
+        lexicon = load_lexicon(jsonl_file)
+        assert_equal(lexicon.verbs_base, ['かく', 'くる'])
+        assert_equal(lexicon.verbs_kanji, ['書く', 'None'])
+        assert_equal(len(lexicon.errors), 2)
+
+        tsv_file = 'verbs.tsv'
+        with open(tsv_file, 'w', encoding='utf-8') as f:
+            f.write('verb_base\tverb_kanji\nかく\t書く\n')
+        assert_equal(load_lexicon(tsv_file).verbs_base, ['かく'])
+
+        # the second load reads the cache, a changed verb lib is parsed again
+        parse_lexicon = jvp.parse_lexicon
+        jvp.parse_lexicon = None
+        try:
+            assert_equal(load_lexicon(tsv_file).verbs_base, ['かく'])
+            with open(tsv_file, 'a', encoding='utf-8') as f:
+                f.write('みる\t見る\n')
+            assert_raises(TypeError, load_lexicon, tsv_file)
+        finally:
+            jvp.parse_lexicon = parse_lexicon
+        assert_equal(load_lexicon(tsv_file).verbs_base, ['かく', 'みる'])
+
+        # a truncated, corrupted or pickled cache is not run, parsed again
+        import pickle
+        class Crafted(object):
+            def __reduce__(self):
+                return os.mkdir, ('crafted',)
+        cache_file = tsv_file + '.lexcache'
+        with open(cache_file, 'rb') as f:
+            data = f.read()
+        # the errors are the last 2 bytes, [], after the verb types
+        for bad_data in (data[:-1], data[:20], data[:-3] + b'\x07' + data[-2:],
+                         pickle.dumps(Crafted())):
+            with open(cache_file, 'wb') as f:
+                f.write(bad_data)
+            assert_equal(load_lexicon(tsv_file).verbs_base, ['かく', 'みる'])
+            with open(cache_file, 'rb') as f:
+                assert_equal(f.read(), data)
+        assert(not os.path.exists('crafted'))
+    bases, kanjis = read_verb_lib(os.path.join(test_dir,
+                                               'Japanese_verb_base.jvp'))
+    assert_equal((bases[:2], kanjis[:2]), (['あう', 'あく'], ['会う', '開く']))